@@ -16,6 +16,14 @@ Requirements:
 Script usage:
     backup_analysis.py -q
     backup_analysis.py -q -f config_file
+    backup_analysis.py -q --format ndjson -o report.ndjson
+    backup_analysis.py -q --profile --cprofile
+    backup_analysis.py -q --push /shared/collect | --push collector:9099
+    backup_analysis.py -q --collect /shared/collect [--listen 0.0.0.0:9099]
+    backup_analysis.py -q --full
+    backup_analysis.py --plan
+    backup_analysis.py -q --record /tmp/rec | -v --replay /tmp/rec
+    backup_analysis.py -q --summary
     backup_analysis.py -v
 
 Changelog
@@ -30,20 +38,52 @@ Changelog
     3.20.0 - refactor to be used with python3
     3.21.0 - use oracledb instead of cx_Oracle, add dataguard status, add docker version check
     3.22.0 - add SGA and PGA size to report and database summary boxes
+    3.23.0 - compact html tables, section size budget with csv.gz attachments
+    3.24.0 - json/ndjson machine-readable report output
+    3.25.0 - --profile run timeline (chrome trace-event json), --cprofile
+    3.26.0 - fleet mode: --push results to collector, --collect consolidated report
+    3.27.0 - SQL registry loaded once per run, statement cache size, parse statistics
+    3.28.0 - multitenant: parallel per-PDB checks from oracle_pdbs map
+    3.29.0 - sizing_mode = fast (tablespace usage metrics), backup_benchmark.py
+    3.30.0 - statistics check from dba_tab_statistics with stale tables count
+    3.31.0 - logs_count_method: exact, stats, sample or incremental LOG_ZAPISY counts
+    3.32.0 - windowed redo switch query merged into local hourly histogram, p95 and trend
+    3.33.0 - per-check call_timeout, timed out checks reported and skipped
+    3.34.0 - connection retries with jittered backoff, circuit breaker, max_concurrency
+    3.35.0 - report_mode = delta: changed sections and new alerts only, weekly or --full report
+    3.36.0 - declarative check plan (DAG) with per-database overrides, check_parallelism, --plan
+    3.37.0 - spool_fragments: per-database fragments in temp files, email streamed from files
+    3.38.0 - queue-based logging (listener thread), log_rate_limit, db/check/elapsed log fields,
+             credentials redacted from logged config
+    3.39.0 - load-aware scheduling (load_aware): v$sysmetric host CPU / AAS, busy databases run
+             expensive checks serialized or delayed within run_deadline
+    3.40.0 - --record DIR saves raw result sets, --replay DIR rebuilds the report offline
+    3.41.0 - rman_catalog: full/arch backups of all DBIDs from one recovery catalog query
+    3.42.0 - render stage: database fragments rendered from plain results, render_workers processes
+    3.43.0 - datafile backup coverage: newest v$backup_datafile checkpoint per datafile, incremental
+    3.44.0 - archivelog coverage: sequence gaps, logs not backed up, oldest unprotected log per thread
+    3.45.0 - run_deadline (seconds or HH:MM) for the whole run: backup status and summary checks first,
+             report sent at the deadline with the rest marked not collected
+    3.46.0 - --summary: summary boxes and alerts only, email when the alert state changed
+    3.47.0 - python-oracledb Thin mode with wallet (config_dir, wallet_location), Thick mode only when needed
 
 """
 
-__ver__ = "3.22.0"
+__ver__ = "3.47.0"
 
 import os
 import sys
+import shutil
 import ctypes
+import time
 
 import datetime
 import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import logging.handlers
 import configparser
+import cProfile
 import warnings
 warnings.filterwarnings('ignore', message='.*cryptography', )
 
@@ -51,16 +91,39 @@ import texttable
 from jinja2 import Environment, FileSystemLoader
 from lib.utils import Utils
 from lib.database_tests import DatabaseTests
-from lib.database_usage import DatabaseUsage
+from lib.database_usage import DatabaseUsage, QueryError, DatabaseUnavailable
 from lib.email_creation import EmailCreation
+from lib.report_writer import ReportWriter
+from lib.tracing import Tracer
+from lib.fleet import FleetPusher, FleetCollector
+from lib.sql_registry import SqlRegistry
+from lib.report_delta import ReportDelta
+from lib.check_plan import CheckPlan
+from lib.report_spool import ReportSpool
+from lib.log_pipeline import LogPipeline, LogContext
+from lib.load_governor import LoadGovernor
+from lib.result_recorder import ResultRecorder
+from lib.rman_catalog import RmanCatalog
+from lib.state_store import StateStore
+from lib.render_stage import RenderStage, SECTION_TITLES, render_section, check_alerts
 
 ALERT = False
 ALERT_MSG = ""
-LOG_FORMAT = "[%(asctime)s, %(name)s, %(threadName)s, %(levelname)s] %(message)s"
+REPORT_WRITER = None
+FLEET_PUSHER = None
+REPORT_SPOOL = None
+# set when run_deadline is reached, database results finished later are dropped
+COLLECTION_CLOSED = threading.Event()
+RESULTS_LOCK = threading.Lock()
+# finished nodes of running databases by results index, read at the run deadline (database_partial)
+LIVE_DATABASES = {}
+LOG_FORMAT = "[%(asctime)s, %(name)s, %(threadName)s, %(levelname)s]%(structured)s %(message)s"
 WARNING_MSG_PLACEHOLDER = "%WARNING_MSG%"
+DELTA_TXT_HEADING = "\n=== Changes since previous run ===\n"
 pathname = os.path.abspath(os.path.dirname(sys.argv[0])) + str(os.sep)
 
 # Setup rotating file handler - daily rotation, keep 30 days of logs
+# written by the queue listener thread, database threads only enqueue records
 log_file = pathname + "log" + str(os.sep) + "backup_analysis.log"
 handler = logging.handlers.TimedRotatingFileHandler(
     log_file,
@@ -69,10 +132,8 @@ handler = logging.handlers.TimedRotatingFileHandler(
     backupCount=30,
     encoding='utf-8'
 )
-handler.setFormatter(logging.Formatter(LOG_FORMAT))
+LogPipeline.start(handler, LOG_FORMAT)
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-logger.addHandler(handler)
 
 DATE = datetime.datetime.now()
 logging.info("Report start: %s" % DATE.strftime("%d-%m-%Y"))
@@ -91,10 +152,8 @@ def fs_df(db_fs):
     result = []
     for i in db_fs:
         logging.info("Filesystem storage usage: " + i)
-        if os.name == 'nt':
-            total, used, free = Utils.disk_usage_win(i)
-        else:
-            total, used, free = Utils.disk_usage_linux(i)
+        disk_usage = Utils.disk_usage_win if os.name == 'nt' else Utils.disk_usage_linux
+        total, used, free = ResultRecorder.call("host", "disk_usage_%s" % i, disk_usage, i)
         total = float(total // (2**30))
         used = float(used // (2**30))
         free = float(free // (2**30))
@@ -119,20 +178,15 @@ def asm_df(dbs):
     global ALERT
     global ALERT_MSG
     logging.info("ASM storage usage: %s" % dbs["db"].upper())
-    con = DatabaseUsage(dbs)
-    sql = """\
-SELECT
-    (SELECT SYS_CONTEXT('USERENV','SERVER_HOST') FROM DUAL) host,
-    name,
-    round(total_mb/1024) total_gb,
-    round((total_mb-free_mb)/1024) as used_gb,
-    round((free_mb)/1024) free_gb,
-    round(100 * (free_mb/total_mb),2) free_perc
-FROM
-    v$asm_diskgroup
-"""
-    result = con.execute_query(sql, None)
-    con.close_db()
+    try:
+        con = DatabaseUsage(dbs)
+        try:
+            result = con.execute_query(SqlRegistry.get("asm_diskgroup"), None)
+        finally:
+            con.close_db()
+    except (DatabaseUnavailable, QueryError) as e:
+        logging.error("ASM storage usage %s not collected: %s" % (dbs["db"].upper(), e))
+        return {"html": "<h4 style='color:red'>UWAGA! %s</h4>" % e, "txt": "ASM usage not collected: %s\n" % e}
 
     template = env.get_template('fs_size.html.j2')
     ret_val["html"] = template.render(data=result, threshold=Utils.config["threshold"])
@@ -142,268 +196,413 @@ FROM
     return ret_val
 
 
-def render_table(caption, full_title, db_name, table_html, id_postfix):
-    """Renders table test content
-    """
-    logging.info("%s %s" % (caption, db_name))
-    template = env.get_template('test_table.html.j2')
-    html = template.render(caption=caption, full_title=full_title, dbname=db_name, table_html=table_html, postfix=id_postfix)
-    return html
+def run_check(checks, key, func, *args):
+    """Run single check and keep its result under key for machine-readable output
 
+    All queries of the check share its call_timeout, a timed out or failed check is reported
+    as such and the remaining checks of the database still run.
+    """
+    db = func.__self__
+    # parse counters of the session (v$mystat) before and after the check
+    parse_stats = db.db_connection.parse_statistics()
+    db.db_connection.set_call_timeout(Utils.get_call_timeout(key))
+    start = time.perf_counter()
+    try:
+        with LogContext.bind(check=key), Tracer.span(key, cat="check"):
+            ret_val = func(*args)
+    except QueryError as e:
+        ret_val = db.check_failed(key, e)
+    finally:
+        db.db_connection.set_call_timeout(0)
+    elapsed = time.perf_counter() - start
+    parses = DatabaseUsage.parse_delta(parse_stats, db.db_connection.parse_statistics())
+    fields = {"db": db.db_name, "check": key, "elapsed": elapsed}
+    if parses is not None:
+        SqlRegistry.record(key, parses)
+        fields.update(parses=parses["parses"], cache_hits=parses["cache_hits"])
+    logging.info("Check done", extra=fields)
+    checks[key] = ret_val
+    return ret_val
 
-def get_app_version(db, app_version, db_name):
-    """Get application version based on app type"""
-    if not app_version:
-        return ""
-    
-    logging.info("Checking %s version %s" % (app_version.upper(), db_name))
-    
-    if app_version == 'amms':
-        ret_val = db.amms_version()
-    elif app_version == 'im':
-        ret_val = db.im_version()
-    elif app_version == 'docker':
-        ret_val = db.docker_version()
-    else:
-        return ""
-    
-    return ret_val['version']
 
+def run_plan(plan, dbs, checks, session, parallelism=1, governor=None, done=None):
+    """Execute check plan
 
-def get_database_info(db, dbs, multitenant, dataguard):
-    """Get database version, DBID, and DataGuard status"""
-    info = {}
-    
-    # Database version
-    ret_val = db.db_version()
-    info['db_version'] = ret_val['version']
-    logging.info("%s ver.: %s" % (dbs["db"].upper(), info['db_version']))
-    
-    # DBID for RMAN
-    ret_val = db.dbid()
-    info['dbid'] = ret_val["dbid"]
-    logging.info("%s DBID %s" % (dbs["db"].upper(), str(info['dbid'])))
-    
-    # DataGuard status
-    info['dg_status'] = Utils.get_dg_status(dbs["db"]) if dataguard else None
-    
-    # PDBs for multitenant
-    info['pdb_val'] = db.pdbs() if multitenant else None
-    
-    return info
-
-
-def render_db_title(dbs, dbid, db_version, check_logs, lob_check, dg_status, multitenant, pdb_val):
-    """Render database title section (HTML and text)"""
-    if multitenant:
-        template = env.get_template('db_title_cdb.html.j2')
-        html_content = template.render(
-            dbname=dbs["db"], dbid=dbid, check_logs=check_logs, 
-            lob_check=lob_check, pdb_val=pdb_val, 
-            dg_status=dg_status, db_version=db_version
-        )
-        text_content = "=== Database: %s (DBID: %s, ver.: %s) ===\n\n" % (dbs["db"].upper(), dbid, db_version)
-        if dg_status:
-            text_content += " DataGuard status: {0:}\n".format(dg_status)
-        for pdb in pdb_val:
-            text_content += " * {0:} ({1:})\n".format(pdb['pdb'], pdb['guid'])
+    :param session: function returning (DatabaseTests, release function) for a node
+    :param governor: LoadGovernor pacing expensive nodes, None runs the plan as is
+    :param done: dict filled with results of finished nodes while the plan runs
+    :return: {node name: result}, check results are also kept in checks
+    """
+    costs = plan.costs() if governor is not None else {}
+
+    def run_node(node, deps):
+        result = run_session_node(node, deps)
+        if done is not None:
+            done[node["name"]] = result
+        return result
+
+    def run_session_node(node, deps):
+        if node["check"] and not LoadGovernor.collecting():
+            checks[node["name"]] = DatabaseTests.not_collected(node["name"])
+            return checks[node["name"]]
+        try:
+            db, release = session()
+        except (DatabaseUnavailable, QueryError) as e:
+            if not node["check"]:
+                raise
+            # pooled session of the node not available, the check fails and the plan goes on
+            checks[node["name"]] = DatabaseTests.failed_result(dbs["db"].upper(), node["name"], e)
+            return checks[node["name"]]
+        try:
+            with LogContext.bind(db=dbs["db"]):
+                if governor is None:
+                    return run_db_node(db, node, deps)
+                with governor.admit(node, costs[node["name"]], db) as admitted:
+                    if not admitted and node["check"]:
+                        checks[node["name"]] = DatabaseTests.not_collected(node["name"])
+                        return checks[node["name"]]
+                    return run_db_node(db, node, deps)
+        finally:
+            release()
+
+    def run_db_node(db, node, deps):
+        if "dbid" in deps:
+            # reuse DBID node instead of querying it again
+            db.dbid_value = deps["dbid"]["dbid"]
+        func = getattr(db, node["method"])
+        args = node["args"](dbs, deps) if node["args"] else ()
+        if node["check"]:
+            return run_check(checks, node["name"], func, *args)
+        with Tracer.span(node["name"], cat="check"):
+            return func(*args)
+
+    return plan.execute(run_node, parallelism)
+
+
+def run_pdb_tests(dbs, pdb, pool, config, governor=None):
+    """Run PDB scoped plan (app version, logs, tablespaces, stats) in a pooled session switched to the PDB"""
+    flags = determine_check_flags({"db": pdb}, config)
+    section_dbs = {"db": "%s_%s" % (dbs["db"], pdb), "skip_checks": dbs.get("skip_checks")}
+    plan = CheckPlan(section_dbs, flags, scope="pdb")
+    checks = {}
+    try:
+        db = DatabaseTests(dbs, pool=pool, container=pdb)
+    except (DatabaseUnavailable, QueryError) as e:
+        logging.error("PDB %s of %s not checked: %s" % (pdb.upper(), dbs["db"].upper(), e))
+        return pdb_session_failed(dbs, pdb, section_dbs, plan, e)
+    try:
+        info = run_plan(plan, section_dbs, checks, lambda: (db, lambda: None), governor=governor)
+    finally:
+        db.db_connection.close_db()
+
+    version = info["app_version"]["version"] if "app_version" in info else ""
+    # plain result data, rendered together with the CDB in the render stage
+    return {"pdb": pdb, "section_db": section_dbs["db"], "version": version, "sections": plan.check_names(),
+            "checks": checks}
+
+
+def pdb_session_failed(dbs, pdb, section_dbs, plan, error):
+    """PDB data with every section failed, the session could not be switched to the PDB"""
+    sections = plan.check_names()
+    checks = {}
+    for name in sections:
+        checks[name] = DatabaseTests.failed_result(section_dbs["db"].upper(), name, error)
+    if sections:
+        checks[sections[0]]["alert"] = True
+        checks[sections[0]]["alert_msg"] = DatabaseTests.ALERT_PREFIX + "PDB %s (%s) niedostępna: %s</p>" % (
+            pdb.upper(), dbs["db"].upper(), error)
+    return {"pdb": pdb, "section_db": section_dbs["db"], "version": "", "sections": sections, "checks": checks}
+
+
+def pdb_not_collected(dbs, pdb):
+    """PDB data with every section not collected, the PDB plan was still running at the run deadline"""
+    section_dbs = {"db": "%s_%s" % (dbs["db"], pdb), "skip_checks": dbs.get("skip_checks")}
+    sections = CheckPlan(section_dbs, determine_check_flags({"db": pdb}, Utils.config), scope="pdb").check_names()
+    return {"pdb": pdb, "section_db": section_dbs["db"], "version": "", "sections": sections,
+            "checks": {name: DatabaseTests.not_collected(name) for name in sections}}
+
+
+def start_pdb_tests(dbs, pdb_names, governor=None):
+    """Submit PDB tests to a thread pool backed by a session pool of the CDB"""
+    pool_size = max(1, min(len(pdb_names), Utils.get_config_int("pdb_parallelism", 4)))
+    if governor is not None and governor.level != "ok" and pool_size > 1:
+        logging.info("%s decision: %s, pdb_parallelism %d -> 1", dbs["db"].upper(), governor.level, pool_size)
+        pool_size = 1
+    logging.info("Multitenant mode for %s: %d PDBs, %d parallel sessions" %
+                 (dbs["db"].upper(), len(pdb_names), pool_size))
+    pool = DatabaseUsage.create_pool(dbs, pool_size)
+    executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="pdb-%s" % dbs["db"])
+    futures = [executor.submit(run_pdb_tests, dbs, pdb, pool, Utils.config, governor) for pdb in pdb_names]
+    return pool, executor, futures
+
+
+def db_test(dbs, results, i, flags):
+    """Execute tests on database"""
+    live = {}
+    with RESULTS_LOCK:
+        LIVE_DATABASES[i] = live
+    with LogContext.bind(db=dbs["db"]), Tracer.span("db_test", db=dbs["db"]):
+        try:
+            result = db_test_run(dbs, flags, live)
+        except (DatabaseUnavailable, QueryError) as e:
+            logging.error("Database %s skipped: %s" % (dbs["db"].upper(), e))
+            result = database_unavailable(dbs, e)
+        publish_result(dbs, results, i, result)
+
+
+def publish_result(dbs, results, i, result):
+    """Store result of a finished database and stream it (REPORT_WRITER, FLEET_PUSHER, REPORT_SPOOL)
+
+    Results of databases finished after the run deadline closed collection are dropped,
+    the report has been sent with the sections finished by then (database_partial).
+    """
+    with RESULTS_LOCK:
+        LIVE_DATABASES.pop(i, None)
+        if COLLECTION_CLOSED.is_set():
+            logging.warning("Database %s finished after run deadline, not reported" % dbs["db"].upper())
+            return
+        store_result(dbs, results, i, result)
+
+
+def store_result(dbs, results, i, result):
+    """Keep result and stream it, called with RESULTS_LOCK held"""
+    results[i] = result
+    # Stream machine-readable records as soon as the database is done
+    if REPORT_WRITER is not None:
+        REPORT_WRITER.write_database(dbs["db"], result)
+    if FLEET_PUSHER is not None and not result.get("unavailable") and not result.get("not_collected"):
+        FLEET_PUSHER.push_database(dbs["db"], result)
+    if REPORT_SPOOL is not None:
+        spool_database_result(dbs, result)
+
+
+def spool_database_result(dbs, result):
+    """Move report fragments of a finished database to REPORT_SPOOL, only summary metadata stays in result"""
+    if delta_report_day(Utils.config):
+        fragment = render_delta_fragment(dbs, result)
     else:
-        template = env.get_template('db_title.html.j2')
-        html_content = template.render(
-            dbname=dbs["db"], dbid=dbid, check_logs=check_logs,
-            lob_check=lob_check, dg_status=dg_status, db_version=db_version
-        )
-        text_content = "=== Database: %s (DBID: %s, ver.: %s) ===\n\n" % (dbs["db"].upper(), dbid, db_version)
-        if dg_status:
-            text_content += " DataGuard status: {0:}\n".format(dg_status)
-    
-    return html_content, text_content
+        if report_mode(Utils.config) == "delta":
+            # full report day, new baseline for the following delta reports
+            ReportDelta.compare(dbs["db"], result)
+        fragment = (result["html"], "\n" + result["txt"])
+    if fragment is None:
+        result["unchanged"] = True
+    else:
+        result["fragment"] = REPORT_SPOOL.put(dbs["db"], *fragment)
+    result["html"] = None
+    result["txt"] = None
+    result["checks"] = {}
+
+
+def database_unavailable(dbs, error):
+    """Result of a database which could not be connected or queried"""
+    reason = error.reason if isinstance(error, DatabaseUnavailable) else str(error)
+    template = env.get_template('db_unavailable.html.j2')
+    result = {
+        "html": template.render(dbname=dbs["db"], reason=reason),
+        "txt": "=== Database: %s ===\n\n UNAVAILABLE: %s\n" % (dbs["db"].upper(), reason),
+        "size": None,
+        "alert": True,
+        "alert_msg": DatabaseTests.ALERT_PREFIX + dbs["db"].upper() + " niedostępna: %s</p>" % reason,
+        "db_version": None,
+        "version": "",
+        "dbid": "-",
+        "sga": None,
+        "pga": None,
+        "checks": {},
+        "unavailable": reason
+    }
+    return result
+
+
+def database_not_collected(dbs):
+    """Result of a database still running at the run deadline (run_deadline)"""
+    reason = "nie zebrano przed upływem run_deadline"
+    template = env.get_template('db_unavailable.html.j2')
+    return {
+        "html": template.render(dbname=dbs["db"], reason=reason, heading="UWAGA! Baza nie została sprawdzona"),
+        "txt": "=== Database: %s ===\n\n NOT COLLECTED: run deadline reached\n" % dbs["db"].upper(),
+        "size": None,
+        "alert": True,
+        "alert_msg": DatabaseTests.ALERT_PREFIX + dbs["db"].upper() + " %s</p>" % reason,
+        "db_version": None,
+        "version": "",
+        "dbid": "-",
+        "sga": None,
+        "pga": None,
+        "checks": {},
+        "unavailable": reason,
+        "not_collected": True
+    }
 
 
-def run_backup_tests(db, dbs, html_content, text_content):
-    """Run backup-related tests (FRA, Full, Archive)"""
-    alert = False
-    alert_msg = ""
-    
-    # FRA usage
-    text_content += "--- Fast Recovery Area ---\n"
-    ret_val = db.fra_usage()
-    text_content += "%s\n" % ret_val["txt"]
-    html_content += render_table("Fast Recovery Area", "Raport zajętość Fast Recovery Area:", 
-                                  dbs["db"], ret_val["html"], "fra")
-    
-    # Full backup
-    text_content += "--- Full backup ---\n"
-    ret_val = db.full_bck(dbs["db"].upper())
-    text_content += "%s\n" % ret_val["txt"]
-    html_content += render_table("Full backup", "Raport wykonania kopii pełnych:", 
-                                  dbs["db"], ret_val["html"], "full")
-    if ret_val["alert"]:
-        alert = True
-        alert_msg += ret_val["alert_msg"]
-    
-    # Archivelog backup
-    text_content += "--- Archivelog ---\n"
-    ret_val = db.arch_bck(dbs["db"].upper())
-    text_content += "%s\n" % ret_val["txt"]
-    html_content += render_table("Archivelog", "Raport wykonania kopii archive-logów:", 
-                                  dbs["db"], ret_val["html"], "arch")
-    if ret_val["alert"]:
-        alert = True
-        alert_msg += ret_val["alert_msg"]
-    
-    return html_content, text_content, alert, alert_msg
+def database_partial(dbs, live):
+    """Result of a database still running at the run deadline (run_deadline)
 
+    Sections finished so far are reported, the remaining sections and unfinished PDBs
+    are marked as not collected. database_not_collected() when no check has finished.
+    """
+    checks = dict(live.get("checks") or {})
+    finished = [name for name, ret_val in checks.items() if not ret_val.get("not_collected")]
+    if not finished:
+        return database_not_collected(dbs)
+    plan = live["plan"]
+    sections = plan.check_names()
+    # copies, render_check() changes check results in place and the database thread still runs
+    checks = {name: dict(checks[name]) if name in checks else DatabaseTests.not_collected(name)
+              for name in sections}
+    pdb_results = [future.result() if future.done() and future.exception() is None else pdb_not_collected(dbs, pdb)
+                   for pdb, future in live["pdbs"]]
+    result = database_result(dbs, live["flags"], plan, dict(live["done"]), checks, pdb_results)
+    reason = "niekompletna, %d z %d sekcji zebrano przed upływem run_deadline" % (len(finished), len(sections))
+    result["alert"] = True
+    result["alert_msg"] += DatabaseTests.ALERT_PREFIX + dbs["db"].upper() + " %s</p>" % reason
+    result["not_collected"] = True
+    return result
+
+
+def database_stale(meta):
+    """Result of a database whose newest fleet payload is from an earlier report date"""
+    reason = "brak wyników z dnia %s, ostatnie z %s (host %s)" % (DATE.strftime("%Y-%m-%d"), meta.get("report_date"),
+                                                                    meta.get("host"))
+    template = env.get_template('db_unavailable.html.j2')
+    return {
+        "db": meta["db"],
+        "html": template.render(dbname=meta["db"], reason=reason, heading="UWAGA! Brak aktualnych wyników"),
+        "txt": "=== Database: %s ===\n\n STALE: last results of %s from host %s\n" % (
+            meta["db"].upper(), meta.get("report_date"), meta.get("host")),
+        "size": None,
+        "alert": True,
+        "alert_msg": DatabaseTests.ALERT_PREFIX + meta["db"].upper() + " %s</p>" % reason,
+        "db_version": None,
+        "version": "",
+        "dbid": meta.get("dbid", "-"),
+        "sga": None,
+        "pga": None,
+        "stale": meta.get("report_date")
+    }
 
-def run_optional_tests(db, dbs, html_content, text_content, check_logs, app_version, lob_check):
-    """Run optional tests (logs, certs, lobs)"""
-    alert = False
-    alert_msg = ""
-    
-    # Logs stats
-    if check_logs:
-        text_content += "--- Logs info ---\n"
-        ret_val = db.logs_test()
-        text_content += "%s\n" % ret_val["txt"]
-        html_content += render_table("Logs info", "Raport z migracji logów aplikacji:", 
-                                      dbs["db"], ret_val["html"], "logs")
-    
-    # AMMS certs
-    if app_version == 'amms':
-        text_content += "--- AMMS Certs ---\n"
-        ret_val = db.amms_infra_certs()
-        text_content += "%s\n" % ret_val["txt"]
-        html_content += render_table("AMMS cert", "Informacje o certyfikatach AMMS:", 
-                                      dbs["db"], ret_val["html"], "cert")
-    
-    # Redo rotation
-    text_content += "--- Redo logs ---\n"
-    ret_val = db.redo_test()
-    text_content += "%s\n" % ret_val["txt"]
-    html_content += render_table("Redo logs", "Max rotacja redo logów:", 
-                                  dbs["db"], ret_val["html"], "redo")
-    
-    # Check lob partitions
-    if lob_check:
-        text_content += "--- Lob partitions ---\n"
-        ret_val = db.edm_lobs(dbs["db"].upper())
-        text_content += "%s\n" % ret_val["txt"]
-        html_content += render_table("Lob partitions", "Partycje lob i czas obowiązywania:", 
-                                      dbs["db"], ret_val["html"], "lob")
-        if ret_val["alert"]:
-            alert = True
-            alert_msg += ret_val["alert_msg"]
-    
-    return html_content, text_content, alert, alert_msg
 
+def database_plan(dbs, flags):
+    """Compiled check plan of a database and PDB names checked in their own sessions"""
+    if Utils.params.get("summary"):
+        return CheckPlan(dbs, flags, scope="summary"), []
+    # PDB scoped checks run in parallel with CDB level checks when oracle_pdbs lists PDBs of this CDB
+    pdb_names = Utils.config.get("oracle_pdbs", {}).get(dbs["db"], []) if flags["multitenancy"] else []
+    return CheckPlan(dbs, dict(flags, pdb_sessions=bool(pdb_names))), pdb_names
 
-def run_tablespace_and_stats_tests(db, dbs, html_content, text_content, multitenant):
-    """Run tablespace and statistics tests"""
-    # Tablespace size
-    text_content += "--- Tablespaces ---\n"
-    if multitenant:
-        logging.info("Using CDB tablespace test for %s (multitenant=True)" % dbs["db"].upper())
-        ret_val = db.cdb_tblspc_usage()
-    else:
-        logging.info("Using standard tablespace test for %s (multitenant=False)" % dbs["db"].upper())
-        ret_val = db.tblspc_usage()
-    text_content += "%s\n" % ret_val["txt"]
-    html_content += render_table("Tablespaces", "Raport przestrzeni tabel:", 
-                                  dbs["db"], ret_val["html"], "tbl")
-    
-    # Tables stats
-    text_content += "--- Oldest statistics ---\n"
-    ret_val = db.stats_test()
-    text_content += ret_val["txt"] + "\n"
-    html_content += render_table("Oldest statistics", "Raport statystyk tabel:", 
-                                  dbs["db"], ret_val["html"], "stats")
-    
-    return html_content, text_content
 
+def db_test_run(dbs, flags, live=None):
+    """Execute check plan of a database, body of db_test, returns the database result
 
-def get_database_size(db, dbs, text_content, multitenant):
-    """Get database size and update text content"""
-    if multitenant:
-        logging.debug("Using CDB size query for %s" % dbs["db"].upper())
-        ret_val = db.cdb_db_size()
+    :param live: dict of db_test filled with the plan and its finished nodes, see database_partial()
+    """
+    plan, pdb_names = database_plan(dbs, flags)
+    parallelism = max(1, dbs.get("check_parallelism", 1))
+    pool = None
+    if parallelism > 1:
+        # independent nodes run at once, each in its own pooled session
+        pool = DatabaseUsage.create_pool(dbs, parallelism)
+
+        def session():
+            db = DatabaseTests(dbs, pool=pool)
+            return db, db.db_connection.close_db
     else:
-        logging.debug("Using standard size query for %s" % dbs["db"].upper())
-        ret_val = db.db_size()
-    
-    text_content += "%s\n" % ret_val["txt"]
-    db_size = ret_val["size"]
-    logging.info("Database size " + dbs["db"].upper() + " " + str(db_size))
-    
-    return db_size, text_content
+        db = DatabaseTests(dbs)
 
+        def session():
+            return db, lambda: None
 
-def get_memory_size(db, dbs, text_content):
-    """Get SGA and PGA size and update text content"""
+    # load signal before the run, busy database gets serial plan and PDB checks
+    governor = LoadGovernor(dbs["db"])
+    if governor.enabled:
+        sample_db, release = session()
+        try:
+            parallelism = governor.parallelism(sample_db, parallelism)
+        finally:
+            release()
 
-    ret_val = db.db_memory()
-    text_content += "%s\n" % ret_val["txt"]
+    if pdb_names:
+        pdb_pool, pdb_executor, pdb_futures = start_pdb_tests(dbs, pdb_names, governor)
 
-    logging.info("Memory size " + dbs["db"].upper() + " SGA: " + str(ret_val["sga"]) + " GB, PGA: " + str(ret_val["pga"]) + " GB")
-    
-    return ret_val, text_content
+    logging.info("Executing on %s" % dbs["db"].upper())
+    checks = {}
+    done = {}
+    if live is not None:
+        live.update(flags=flags, plan=plan, checks=checks, done=done,
+                    pdbs=list(zip(pdb_names, pdb_futures)) if pdb_names else [])
+    try:
+        info = run_plan(plan, dbs, checks, session, parallelism, governor, done)
+        # plan order, parallel nodes finish in any order
+        checks = {node["name"]: checks[node["name"]] for node in plan.nodes if node["name"] in checks}
+
+        # Results grouped per PDB, in oracle_pdbs order
+        pdb_results = [future.result() for future in pdb_futures] if pdb_names else []
+    finally:
+        if pdb_names:
+            pdb_executor.shutdown()
+            pdb_pool.close()
+        if pool is not None:
+            pool.close()
+        else:
+            db.db_connection.close_db()
 
+    return database_result(dbs, flags, plan, info, checks, pdb_results)
 
-def db_test(dbs, results, i, check_logs=False, app_version=False, lob_check=False,
-            multitenant=False, dataguard=False):
-    """Execute tests on database"""
-    db = DatabaseTests(dbs)
-    logging.info("Executing on %s" % dbs["db"].upper())
-    
-    # Get database information
-    db_info = get_database_info(db, dbs, multitenant, dataguard)
-    
-    # Get app version
-    app_version_result = get_app_version(db, app_version, dbs["db"].upper())
-    
-    # Render DB Title
-    html_content, text_content = render_db_title(
-        dbs, db_info['dbid'], db_info['db_version'], check_logs, lob_check, 
-        db_info['dg_status'], multitenant, db_info['pdb_val']
-    )
-    
-    # Get database size
-    db_size, text_content = get_database_size(db, dbs, text_content, multitenant)
 
-    # Get memory size
-    db_memory, text_content = get_memory_size(db, dbs, text_content)
-    
-    # Run backup tests
-    html_content, text_content, alert, alert_msg = run_backup_tests(db, dbs, html_content, text_content)
-    
-    # Run optional tests
-    html_opt, text_opt, alert_opt, alert_msg_opt = run_optional_tests(
-        db, dbs, html_content, text_content, check_logs, app_version, lob_check
-    )
-    html_content = html_opt
-    text_content = text_opt
-    alert = alert or alert_opt
-    alert_msg += alert_msg_opt
-    
-    # Run tablespace and statistics tests
-    html_content, text_content = run_tablespace_and_stats_tests(db, dbs, html_content, text_content, multitenant)
-    
-    # Store results
-    db.db_connection.close_db()
-    results[i] = {
-        "html": html_content,
-        "txt": text_content,
-        "size": db_size,
-        "alert": alert,
-        "alert_msg": alert_msg,
-        "db_version": db_info['db_version'],
+def database_result(dbs, flags, plan, info, checks, pdb_results):
+    """Render database fragment and summary data from results of plan nodes and PDB data"""
+    app_version_result = info['app_version']['version'] if 'app_version' in info else ""
+    dbid = info['dbid']['dbid'] if 'dbid' in info else "-"
+    db_version = info['db_version']['version'] if 'db_version' in info else None
+    if Utils.params.get("summary"):
+        # --summary: data of the summary box and alerts only, no report sections
+        alert, alert_msg = check_alerts(plan.check_names(), checks)
+        rendered = {"html": "", "txt": "", "alert": alert, "alert_msg": alert_msg, "checks": checks, "pdbs": []}
+    else:
+        # Title, sections and PDBs rendered from plain result data, in a worker process with render_workers
+        with Tracer.span("render", db=dbs["db"]):
+            rendered = RenderStage.render({
+                "db": dbs["db"],
+                "title": {"dbid": dbid, "db_version": db_version,
+                          "check_logs": flags['logs_check'], "lob_check": flags['lob_check'],
+                          "dg_status": info['dg_status']['dg_status'] if 'dg_status' in info else None,
+                          "multitenant": flags['multitenancy'], "pdb_val": info.get('pdbs') or []},
+                "sections": plan.check_names(),
+                "checks": checks,
+                "pdbs": pdb_results,
+            })
+    checks = rendered["checks"]
+    pdb_versions = []
+    for pdb_result in rendered["pdbs"]:
+        if pdb_result["version"] and pdb_result["version"] not in pdb_versions:
+            pdb_versions.append(pdb_result["version"])
+        for key, ret_val in pdb_result["checks"].items():
+            checks["%s/%s" % (pdb_result["pdb"], key)] = ret_val
+    app_version_result = app_version_result or ", ".join(pdb_versions)
+
+    size = checks.get("size", {})
+    memory = checks.get("memory", {})
+    logging.info("Database size %s %s, SGA: %s GB, PGA: %s GB" % (
+        dbs["db"].upper(), size.get("size"), memory.get("sga"), memory.get("pga")))
+
+    result = {
+        "html": rendered["html"],
+        "txt": rendered["txt"],
+        "size": size.get("size"),
+        "alert": rendered["alert"],
+        "alert_msg": rendered["alert_msg"],
+        "db_version": db_version,
         "version": app_version_result,
-        "dbid": str(db_info['dbid']),
-        "sga": db_memory['sga'],
-        "pga": db_memory['pga']
+        "dbid": str(dbid),
+        "sga": memory.get("sga"),
+        "pga": memory.get("pga"),
+        "checks": checks
     }
     
-    if dataguard:
-        results[i]["dataguard"] = db_info['dg_status']
+    if flags['dataguard'] and 'dg_status' in info:
+        result["dataguard"] = info['dg_status']['dg_status']
+    return result
 
 
 def determine_check_flags(dbs, config):
@@ -436,24 +635,53 @@ def run_database_tests_threaded(oracle_dbs, config):
     threads = []
     results = [None] * len(oracle_dbs)
     
+    deadline = LoadGovernor.remaining() is not None
+
     for i, dbs in enumerate(oracle_dbs):
         flags = determine_check_flags(dbs, config)
         
+        # with run_deadline the report does not wait for databases still running at exit
         t = threading.Thread(
+            name="db-%s" % dbs["db"],
             target=db_test,
-            args=(dbs, results, i, flags['logs_check'], flags['version_check'],
-                  flags['lob_check'], flags['multitenancy'], flags['dataguard'])
+            args=(dbs, results, i, flags),
+            daemon=deadline
         )
         t.start()
         threads.append(t)
     
-    # Wait for all threads to complete
+    # Wait for all threads to complete, with run_deadline until the time left for delivery
     for t in threads:
-        t.join()
+        t.join(LoadGovernor.delivery_wait())
+
+    if any(t.is_alive() for t in threads):
+        with RESULTS_LOCK:
+            COLLECTION_CLOSED.set()
+            late = {i: LIVE_DATABASES.pop(i, {}) for i, result in enumerate(results) if result is None}
+        # collection closed, results of late databases are built from the nodes finished by now
+        for i, live in late.items():
+            logging.warning("Run deadline reached, database %s not fully collected" % oracle_dbs[i]["db"].upper())
+            result = database_partial(oracle_dbs[i], live)
+            with RESULTS_LOCK:
+                store_result(oracle_dbs[i], results, i, result)
     
     return results
 
 
+def print_check_plans():
+    """Print compiled check plans with critical-path estimates (--plan), no database is contacted"""
+    Utils.parse_config_file(configparser)
+    config = Utils.config
+    oracle_dbs = config["oracle_dbs"]
+    for dbs in oracle_dbs:
+        plan, pdb_names = database_plan(dbs, determine_check_flags(dbs, config))
+        print(plan.describe(max(1, dbs.get("check_parallelism", 1))))
+        for pdb in pdb_names:
+            section_dbs = {"db": "%s_%s" % (dbs["db"], pdb), "skip_checks": dbs.get("skip_checks")}
+            print(CheckPlan(section_dbs, determine_check_flags({"db": pdb}, config), scope="pdb").describe())
+        print("")
+
+
 def render_database_boxes(oracle_dbs, results):
     """Render database summary boxes (TOC)"""
     html_content = '<tr><td colspan="2" style="padding:16px 0;"><h2 style="margin:0 0 12px 0; color:#2d3748; font-size:18px; font-weight:700;">Podsumowanie baz danych</h2></td></tr>\n'
@@ -539,6 +767,101 @@ def append_database_reports(results):
     return html_content, txt_content
 
 
+def report_mode(config):
+    return str(config.get("report_mode") or "full").strip().lower()
+
+
+def delta_report_day(config):
+    """True when report_mode = delta and no full report is due (--full, full_report_weekday)"""
+    if report_mode(config) != "delta" or Utils.params.get("full"):
+        return False
+    full_weekday = Utils.get_config_int("full_report_weekday", 0)
+    return DATE.isoweekday() != full_weekday
+
+
+def append_delta_reports(oracle_dbs, results):
+    """Append only sections changed since the previous run and new alerts
+
+    Fingerprints are stored on every run in delta mode, so the weekly full
+    report is also the baseline of the next delta.
+    """
+    html_content = ""
+    txt_content = DELTA_TXT_HEADING
+    unchanged = []
+
+    for dbs, res in zip(oracle_dbs, results):
+        if res is None:
+            continue
+        fragment = render_delta_fragment(dbs, res)
+        if fragment is None:
+            unchanged.append(dbs["db"].upper())
+            continue
+        html_content += fragment[0]
+        txt_content += fragment[1]
+
+    note_html, note_txt = delta_unchanged_note(unchanged)
+    return html_content + note_html, txt_content + note_txt
+
+
+def render_delta_fragment(dbs, res):
+    """Changed sections and new alerts of one database: (html, txt), None when nothing changed"""
+    if res.get("unavailable") or res.get("not_collected"):
+        return res["html"], "\n" + res["txt"]
+    changed, new_alerts = ReportDelta.compare(dbs["db"], res)
+    sections = [key for key in changed if key.rpartition("/")[2] in SECTION_TITLES]
+    if not sections and not new_alerts:
+        return None
+    template = env.get_template('delta_title.html.j2')
+    html_content = template.render(dbname=dbs["db"], dbid=res["dbid"], changed=sections, new_alerts=new_alerts)
+    txt_content = "\n=== Database: %s (DBID: %s) ===\n" % (dbs["db"].upper(), res["dbid"])
+    for msg in new_alerts:
+        txt_content += " New alert: %s\n" % msg
+    for key in sections:
+        pdb, _, name = key.rpartition("/")
+        section_dbs = {"db": "%s_%s" % (dbs["db"], pdb) if pdb else dbs["db"]}
+        html_content += render_section(section_dbs, name, res["checks"][key])
+        txt_content += "--- %s%s ---\n%s\n" % (SECTION_TITLES[name][0], " (%s)" % pdb.upper() if pdb else "",
+                                               res["checks"][key]["txt"])
+    return html_content, txt_content
+
+
+def delta_unchanged_note(unchanged):
+    """Single line listing databases without changes"""
+    logging.info("Delta report: %d databases unchanged" % len(unchanged))
+    if not unchanged:
+        return "", ""
+    return ('<tr><td style="padding:12px 0; color:#718096; font-size:12px;">Bez zmian: %s</td></tr>\n' %
+            ", ".join(unchanged), "\nUnchanged: %s\n" % ", ".join(unchanged))
+
+
+def assemble_spooled_report(html_head, txt_head, oracle_dbs, results, delta, config):
+    """Stream report head, spooled database fragments and footer into report files
+
+    :return: (html path, txt path)
+    """
+    html_parts = [html_head.replace(WARNING_MSG_PLACEHOLDER, ALERT_MSG)]
+    txt_parts = [txt_head.replace(WARNING_MSG_PLACEHOLDER, ALERT_MSG)]
+    if delta:
+        txt_parts.append(DELTA_TXT_HEADING)
+    unchanged = []
+    for dbs, res in zip(oracle_dbs, results):
+        if res is None:
+            continue
+        if res.get("unchanged"):
+            unchanged.append(dbs["db"].upper())
+            continue
+        html_parts.append(res["fragment"])
+        txt_parts.append(res["fragment"])
+    if delta:
+        note_html, note_txt = delta_unchanged_note(unchanged)
+        html_parts.append(note_html)
+        txt_parts.append(note_txt)
+    footer_html, footer_txt = finalize_report_content("", "", config)
+    html_parts.append(footer_html)
+    txt_parts.append(footer_txt)
+    return REPORT_SPOOL.assemble("html", html_parts), REPORT_SPOOL.assemble("txt", txt_parts)
+
+
 def initialize_report_content(config):
     """Initialize HTML and text report headers"""
     template = env.get_template('header.html.j2')
@@ -567,22 +890,245 @@ def finalize_report_content(html_content, txt_content, config):
     return html_content, txt_content
 
 
+def deliver_report(html_content, txt_content):
+    """Print text report (verbose) or send email"""
+    if ResultRecorder.replaying():
+        ResultRecorder.save_report(html_content, txt_content)
+    if Utils.params["verbose"]:
+        # Machine-readable output on stdout takes precedence over text tables
+        if not (Utils.params["format"] and Utils.params["output"] == "-"):
+            print(txt_content)
+    elif not ResultRecorder.replaying():
+        email = EmailCreation(ALERT)
+        email.create_email(html_content, txt_content)
+
+
+def deliver_report_files(html_path, txt_path):
+    """Print spooled text report (verbose) or send email streamed from report files"""
+    if ResultRecorder.replaying():
+        ResultRecorder.save_report_files(html_path, txt_path)
+    if Utils.params["verbose"]:
+        if not (Utils.params["format"] and Utils.params["output"] == "-"):
+            with open(txt_path, "r", encoding="utf-8") as fp:
+                shutil.copyfileobj(fp, sys.stdout)
+    elif not ResultRecorder.replaying():
+        email = EmailCreation(ALERT)
+        email.create_email_from_files(html_path, txt_path)
+
+
+def summary_alert_changes(oracle_dbs, results):
+    """Compare alert state of every database with the previous --summary run
+
+    :return: [(database, previous state, current state)] of changed databases, state kept in StateStore
+    """
+    previous = StateStore.get("summary", "alert_state", {}) or {}
+    current = {}
+    changes = []
+    for dbs, res in zip(oracle_dbs, results):
+        if res is None:
+            continue
+        state = {"alert": bool(res["alert"]), "alert_msg": res["alert_msg"], "dataguard": res.get("dataguard")}
+        current[dbs["db"]] = state
+        # first run: previous state taken as no alert
+        before = previous.get(dbs["db"], {"alert": False, "alert_msg": "", "dataguard": state["dataguard"]})
+        if before != state:
+            changes.append((dbs["db"], before, state))
+    StateStore.put("summary", "alert_state", current)
+    return changes
+
+
+def render_summary_changes(changes):
+    """Databases whose alert state changed, (html, txt)"""
+    def status(state):
+        text = "BŁĄD" if state["alert"] else "OK"
+        return text + (", DataGuard %s" % state["dataguard"] if state["dataguard"] else "")
+
+    items = ["%s: %s &rarr; %s" % (db.upper(), status(before), status(after)) for db, before, after in changes]
+    html_content = '<tr><td style="padding:12px 0; color:#2d3748; font-size:12px;"><strong>Zmiana stanu:</strong> ' \
+                   '%s</td></tr>\n' % "; ".join(items)
+    txt_content = "\nAlert state changed:\n%s\n" % "\n".join(
+        " %s: %s -> %s" % (db.upper(), status(before), status(after)) for db, before, after in changes)
+    return html_content, txt_content
+
+
+def run_summary():
+    """--summary: queries of the summary boxes and backup alerts only, email when the alert state changed"""
+    LoadGovernor.start_run()
+    with Tracer.span("config_parse"):
+        Utils.parse_config_file(configparser)
+    if Utils.params["verbose"]:
+        logging.getLogger().setLevel(logging.DEBUG)
+    LogPipeline.configure(Utils.get_config_int("log_rate_limit", 0))
+    SqlRegistry.load()
+    # database size from usage metrics, the exact mode scans all segments
+    Utils.config["sizing_mode"] = "fast"
+    RmanCatalog.load()
+
+    oracle_dbs = Utils.config["oracle_dbs"]
+    results = run_database_tests_threaded(oracle_dbs, Utils.config)
+    check_for_alerts(results)
+    changes = summary_alert_changes(oracle_dbs, results)
+    logging.info("Summary: %d databases, alert state changed for %d" % (len(oracle_dbs), len(changes)))
+    if not changes and not Utils.params["verbose"]:
+        return
+
+    html_content, txt_content = initialize_report_content(Utils.config)
+    with Tracer.span("render_boxes"):
+        html_content += render_database_boxes(oracle_dbs, results)
+    if changes:
+        changes_html, changes_txt = render_summary_changes(changes)
+        html_content += changes_html
+        txt_content += changes_txt
+    html_content += "<tr><td>" + WARNING_MSG_PLACEHOLDER + "</td></tr>"
+    txt_content += WARNING_MSG_PLACEHOLDER
+    html_content, txt_content = finalize_report_content(html_content, txt_content, Utils.config)
+    SqlRegistry.log_statistics()
+    deliver_report(html_content, txt_content)
+
+
+def run_collector():
+    """Build one consolidated report from payloads pushed by database hosts"""
+    try:
+        with Tracer.span("config_parse"):
+            Utils.parse_config_file(configparser)
+
+        collector = FleetCollector(Utils.params["collect"])
+        if Utils.params["listen"]:
+            collector.listen(Utils.params["listen"], Utils.get_config_int("collect_window", 600),
+                             Utils.get_config_int("collect_max_payload", 20) * 1024 * 1024)
+
+        with Tracer.span("collect_merge"):
+            databases, hosts, stale_databases, stale_hosts = collector.merge(
+                DATE.strftime("%Y-%m-%d"), Utils.get_config_int("collect_stale_days", 7))
+        # stale databases stay in the estate as alerts, their old results are not shown
+        entries = [(meta, path) for meta, path in databases] + [(database_stale(meta), None)
+                                                                for meta, path in stale_databases]
+        entries.sort(key=lambda item: item[0]["db"])
+        metas = [meta for meta, path in entries]
+
+        html_content, txt_content = initialize_report_content(Utils.config)
+        with Tracer.span("render_boxes"):
+            estate = [{"db": meta["db"], "dataguard": "dataguard" in meta} for meta in metas]
+            html_content += render_database_boxes(estate, metas)
+        check_for_alerts(metas)
+
+        html_parts = [html_content + "<tr><td>" + ALERT_MSG + "</td></tr>"]
+        txt_parts = [txt_content + ALERT_MSG + "\n=== Disk usage summary ===\n\n"]
+        for meta, path in stale_hosts:
+            logging.warning("Host %s did not push disk usage, last from %s" % (meta["host"], meta.get("report_date")))
+            html_parts.append('<tr><td style="padding:6px 0; color:red; font-size:12px;">Host %s: brak danych '
+                              'zajętości dysków, ostatnie z %s</td></tr>\n' % (meta["host"], meta.get("report_date")))
+            txt_parts.append("\n=== Host %s ===\n STALE: last disk usage of %s\n" % (meta["host"],
+                                                                                    meta.get("report_date")))
+
+        # Payload fragments are spooled one at a time and streamed into the report files
+        spool = ReportSpool(Utils.config.get("spool_dir"))
+        try:
+            with Tracer.span("render_reports"):
+                for meta, path in hosts:
+                    html, txt = FleetCollector.fragments(path)
+                    fragment = spool.put("host_" + meta["host"], html, "\n=== Host %s ===\n%s" % (meta["host"], txt))
+                    html_parts.append(fragment)
+                    txt_parts.append(fragment)
+                for meta, path in entries:
+                    if path is None:
+                        html, txt = meta["html"], meta["txt"]
+                    else:
+                        html, txt = FleetCollector.fragments(path)
+                    fragment = spool.put(meta["db"], html, "\n" + txt)
+                    html_parts.append(fragment)
+                    txt_parts.append(fragment)
+                footer_html, footer_txt = finalize_report_content("", "", Utils.config)
+                html_parts.append(footer_html)
+                txt_parts.append(footer_txt)
+                html_path = spool.assemble("html", html_parts)
+                txt_path = spool.assemble("txt", txt_parts)
+            deliver_report_files(html_path, txt_path)
+        finally:
+            spool.cleanup()
+
+    except Exception as error:
+        logging.warning(str(error))
+        raise
+
+
 def main():
+    Utils.parse_params()
+    if Utils.params["plan"]:
+        print_check_plans()
+        return
+    if Utils.params["collect"]:
+        run = run_collector
+    elif Utils.params["summary"]:
+        run = run_summary
+    else:
+        run = run_report
+
+    if not Utils.params["profile"]:
+        run()
+        return
+
+    Tracer.enable()
+    profile_base = "%slog%sbackup_analysis_%s" % (pathname, os.sep, DATE.strftime("%Y%m%d_%H%M%S"))
+    profiler = cProfile.Profile() if Utils.params["cprofile"] else None
     try:
-        Utils.parse_params()
-        Utils.parse_config_file(configparser)
+        if profiler is not None:
+            profiler.enable()
+        with Tracer.span("run"):
+            run()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_base + ".prof")
+            logging.info("cProfile stats written to %s.prof" % profile_base)
+        Tracer.write(profile_base + ".trace.json")
+
+
+def run_report():
+    global REPORT_WRITER, FLEET_PUSHER, REPORT_SPOOL, DATE
+    LoadGovernor.start_run()
+    try:
+        with Tracer.span("config_parse"):
+            Utils.parse_config_file(configparser)
+
+        if Utils.params["record"]:
+            ResultRecorder.start("record", Utils.params["record"])
+        elif Utils.params["replay"]:
+            ResultRecorder.start("replay", Utils.params["replay"])
+            DATE = ResultRecorder.recorded_date() or DATE
 
         if Utils.params["verbose"]:
             logging.getLogger().setLevel(logging.DEBUG)
+        LogPipeline.configure(Utils.get_config_int("log_rate_limit", 0))
+
+        with Tracer.span("sql_registry_load"):
+            SqlRegistry.load()
+
+        if Utils.params["format"]:
+            REPORT_WRITER = ReportWriter(Utils.params["format"], Utils.params["output"], DATE)
+
+        if Utils.params["push"]:
+            FLEET_PUSHER = FleetPusher(Utils.params["push"], Utils.config_host["current_host"],
+                                       DATE.strftime("%Y-%m-%d"))
+
+        if Utils.get_config_flag("spool_fragments"):
+            REPORT_SPOOL = ReportSpool(Utils.config.get("spool_dir"))
 
         # Initialize report content
         html_content, txt_content = initialize_report_content(Utils.config)
         
+        # Backups of all databases in one RMAN catalog query (rman_catalog)
+        RmanCatalog.load()
+
+        # Render worker processes (render_workers), forked before the database threads start
+        RenderStage.start()
+
         # Run database tests in parallel
         results = run_database_tests_threaded(Utils.config["oracle_dbs"], Utils.config)
         
         # Render database summary boxes
-        html_content += render_database_boxes(Utils.config["oracle_dbs"], results)
+        with Tracer.span("render_boxes"):
+            html_content += render_database_boxes(Utils.config["oracle_dbs"], results)
         
         # Check for alerts
         check_for_alerts(results)
@@ -591,29 +1137,65 @@ def main():
         html_content += "<tr><td>" + WARNING_MSG_PLACEHOLDER + "</td></tr>"
         txt_content += WARNING_MSG_PLACEHOLDER
         
+        # Delta mode: only changed sections, new alerts and summary boxes
+        delta = delta_report_day(Utils.config)
+
         # Add disk usage section
-        disk_html, disk_txt = add_disk_usage_section(Utils.config, Utils.config["oracle_dbs"])
-        html_content += disk_html
-        txt_content += disk_txt
+        with Tracer.span("disk_usage"):
+            disk_html, disk_txt = add_disk_usage_section(Utils.config, Utils.config["oracle_dbs"])
+        if not delta:
+            html_content += disk_html
+            txt_content += disk_txt
+        if FLEET_PUSHER is not None:
+            FLEET_PUSHER.push_host(disk_html, disk_txt)
         
+        if REPORT_SPOOL is not None:
+            # Database fragments were spooled as soon as each database finished
+            with Tracer.span("render_reports"):
+                html_path, txt_path = assemble_spooled_report(html_content, txt_content, Utils.config["oracle_dbs"],
+                                                              results, delta, Utils.config)
+            if REPORT_WRITER is not None:
+                REPORT_WRITER.close()
+            SqlRegistry.log_statistics()
+            deliver_report_files(html_path, txt_path)
+            ReportDelta.commit()
+            return
+
         # Append database-specific reports
-        reports_html, reports_txt = append_database_reports(results)
-        html_content += reports_html
-        txt_content += reports_txt
+        with Tracer.span("render_reports"):
+            if delta:
+                reports_html, reports_txt = append_delta_reports(Utils.config["oracle_dbs"], results)
+            else:
+                reports_html, reports_txt = append_database_reports(results)
+                if report_mode(Utils.config) == "delta":
+                    # full report day, new baseline for the following delta reports
+                    for dbs, res in zip(Utils.config["oracle_dbs"], results):
+                        if res is not None:
+                            ReportDelta.compare(dbs["db"], res)
+            html_content += reports_html
+            txt_content += reports_txt
         
-        # Finalize report content
-        html_content, txt_content = finalize_report_content(html_content, txt_content, Utils.config)
+            # Finalize report content
+            html_content, txt_content = finalize_report_content(html_content, txt_content, Utils.config)
         
+        if REPORT_WRITER is not None:
+            REPORT_WRITER.close()
+
+        SqlRegistry.log_statistics()
+
         # Output or send email
-        if Utils.params["verbose"]:
-            print(txt_content)
-        else:
-            email = EmailCreation(ALERT)
-            email.create_email(html_content, txt_content)
+        deliver_report(html_content, txt_content)
+        # delta baseline only once the report went out
+        ReportDelta.commit()
 
     except Exception as error:
         logging.warning(str(error))
         raise
+    finally:
+        RenderStage.shutdown()
+        if REPORT_SPOOL is not None:
+            REPORT_SPOOL.cleanup()
+        ResultRecorder.finish(DATE)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for Backup and Tablespace Analysis
+
+Runs selected parts of the report against databases from the config file
+and prints timings (best of --repeat runs) as text tables.
+
+Script usage:
+    backup_benchmark.py -f config_file -c sizing [-r 3]
+    backup_benchmark.py -f config_file -c memory [-d 200]
+    backup_benchmark.py -f config_file -c render [-d 200] [-w 8]
+    backup_benchmark.py -f config_file -c startup [-r 3]
+
+Cases:
+    sizing - exact (segment scan) vs fast (tablespace usage metrics) database size
+             and tablespace usage: elapsed time and result differences
+    memory - peak memory (tracemalloc) of in-memory report and MIME message
+             vs spooled fragments streamed into a message file, synthetic
+             report of --databases databases, no database or SMTP needed
+    render - rendering of --databases synthetic database results (tables,
+             text tables, section templates) inline in the database threads
+             vs render stage with 1, 2, 4 .. --workers processes
+    startup - python-oracledb Thin vs Thick mode: driver start, first connection
+              to every database and peak memory, each run in a fresh process
+"""
+
+import sys
+import os
+import time
+import logging
+import datetime
+import resource
+import tracemalloc
+import multiprocessing
+import configparser
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from optparse import OptionParser
+
+from lib.utils import Utils
+from lib.sql_registry import SqlRegistry
+from lib.database_tests import DatabaseTests
+from lib.database_usage import DatabaseUsage, DatabaseUnavailable
+from lib.report_spool import ReportSpool
+from lib.email_creation import EmailCreation
+from lib.render_stage import RenderStage
+
+logging.basicConfig(level=logging.WARNING, format="[%(asctime)s, %(name)s, %(levelname)s] %(message)s")
+
+
+def timed(repeat, func, *args):
+    """Best elapsed time of repeat runs and result of the last one"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def compare_sizes(exact_rows, fast_rows):
+    """Data size difference (second column) between exact and fast mode"""
+    exact_size = float(exact_rows[0][1] or 0)
+    fast_size = float(fast_rows[0][1] or 0)
+    pct = 100.0 * (fast_size - exact_size) / exact_size if exact_size else 0.0
+    return "data %.2f GB vs %.2f GB (%+.2f%%)" % (exact_size, fast_size, pct)
+
+
+def compare_tablespaces(exact_rows, fast_rows, key_cols):
+    """Max used MB / free % difference of tablespaces present in both modes"""
+    exact = {tuple(row[:key_cols]): row for row in exact_rows}
+    fast = {tuple(row[:key_cols]): row for row in fast_rows}
+    common = set(exact) & set(fast)
+    used_diff = max([abs(float(exact[key][key_cols + 1]) - float(fast[key][key_cols + 1])) for key in common] or [0])
+    pct_diff = max([abs(float(exact[key][key_cols + 4]) - float(fast[key][key_cols + 4])) for key in common] or [0])
+    return "%d common, %d only exact, %d only fast; max diff used %.0f MB, free %.2f%%" % (
+        len(common), len(set(exact) - common), len(set(fast) - common), used_diff, pct_diff)
+
+
+def synthetic_fragment(i):
+    """Html and txt fragment of similar size as one database report"""
+    row_html = "<tr><td>DB%04d</td><td>USERS</td><td>1024.00</td><td>512.00</td><td>50.00</td></tr>\n" % i
+    row_txt = "| DB%04d | USERS | 1024.00 | 512.00 | 50.00 |\n" % i
+    return "<table>\n%s</table>\n" % (row_html * 400), "=== DB%04d ===\n%s" % (i, row_txt * 400)
+
+
+def traced(func, *args):
+    """Elapsed time, peak traced memory and result of single run"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def report_in_memory(databases):
+    results = [synthetic_fragment(i) for i in range(databases)]
+    html = "".join(res[0] for res in results)
+    txt = "".join("\n" + res[1] for res in results)
+    msg_str = EmailCreation(False, connect=False)._build_message(html, txt)[2]
+    return len(msg_str.encode("utf-8"))
+
+
+def report_spooled(databases):
+    spool = ReportSpool()
+    try:
+        parts = [spool.put("db%04d" % i, *synthetic_fragment(i)) for i in range(databases)]
+        html_path = spool.assemble("html", parts)
+        txt_path = spool.assemble("txt", parts)
+        msg_path = EmailCreation(False, connect=False)._build_message_file(html_path, txt_path)[2]
+        size = os.path.getsize(msg_path)
+        os.remove(msg_path)
+        return size
+    finally:
+        spool.cleanup()
+
+
+def bench_memory(repeat, databases):
+    rows = []
+    for name, func in (("in memory", report_in_memory), ("spooled", report_spooled)):
+        best = None
+        for _ in range(repeat):
+            elapsed, peak, size = traced(func, databases)
+            best = (elapsed, peak, size) if best is None else min(best, (elapsed, peak, size))
+        rows.append([name, databases, best[2] / 1024.0 / 1024.0, best[1] / 1024.0 / 1024.0, best[0]])
+    return rows, ["Mode", "Databases", "Message [MB]", "Peak memory [MB]", "Elapsed [s]"]
+
+
+def synthetic_job(i, rows):
+    """Plain result data of one database as passed to RenderStage.render"""
+    now = datetime.datetime(2026, 1, 1, 22, 0)
+
+    def check(result, html_header, txt_header, **html_args):
+        ret_val = {"alert": False, "alert_msg": ""}
+        ret_val["columns"] = txt_header
+        ret_val["rows"] = result
+        ret_val["render"] = {"html_header": html_header, "html_prefix": "", "txt_prefix": "", "html_args": html_args}
+        return ret_val
+
+    backups = [(now, now, 1024.5, 512.25, "DB FULL", "SBT_TAPE", "COMPLETED")] * 14
+    tablespaces = [("TS_%04d" % n, 4, 1024.0 + n, 512.0, 1536.0 + n, 33.3, 32768.0) for n in range(rows)]
+    stats = [("TABLE_%04d" % n, "APP", now, "YES") for n in range(rows // 4)]
+    checks = {
+        "size": check([(2048.0, 1536.0)], ["Fizyczne [GB]", "Dane [GB]"], ["Physical [GB]", "Data [GB]"],
+                      style_class="half_tbl", caption="Database size"),
+        "fra": check([(100.0, 45.5)], ["Przydzielone [GB]", "Wolne [%]"], ["FRA size [GB]", "Free [%]"],
+                     style_class="half_tbl", caption="FRA usage"),
+        "full": check(backups, ["Start", "Koniec", "Wejście", "Wyjście", "Typ", "Urządzenie", "Status"],
+                      ["Start time", "End time", "Data input", "Data output", "Backup type", "Backup dev", "Status"],
+                      style_class="full_tbl", caption="Full backup"),
+        "arch": check(backups * 4, ["Start", "Koniec", "Wejście", "Wyjście", "Typ", "Urządzenie", "Status"],
+                      ["Start time", "End time", "Data input", "Data output", "Backup type", "Backup dev", "Status"],
+                      style_class="full_tbl", caption="Archivelog backup"),
+        "tbl": check(tablespaces, ["Tablespace", "Pliki", "Użycie", "Wolne", "Razem", "Wolne [%]", "Max"],
+                     ["Tablespace", "Files", "Used", "Free", "Total", "Free [%]", "Max"],
+                     index_to_test=5, style_class="full_tbl", caption="Tablespaces"),
+        "stats": check(stats, ["Tabela", "Właściciel", "Ostatnio analizowane", "Nieaktualne"],
+                       ["Table name", "Owner", "Last analysed", "Stale"], style_class="full_tbl",
+                       caption="Oldest statistics count"),
+    }
+    return {"db": "db%04d" % i,
+            "title": {"dbid": 1000000 + i, "db_version": "19.21.0.0.0", "check_logs": False, "lob_check": False,
+                      "dg_status": None, "multitenant": False, "pdb_val": []},
+            "sections": list(checks), "checks": checks, "pdbs": []}
+
+
+def render_fleet(databases, rows, threads):
+    """Render all databases from database threads, fragments kept in database order"""
+    jobs = [synthetic_job(i, rows) for i in range(databases)]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        fragments = list(executor.map(RenderStage.render, jobs))
+    return sum(len(fragment["html"]) + len(fragment["txt"]) for fragment in fragments)
+
+
+def bench_render(repeat, databases, workers, rows=400):
+    """Inline rendering in database threads vs render stage worker processes"""
+    Utils.config["section_size_budget"] = 0
+    threads = min(databases, 32)
+    counts = [0]
+    count = 1
+    while count < workers:
+        counts.append(count)
+        count *= 2
+    counts.append(workers)
+    table = []
+    baseline = None
+    for count in counts:
+        RenderStage.start(count)
+        try:
+            elapsed, size = timed(repeat, render_fleet, databases, rows, threads)
+        finally:
+            RenderStage.shutdown()
+        baseline = baseline or elapsed
+        table.append(["inline (threads)" if count == 0 else "%d processes" % count, databases, threads,
+                      size / 1024.0 / 1024.0, elapsed, baseline / elapsed])
+    return table, ["Render", "Databases", "DB threads", "Report [MB]", "Elapsed [s]", "Speedup"]
+
+
+def bench_sizing(repeat):
+    rows = []
+    for dbs in Utils.config["oracle_dbs"]:
+        multitenant = dbs.get("multitenant", False)
+        db = DatabaseTests(dbs)
+        cases = (
+            ("size", db.cdb_db_size if multitenant else db.db_size),
+            ("tablespaces", db.cdb_tblspc_usage if multitenant else db.tblspc_usage),
+        )
+        for name, check in cases:
+            elapsed = {}
+            result = {}
+            for mode in ("exact", "fast"):
+                Utils.config["sizing_mode"] = mode
+                elapsed[mode], ret_val = timed(repeat, check)
+                result[mode] = ret_val["rows"]
+            if name == "size":
+                diff = compare_sizes(result["exact"], result["fast"])
+            else:
+                diff = compare_tablespaces(result["exact"], result["fast"], 2 if multitenant else 1)
+            rows.append([dbs["db"].upper(), name, elapsed["exact"], elapsed["fast"],
+                         elapsed["exact"] / elapsed["fast"] if elapsed["fast"] else 0.0, diff])
+        db.db_connection.close_db()
+    return rows, ["Database", "Check", "Exact [s]", "Fast [s]", "Speedup", "Difference"]
+
+
+def startup_probe(config_file, driver_mode):
+    """Driver start and first connections in this (fresh) process: mode, seconds, failures, peak RSS [MB]"""
+    Utils.params["config_file"] = config_file
+    Utils.params["verbose"] = True
+    Utils.parse_config_file(configparser)
+    Utils.config["driver_mode"] = driver_mode
+    start = time.perf_counter()
+    mode = DatabaseUsage.driver_mode()
+    init = time.perf_counter() - start
+    failed = 0
+    start = time.perf_counter()
+    for dbs in Utils.config["oracle_dbs"]:
+        try:
+            DatabaseUsage(dbs).close_db()
+        except DatabaseUnavailable:
+            failed += 1
+    connect = time.perf_counter() - start
+    return mode, init, connect, failed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def bench_startup(repeat, config_file):
+    """Thin vs Thick mode, Thick mode cannot be left once initialized: every run in a new process"""
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for driver_mode in ("thin", "thick"):
+        best = None
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                mode, init, connect, failed, rss = executor.submit(startup_probe, config_file, driver_mode).result()
+            if best is None or init + connect < best[1] + best[2]:
+                best = (mode, init, connect, failed, rss)
+        mode, init, connect, failed, rss = best
+        rows.append([driver_mode, mode, len(Utils.config["oracle_dbs"]), failed, init, connect, init + connect, rss])
+    return rows, ["Requested", "Mode", "Databases", "Failed", "Driver init [s]", "Connect [s]", "Total [s]",
+                  "Peak RSS [MB]"]
+
+
+CASES = {
+    "sizing": bench_sizing,
+    "memory": bench_memory,
+    "render": bench_render,
+    "startup": bench_startup,
+}
+
+
+def main():
+    parser = OptionParser(usage="%prog [-f config_file] -c case [-r repeat]", prog="backup_benchmark.py")
+    parser.add_option("-f", "--file", dest="config_file", default="config.cfg",
+                      help="read configuration from given file")
+    parser.add_option("-c", "--case", dest="case", type="choice", choices=sorted(CASES),
+                      help="benchmark case: %s" % ", ".join(sorted(CASES)))
+    parser.add_option("-r", "--repeat", dest="repeat", type="int", default=3,
+                      help="runs per measurement, best time is reported")
+    parser.add_option("-d", "--databases", dest="databases", type="int", default=200,
+                      help="number of synthetic databases (memory and render case)")
+    parser.add_option("-w", "--workers", dest="workers", type="int", default=os.cpu_count() or 1,
+                      help="max render processes (render case), default number of CPUs")
+    (options, args) = parser.parse_args()
+    if options.case is None:
+        parser.error("benchmark case is required")
+
+    Utils.params["config_file"] = options.config_file
+    Utils.params["verbose"] = True
+    Utils.parse_config_file(configparser)
+    SqlRegistry.load()
+
+    if options.case == "memory":
+        rows, header = bench_memory(options.repeat, options.databases)
+    elif options.case == "render":
+        rows, header = bench_render(options.repeat, options.databases, options.workers)
+    elif options.case == "startup":
+        rows, header = bench_startup(options.repeat, options.config_file)
+    else:
+        rows, header = CASES[options.case](options.repeat)
+    print(Utils.create_txt_table(rows, header))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
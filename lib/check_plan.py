@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+# Declarative check plan, in report order.
+#   name     - node name, check nodes are also the key in results[i]["checks"]
+#   method   - DatabaseTests method name, or function of flags returning it
+#   args     - function of (dbs, deps) returning method arguments
+#   deps     - nodes whose results are needed (reused) by this node
+#   when     - function of flags, node is skipped when it returns False
+#   reason   - reason printed for node skipped by when (default "not configured")
+#   scope    - "db" (database / CDB), "pdb" (pooled PDB session) and/or "summary" (--summary, data of the
+#              summary boxes and backup alerts only)
+#   check    - report check (result kept, failures reported) or info node (failure skips database)
+#   cost     - estimated duration [s], replaced by the previous run timing when known
+#   priority - run order class, 1 (default): backup status and summary box data, 2: heavy diagnostics;
+#              with run_deadline the checks not started in time are reported as not collected
+PLAN = (
+    {"name": "db_major_version", "method": "db_major_version", "scope": ("db", "summary"), "check": False,
+     "cost": 0.1},
+    {"name": "db_version", "method": "db_version", "deps": ("db_major_version",), "scope": ("db", "summary"),
+     "args": lambda dbs, deps: (deps["db_major_version"]["major"],), "check": False, "cost": 0.1},
+    {"name": "dbid", "method": "dbid", "scope": ("db", "pdb", "summary"), "check": False, "cost": 0.1},
+    {"name": "dg_status", "method": "dg_status", "when": lambda flags: flags["dataguard"], "scope": ("db", "summary"),
+     "check": False, "cost": 2.0},
+    {"name": "pdbs", "method": "pdbs", "when": lambda flags: flags["multitenancy"], "scope": ("db",),
+     "check": False, "cost": 0.2},
+    {"name": "app_version", "method": lambda flags: "%s_version" % flags["version_check"],
+     "when": lambda flags: flags["version_check"], "scope": ("db", "pdb", "summary"), "check": False, "cost": 0.2},
+    {"name": "size", "method": lambda flags: "cdb_db_size" if flags["multitenancy"] else "db_size",
+     "scope": ("db", "summary"), "cost": 5.0},
+    {"name": "memory", "method": "db_memory", "scope": ("db", "summary"), "cost": 0.1},
+    {"name": "fra", "method": "fra_usage", "scope": ("db", "summary"), "cost": 0.2},
+    # with rman_catalog the DBID selects rows of the catalog query
+    {"name": "full", "method": "full_bck", "args": lambda dbs, deps: (dbs["db"].upper(),), "deps": ("dbid",),
+     "scope": ("db", "summary"), "cost": 1.0},
+    {"name": "arch", "method": "arch_bck", "args": lambda dbs, deps: (dbs["db"].upper(),), "deps": ("dbid",),
+     "scope": ("db", "summary"), "cost": 1.0},
+    {"name": "archlogs", "method": "archivelog_coverage", "args": lambda dbs, deps: (dbs["db"].upper(),),
+     "scope": ("db",), "cost": 0.5},
+    # newest backup of every datafile, incremental from the last evaluated backup record
+    {"name": "datafiles", "method": "datafile_coverage", "args": lambda dbs, deps: (dbs["db"].upper(),),
+     "deps": ("dbid",), "scope": ("db",), "cost": 1.0},
+    {"name": "logs", "method": "logs_test", "deps": ("dbid",), "when": lambda flags: flags["logs_check"],
+     "scope": ("db", "pdb"), "cost": 10.0, "priority": 2},
+    {"name": "cert", "method": "amms_infra_certs", "when": lambda flags: flags["version_check"] == "amms",
+     "scope": ("db", "pdb"), "cost": 0.2, "priority": 2},
+    {"name": "redo", "method": "redo_test", "deps": ("dbid",), "scope": ("db",), "cost": 0.5, "priority": 2},
+    {"name": "lob", "method": "edm_lobs", "args": lambda dbs, deps: (dbs["db"].upper(),),
+     "when": lambda flags: flags["lob_check"], "scope": ("db", "pdb"), "cost": 0.5, "priority": 2},
+    # with PDB sessions (oracle_pdbs) tablespaces and statistics are checked per PDB
+    {"name": "tbl", "method": lambda flags: "cdb_tblspc_usage" if flags["multitenancy"] else "tblspc_usage",
+     "when": lambda flags: not flags.get("pdb_sessions"), "reason": "checked per PDB", "scope": ("db", "pdb"),
+     "cost": 3.0, "priority": 2},
+    {"name": "stats", "method": "stats_test", "when": lambda flags: not flags.get("pdb_sessions"),
+     "reason": "checked per PDB", "scope": ("db", "pdb"), "cost": 2.0, "priority": 2},
+)
+
+
+class CheckPlan(object):
+    """Check plan of one database compiled into a DAG
+
+    Nodes are kept in PLAN (report) order, which is also a valid topological
+    order. Skipped nodes are listed with the reason, nodes depending on them
+    are skipped as well. Nodes run by priority, then in plan order; a node
+    never runs before its dependencies.
+    """
+
+    def __init__(self, dbs, flags, scope="db"):
+        self.dbs = dbs
+        self.scope = scope
+        self.nodes = []
+        self.skipped = []
+        skip_checks = set(dbs.get("skip_checks") or [])
+        names = set()
+        for spec in PLAN:
+            if scope not in spec["scope"]:
+                continue
+            reason = None
+            if spec["name"] in skip_checks:
+                reason = "skip_checks"
+            elif "when" in spec and not spec["when"](flags):
+                reason = spec.get("reason", "not configured")
+            else:
+                missing = [dep for dep in spec.get("deps", ()) if dep not in names]
+                if missing:
+                    reason = "needs %s" % ", ".join(missing)
+            if reason is not None:
+                self.skipped.append((spec["name"], reason))
+                continue
+            method = spec["method"](flags) if callable(spec["method"]) else spec["method"]
+            deps = spec.get("deps", ())
+            # not before its dependencies
+            priority = max([spec.get("priority", 1)] + [node["priority"] for node in self.nodes
+                                                        if node["name"] in deps])
+            self.nodes.append({"name": spec["name"], "method": method, "args": spec.get("args"),
+                               "deps": deps, "check": spec.get("check", True),
+                               "cost": spec["cost"], "priority": priority})
+            names.add(spec["name"])
+
+    def run_order(self):
+        """Nodes in execution order: priority, then plan order"""
+        return sorted(self.nodes, key=lambda node: node["priority"])
+
+    def check_names(self):
+        """Names of check nodes in plan order, the order of report sections"""
+        return [node["name"] for node in self.nodes if node["check"]]
+
+    def costs(self):
+        """Estimated node durations: previous run timings, PLAN defaults otherwise"""
+        timings = StateStore.get("plan", "%s/%s" % (self.scope, self.dbs["db"]), {}) or {}
+        return {node["name"]: float(timings.get(node["name"], node["cost"])) for node in self.nodes}
+
+    def critical_path(self, costs=None):
+        """Longest dependency chain: (estimated seconds, [node names])"""
+        costs = costs or self.costs()
+        finish = {}
+        path = {}
+        for node in self.nodes:
+            before = max(node["deps"], key=lambda dep: finish[dep]) if node["deps"] else None
+            finish[node["name"]] = costs[node["name"]] + (finish[before] if before else 0.0)
+            path[node["name"]] = (path[before] if before else []) + [node["name"]]
+        if not finish:
+            return 0.0, []
+        last = max(finish, key=finish.get)
+        return finish[last], path[last]
+
+    def describe(self, parallelism=1):
+        """Plan as text: nodes, dependencies, skipped nodes and time estimates"""
+        costs = self.costs()
+        lines = ["Check plan %s (%s scope, parallelism %d):" % (self.dbs["db"].upper(), self.scope, parallelism)]
+        for node in self.run_order():
+            lines.append("  %-18s %-22s p%d %7.2f s%s" % (
+                node["name"], node["method"], node["priority"], costs[node["name"]],
+                "  <- " + ", ".join(node["deps"]) if node["deps"] else ""))
+        for name, reason in self.skipped:
+            lines.append("  %-18s skipped (%s)" % (name, reason))
+        critical, path = self.critical_path(costs)
+        lines.append("  sequential estimate %.2f s, critical path %.2f s: %s" % (
+            sum(costs.values()), critical, " -> ".join(path)))
+        return "\n".join(lines)
+
+    def execute(self, run_node, parallelism=1):
+        """Run nodes, each as soon as its dependencies are done
+
+        :param run_node: function(node, deps) -> result, deps maps dependency names to their results
+        :param parallelism: max nodes running at once, 1 runs nodes one by one in run_order()
+        :return: {node name: result}
+        """
+        results = {}
+        timings = {}
+
+        def timed(node, deps):
+            start = time.perf_counter()
+            try:
+                return run_node(node, deps)
+            finally:
+                timings[node["name"]] = round(time.perf_counter() - start, 3)
+
+        if parallelism <= 1:
+            for node in self.run_order():
+                results[node["name"]] = timed(node, {dep: results[dep] for dep in node["deps"]})
+        else:
+            pending = self.run_order()
+            running = {}
+            with ThreadPoolExecutor(max_workers=parallelism,
+                                    thread_name_prefix="plan-%s" % self.dbs["db"]) as executor:
+                while pending or running:
+                    for node in [node for node in pending if all(dep in results for dep in node["deps"])]:
+                        pending.remove(node)
+                        future = executor.submit(timed, node, {dep: results[dep] for dep in node["deps"]})
+                        running[future] = node["name"]
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results[running.pop(future)] = future.result()
+
+        StateStore.put("plan", "%s/%s" % (self.scope, self.dbs["db"]), timings)
+        logger.info("%s plan done in %.2f s of node time, %d nodes",
+                    self.dbs["db"].upper(), sum(timings.values()), len(timings))
+        return results
@@ -1,8 +1,11 @@
-import re
-from jinja2 import Environment, FileSystemLoader
-import os
-import sys
-from .database_usage import DatabaseUsage
+import math
+from .database_usage import DatabaseUsage, CheckTimeout
+from .result_recorder import ResultRecorder
+from .rman_catalog import RmanCatalog
+from .render_stage import RenderStage
+from .sequence_ranges import SequenceRanges
+from .sql_registry import SqlRegistry
+from .state_store import StateStore
 from .utils import Utils
 import logging
 import datetime
@@ -13,7 +16,8 @@ logger = logging.getLogger(__name__)
 class DatabaseTests(object):
 
     db_connection = None  # type: DatabaseUsage
-    env = None
+    db_name = None
+    dbid_value = None
     
     # Alert constants
     ALERT_PREFIX = "<p>&raquo; "
@@ -47,55 +51,163 @@ class DatabaseTests(object):
     LBL_INSTALL_DATE = "Install date"
     LBL_DATABASE_VERSION = "Database version"
 
-    def __init__(self, db):
-        self.env = Environment(loader=FileSystemLoader('%s/sql/' % os.path.dirname(__file__)))
-        self.db_connection = DatabaseUsage(db)
+    # Application log tables counted by logs_test
+    LOG_TABLES = ("LOG_ZAPISY_AKT", "LOG_ZAPISY_ARCH")
+
+    def __init__(self, db, pool=None, container=None):
+        self.db_name = db["db"] if container is None else "%s_%s" % (db["db"], container)
+        self.db_connection = DatabaseUsage(db, pool=pool, container=container)
+
+    def check_failed(self, check, error):
+        """Result of a check whose query failed or timed out (call_timeout), remaining checks still run
+
+        :param error: QueryError or CheckTimeout
+        """
+        return DatabaseTests.failed_result(self.db_name, check, error)
+
+    @staticmethod
+    def failed_result(db_name, check, error):
+        """check_failed() result of db_name (upper case), also for checks whose session could not be opened"""
+        logger.warning("%s check %s failed: %s", db_name, check, error)
+        timed_out = isinstance(error, CheckTimeout)
+        ret_val = {"timed_out": timed_out, "error": str(error), "alert": False, "alert_msg": "", "timeout_alert": "",
+                   "columns": [], "rows": [], "size": None, "sga": None, "pga": None}
+        if timed_out and Utils.get_config_flag("call_timeout_alert"):
+            # collected by db_test_run, so checks without alert handling also raise it
+            ret_val["timeout_alert"] = DatabaseTests.ALERT_PREFIX + db_name + " %s %s</p>" % (check, error)
+        ret_val["html"] = "<h4 style='color:#c05621'>Przerwano: {0:}</h4>".format(error)
+        ret_val["txt"] = "Check failed: {0:}".format(error)
+        return ret_val
+
+    @staticmethod
+    def not_collected(check):
+        """Result of a check not started before the run deadline (run_deadline)"""
+        logger.info("Check %s not collected, run deadline reached", check)
+        return {"not_collected": True, "alert": False, "alert_msg": "", "columns": [], "rows": [],
+                "size": None, "sga": None, "pga": None,
+                "html": "<h4 style='color:#718096'>Nie zebrano - przekroczony czas raportu (run_deadline)</h4>",
+                "txt": "Not collected: run deadline reached"}
+
+    @staticmethod
+    def _sizing_sql(name):
+        """Size / tablespace statement for sizing_mode: exact (segment scan) or fast (usage metrics)
+        """
+        if str(Utils.config.get("sizing_mode") or "exact").strip().lower() == "fast":
+            return SqlRegistry.get(name + "_fast")
+        return SqlRegistry.get(name)
 
     def arch_bck(self, db_name):
         """Get ArchiveLog backup information
         """
         logger.debug("Archivelog Backup test")
         ret_val = {}
-        sql_template = self.env.get_template('archivelog_backup.sql')
-        sql = sql_template.render()
-        result = self.db_connection.execute_query(
-            sql, {"period": Utils.config["period"]})
+        result = self._backup_rows("archivelog_backup", "ARCH")
         if len(result) > 0:
-            ret_val["html"] = Utils.create_html_table(result, ["Start", "Koniec", "Wejście [MB]", "Wyjście [MB]", "Typ", "Urządzenie", "Status"], style_class="full_tbl", caption="Archivelog backup")
-            ret_val["txt"] = Utils.create_txt_table(result, ["Start time", "End time", "Data input", "Data output", "Backup type", "Backup dev", "Status"])
+            RenderStage.table(ret_val, result, ["Start", "Koniec", "Wejście [MB]", "Wyjście [MB]", "Typ", "Urządzenie", "Status"],
+                              ["Start time", "End time", "Data input", "Data output", "Backup type", "Backup dev", "Status"],
+                              style_class="full_tbl", caption="Archivelog backup")
             ret_val['alert'] = False
             ret_val['alert_msg'] = ""
         else:
             ret_val['alert'] = True
             ret_val['alert_msg'] = self.ALERT_PREFIX + db_name + " ARCH Backup missing</p>"
-            logger.warning(db_name + " ARCH Backup missing")
+            logger.warning("%s ARCH Backup missing", db_name)
             ret_val["html"] = "<h4 style='color:red'>UWAGA! Brak kopii w ramach ostatnich {0:} dni</h4>"\
                 .format(str(Utils.config["period"]))
             ret_val["txt"] = "UWAGA! Brak kopii w ramach ostatnich {0:} dni".format(
                 str(Utils.config["period"]))
         return ret_val
 
+    @staticmethod
+    def _format_ranges(ranges, limit=5):
+        """Sequence ranges as "12-14, 27", the first limit ranges"""
+        text = ", ".join(str(start) if start == end else "%s-%s" % (start, end) for start, end in ranges[:limit])
+        if len(ranges) > limit:
+            text += " ... (+%d)" % (len(ranges) - limit)
+        return text or "-"
+
+    def archivelog_coverage(self, db_name):
+        """Archived log sequence gaps and logs not backed up, per redo thread
+
+        Sequence ranges of v$archived_log and v$backup_redolog in the last archivelog_window_days
+        come aggregated from one query and are merged per thread (SequenceRanges), so the cost
+        follows the number of ranges, not the number of logs.
+        """
+        logger.debug("Archivelog coverage test")
+        window_days = Utils.get_config_int("archivelog_window_days", 7)
+        backup_hours = Utils.get_config_int("archivelog_backup_hours", 24)
+        result = self.db_connection.execute_query(SqlRegistry.get("archivelog_ranges"),
+                                                  {"window_days": window_days})
+        archived = {}
+        backed_up = {}
+        for kind, thread, first_sequence, last_sequence, first_time, next_time in result:
+            ranges = archived if kind == "ARCH" else backed_up
+            ranges.setdefault(thread, SequenceRanges()).add(first_sequence, last_sequence, first_time, next_time)
+        logger.debug("%s: %d sequence ranges of %d threads", self.db_name, len(result), len(archived))
+
+        now = datetime.datetime.now()
+        ret_val = {"gaps": 0, "unprotected": 0, "oldest_unprotected": None}
+        rows = []
+        late = []
+        for thread in sorted(archived):
+            logs = archived[thread]
+            backups = backed_up.get(thread, SequenceRanges())
+            gaps = logs.gaps()
+            unprotected = logs.missing(backups)
+            oldest = logs.first_time(unprotected[0][0], backups) if unprotected else None
+            ret_val["gaps"] += sum(end - start + 1 for start, end in gaps)
+            ret_val["unprotected"] += sum(end - start + 1 for start, end in unprotected)
+            if oldest is not None:
+                if ret_val["oldest_unprotected"] is None or oldest < ret_val["oldest_unprotected"]:
+                    ret_val["oldest_unprotected"] = oldest
+                if (now - oldest).total_seconds() > backup_hours * 3600:
+                    late.append(str(thread))
+            rows.append([str(thread), "%s-%s" % logs.bounds(), str(logs.count()), self._format_ranges(gaps),
+                         self._format_ranges(unprotected), oldest if oldest is not None else "-"])
+
+        alerts = []
+        if ret_val["gaps"]:
+            alerts.append("%d archived log sequences missing" % ret_val["gaps"])
+        if late:
+            alerts.append("archived logs not backed up for over %d h (thread %s)" % (backup_hours, ", ".join(late)))
+        ret_val["alert"] = bool(alerts)
+        ret_val["alert_msg"] = ""
+        if alerts:
+            ret_val["alert_msg"] = self.ALERT_PREFIX + db_name + " " + "; ".join(alerts) + "</p>"
+            logger.warning("%s %s", db_name, "; ".join(alerts))
+        if ret_val["oldest_unprotected"] is not None:
+            ret_val["oldest_unprotected"] = ret_val["oldest_unprotected"].isoformat()
+        RenderStage.table(ret_val, rows, ["Wątek", "Sekwencje", "Zarchiwizowane", "Luki", "Bez kopii",
+                                          "Najstarszy bez kopii"],
+                          ["Thread", "Sequences", "Archived", "Gaps", "Not backed up", "Oldest unprotected"],
+                          style_class="full_tbl", caption="Archivelog coverage")
+        return ret_val
+
+    def _backup_rows(self, template, kind):
+        """Backup rows from the RMAN catalog (rman_catalog), from the database itself otherwise"""
+        result = RmanCatalog.rows(self.dbid_value, kind)
+        if result is not None:
+            logger.debug("%s %s backups from RMAN catalog", self.db_name, kind)
+            return result
+        return self.db_connection.execute_query(SqlRegistry.get(template), {"period": Utils.config["period"]})
+
     def full_bck(self, db_name):
         """Get FULL backup information
         """
         logger.debug("FULL Backup test")
         ret_val = {}
-        sql_template = self.env.get_template('full_backup.sql')
-        sql = sql_template.render()
-        result = self.db_connection.execute_query(
-            sql, {"period": Utils.config["period"]})
+        result = self._backup_rows("full_backup", "FULL")
         if len(result) > 0:
-            ret_val["html"] = Utils.create_html_table(result, ["Start", "Koniec", "Wejście [GB]", "Wyjście [GB]",
-                                                               "Typ", "Urządzenie", "Status"], style_class="full_tbl",
-                                                      caption="Full backup")
-            ret_val["txt"] = Utils.create_txt_table(result, ["Start time", "End time", "Data input", "Data output",
-                                                             "Backup type", "Backup dev", "Status"])
+            RenderStage.table(ret_val, result, ["Start", "Koniec", "Wejście [GB]", "Wyjście [GB]",
+                                                "Typ", "Urządzenie", "Status"],
+                              ["Start time", "End time", "Data input", "Data output",
+                               "Backup type", "Backup dev", "Status"], style_class="full_tbl", caption="Full backup")
             ret_val['alert'] = False
             ret_val['alert_msg'] = ""
         else:
             ret_val['alert'] = True
             ret_val['alert_msg'] = self.ALERT_PREFIX + db_name + " FULL Backup missing</p>"
-            logger.warning(db_name + " FULL Backup missing")
+            logger.warning("%s FULL Backup missing", db_name)
             ret_val["html"] = "<h4 style='color:red'>UWAGA! Brak kopii w ramach ostatnich {0:} dni</h4>" \
                 .format(str(Utils.config["period"]))
             ret_val["txt"] = "UWAGA! Brak kopii w ramach ostatnich {0:} dni".format(
@@ -107,8 +219,7 @@ class DatabaseTests(object):
         """
         logger.debug("PDBs test")
         ret_val = []
-        sql_template = self.env.get_template('pdbs.sql')
-        sql = sql_template.render()
+        sql = SqlRegistry.get("pdbs")
         result = self.db_connection.execute_query(sql)
         if len(result) > 0:
             for item in result:
@@ -123,19 +234,16 @@ class DatabaseTests(object):
         """
         logger.debug("Tablespace size test")
         ret_val = {}
-        sql_template = self.env.get_template('tablespace_usage.sql')
-        sql = sql_template.render()
+        sql = self._sizing_sql("tablespace_usage")
         result = self.db_connection.execute_query(sql)
-        ret_val["html"] = Utils.create_html_table(
-            result, 
-            [self.HDR_TABLESPACE, self.HDR_ILOSC_PLIKOW, self.HDR_UZYCIE_MB,
-             self.HDR_WOLNE_MB, self.HDR_RAZEM_MB, self.HDR_WOLNE_PCT, self.HDR_MAX_MB],
-            index_to_test=5, style_class="full_tbl", caption="Tablespaces"
-        )
-        ret_val["txt"] = Utils.create_txt_table(
-            result, 
-            [self.HDR_TABLESPACE_NAME, self.HDR_NUM_FILES, self.HDR_USED_MB,
-             self.HDR_FREE_MB, self.HDR_TOTAL_MB, self.HDR_FREE_PCT, self.HDR_MAX_SPACE_MB]
+        RenderStage.table(
+            ret_val, result,
+            [self.HDR_TABLESPACE, self.HDR_ILOSC_PLIKOW, self.HDR_UZYCIE_MB, self.HDR_WOLNE_MB, self.HDR_RAZEM_MB,
+             self.HDR_WOLNE_PCT, self.HDR_MAX_MB],
+            [self.HDR_TABLESPACE_NAME, self.HDR_NUM_FILES, self.HDR_USED_MB, self.HDR_FREE_MB, self.HDR_TOTAL_MB,
+             self.HDR_FREE_PCT, self.HDR_MAX_SPACE_MB],
+            index_to_test=5, style_class="full_tbl", caption="Tablespaces",
+            attachment="%s_tablespaces" % self.db_name.upper()
         )
         return ret_val
 
@@ -144,87 +252,87 @@ class DatabaseTests(object):
         """
         logger.debug("CDB Tablespace size test")
         ret_val = {}
-        sql_template = self.env.get_template('cdb_tablespace_usage.sql')
-        sql = sql_template.render()
+        sql = self._sizing_sql("cdb_tablespace_usage")
         result = self.db_connection.execute_query(sql)
-        ret_val["html"] = Utils.create_html_table(
-            result,
-            ["Pluggable Database", self.HDR_TABLESPACE, self.HDR_ILOSC_PLIKOW, self.HDR_UZYCIE_MB,
-             self.HDR_WOLNE_MB, self.HDR_RAZEM_MB, self.HDR_WOLNE_PCT, self.HDR_MAX_MB],
-            index_to_test=6, style_class="full_tbl", caption="Tablespaces"
-        )
-        ret_val["txt"] = Utils.create_txt_table(
-            result,
-            ["Pluggable Database", self.HDR_TABLESPACE_NAME, self.HDR_NUM_FILES, self.HDR_USED_MB,
-             self.HDR_FREE_MB, self.HDR_TOTAL_MB, self.HDR_FREE_PCT, self.HDR_MAX_SPACE_MB]
+        RenderStage.table(
+            ret_val, result,
+            ["Pluggable Database", self.HDR_TABLESPACE, self.HDR_ILOSC_PLIKOW, self.HDR_UZYCIE_MB, self.HDR_WOLNE_MB,
+             self.HDR_RAZEM_MB, self.HDR_WOLNE_PCT, self.HDR_MAX_MB],
+            ["Pluggable Database", self.HDR_TABLESPACE_NAME, self.HDR_NUM_FILES, self.HDR_USED_MB, self.HDR_FREE_MB,
+             self.HDR_TOTAL_MB, self.HDR_FREE_PCT, self.HDR_MAX_SPACE_MB],
+            index_to_test=6, style_class="full_tbl", caption="Tablespaces",
+            attachment="%s_cdb_tablespaces" % self.db_name.upper()
         )
         return ret_val
 
     def stats_test(self):
+        """Oldest analysed tables and number of tables with stale statistics (dba_tab_statistics)
+        """
         logger.debug("TABLE statistics test")
         ret_val = {}
-        sql_template = self.env.get_template('table_statistics.sql')
-        sql = sql_template.render()
-        result = self.db_connection.execute_query(sql)
-        ret_val["html"] = Utils.create_html_table(result, ["Tabela", "Właściciel", "Ostation analizowane"],
-                                                  style_class="full_tbl", caption="Oldest statistics count")
-        ret_val["txt"] = Utils.create_txt_table(
-            result, ["Table name", "Owner", "Last analysed"])
+        owner = (Utils.config.get("stats_owner") or "").strip().upper() or None
+        top_rows = Utils.get_config_int("stats_top_rows", 10)
+        # separate statements with and without owner, each with its own access path
+        if owner:
+            result = self.db_connection.execute_query(SqlRegistry.get("table_statistics_owner"),
+                                                      {"owner": owner, "top_rows": top_rows})
+            stale = self.db_connection.execute_query(SqlRegistry.get("table_statistics_stale_count_owner"),
+                                                     {"owner": owner})
+        else:
+            # schemas of Oracle (oracle_maintained) and temporary tables are left out
+            result = self.db_connection.execute_query(SqlRegistry.get("table_statistics"), {"top_rows": top_rows})
+            stale = self.db_connection.execute_query(SqlRegistry.get("table_statistics_stale_count"))
+        ret_val["stale_count"] = stale[0][0]
+        html_prefix = "<p style=\"margin:0 0 6px 0; color:#4a5568; font-size:12px;\">Tabele z nieaktualnymi " \
+                      "statystykami{0:}: <strong>{1:}</strong></p>\n".format(
+                          " (" + owner + ")" if owner else "", ret_val["stale_count"])
+        RenderStage.table(ret_val, result, ["Tabela", "Właściciel", "Ostatnio analizowane", "Nieaktualne"],
+                          ["Table name", "Owner", "Last analysed", "Stale"], html_prefix=html_prefix,
+                          txt_prefix="Tables with stale statistics: {0:}\n".format(ret_val["stale_count"]),
+                          style_class="full_tbl", caption="Oldest statistics count")
         return ret_val
 
     def db_size(self):
         logger.debug("DB size")
         ret_val = {}
-        sql_template = self.env.get_template('database_size.sql')
-        sql = sql_template.render()
+        sql = self._sizing_sql("database_size")
         result = self.db_connection.execute_query(sql)
-        ret_val["html"] = Utils.create_html_table(
-            result,
+        ret_val["size"] = result[0][0]
+        RenderStage.table(
+            ret_val, result,
+            [self.HDR_FIZYCZNE_GB, self.HDR_DANE_GB],
             [self.HDR_FIZYCZNE_GB, self.HDR_DANE_GB],
             style_class="half_tbl", caption="Database size"
         )
-        ret_val["size"] = result[0][0]
-        ret_val["txt"] = Utils.create_txt_table(
-            result,
-            [self.HDR_FIZYCZNE_GB, self.HDR_DANE_GB]
-        )
         return ret_val
     
     def db_memory(self):
         logger.debug("DB memory delegation")
         ret_val = {}
-        sql_template = self.env.get_template('memory.sql')
-        sql = sql_template.render()
+        sql = SqlRegistry.get("memory")
         result = self.db_connection.execute_query(sql)
-        ret_val["html"] = Utils.create_html_table(
-            result,
-            [self.HDR_SGA_GB, self.HDR_PGA_GB],
-            style_class="half_tbl", caption="Database memory"
-        )
         ret_val["sga"] = result[0][0]
         ret_val["pga"] = result[0][1]
-        ret_val["txt"] = Utils.create_txt_table(
-            result,
-            [self.HDR_SGA_GB, self.HDR_PGA_GB]
+        RenderStage.table(
+            ret_val, result,
+            [self.HDR_SGA_GB, self.HDR_PGA_GB],
+            [self.HDR_SGA_GB, self.HDR_PGA_GB],
+            style_class="half_tbl", caption="Database memory"
         )
         return ret_val
 
     def fra_usage(self):
         logger.debug("Fast Recovery Area usage")
         ret_val = {}
-        sql_template = self.env.get_template('fra_usage.sql')
-        sql = sql_template.render()
+        sql = SqlRegistry.get("fra_usage")
         result = self.db_connection.execute_query(sql)
-        ret_val["html"] = Utils.create_html_table(
-            result,
+        ret_val["size"] = result[0][0]
+        RenderStage.table(
+            ret_val, result,
             [self.HDR_PRZYDZIELONE_GB, self.HDR_WOLNE_PCT],
+            ["FRA size [GB]", self.HDR_FREE_PCT],
             style_class="half_tbl", caption="FRA usage"
         )
-        ret_val["size"] = result[0][0]
-        ret_val["txt"] = Utils.create_txt_table(
-            result,
-            ["FRA size [GB]", self.HDR_FREE_PCT]
-        )
         return ret_val
 
     def cdb_db_size(self):
@@ -232,165 +340,394 @@ class DatabaseTests(object):
         """
         logger.debug("CDB size")
         ret_val = {}
-        sql_template = self.env.get_template('cdb_database_size.sql')
-        sql = sql_template.render()
+        sql = self._sizing_sql("cdb_database_size")
         result = self.db_connection.execute_query(sql)
-        ret_val["html"] = Utils.create_html_table(
-            result,
+        ret_val["size"] = result[0][0]
+        RenderStage.table(
+            ret_val, result,
+            [self.HDR_FIZYCZNE_GB, self.HDR_DANE_GB],
             [self.HDR_FIZYCZNE_GB, self.HDR_DANE_GB],
             style_class="half_tbl", caption="Database size"
         )
-        ret_val["size"] = result[0][0]
-        ret_val["txt"] = Utils.create_txt_table(
-            result,
-            [self.HDR_FIZYCZNE_GB, self.HDR_DANE_GB]
-        )
+        return ret_val
+
+    def _get_dbid(self):
+        """DBID of connected database, queried once"""
+        if self.dbid_value is None:
+            self.dbid_value = self.db_connection.execute_query(SqlRegistry.get("dbid"))[0][0]
+        return self.dbid_value
+
+    @staticmethod
+    def _format_count(val):
+        return "-" if val is None else "{0:,}".format(int(val))
+
+    def _log_counts_stats(self):
+        """Row counts from optimizer statistics (dba_tables.num_rows)"""
+        result = self.db_connection.execute_query(SqlRegistry.get("log_zapisy_stats"))
+        stats = {row[0]: row for row in result}
+        analyzed = [row[2] for row in result if row[2] is not None]
+        label = "Statystyki z {0:}".format(min(analyzed).strftime("%Y-%m-%d")) if analyzed else "Brak statystyk"
+        return [[label] + [self._format_count(stats[table][1] if table in stats else None)
+                           for table in self.LOG_TABLES]]
+
+    def _log_counts_sample(self):
+        """Row counts estimated from SAMPLE BLOCK with approximate 95% error bound
+
+        Blocks are the sampling units: the variance comes from the row counts of the sampled
+        blocks, sum(y^2) * (1 - f) / f^2, so uneven row density between blocks widens the bound.
+        logs_sample_pct is validated when the config is parsed.
+        """
+        pct = Utils.config.get("logs_sample_pct") or 1
+        fraction = pct / 100
+        row = ["Próbka {0:g}%".format(pct)]
+        for table in self.LOG_TABLES:
+            sampled, squares = self.db_connection.execute_query(
+                SqlRegistry.get("log_zapisy_sample", table=table, pct=pct))[0]
+            estimate = sampled / fraction
+            bound = 1.96 * math.sqrt(squares * (1 - fraction)) / fraction
+            row.append("{0:,.0f} ±{1:,.0f}".format(estimate, bound))
+        return [row]
+
+    def _log_counts_incremental(self):
+        """Cached count plus rows above the highest key seen in the previous run
+
+        Full recount when there is no cached state or it is older than logs_full_recount_days,
+        which also corrects the drift caused by rows deleted from the tables.
+        """
+        # validated when the config is parsed
+        key_column = Utils.config.get("logs_key_column") or "ID"
+        recount_days = Utils.get_config_int("logs_full_recount_days", 7)
+        section = "log_counts/%s" % self.db_name
+        state = StateStore.get(self._get_dbid(), section, {})
+        today = datetime.date.today()
+        row = []
+        for table in self.LOG_TABLES:
+            cached = state.get(table)
+            if cached and cached.get("key_column") == key_column and \
+                    (today - datetime.date.fromisoformat(cached["base_date"])).days < recount_days:
+                sql = SqlRegistry.get("log_zapisy_incremental", table=table, key_column=key_column, since=True)
+                delta, max_key = self.db_connection.execute_query(sql, {"last_key": cached["max_key"]})[0]
+                cached["count"] += delta
+                cached["max_key"] = max_key if max_key is not None else cached["max_key"]
+                logger.debug("%s %s: %d new rows since last run", self.db_name, table, delta)
+            else:
+                sql = SqlRegistry.get("log_zapisy_incremental", table=table, key_column=key_column, since=False)
+                count, max_key = self.db_connection.execute_query(sql)[0]
+                cached = {"count": count, "max_key": max_key, "key_column": key_column,
+                          "base_date": today.isoformat()}
+                logger.info("%s %s: full recount %d rows", self.db_name, table, count)
+            state[table] = cached
+            row.append(self._format_count(cached["count"]))
+        StateStore.put(self._get_dbid(), section, state)
+        base_date = min(state[table]["base_date"] for table in self.LOG_TABLES)
+        return [["Przyrostowo od {0:}".format(base_date)] + row]
+
+    def datafile_coverage(self, db_name):
+        """Datafiles whose newest backup or image copy is older than datafile_backup_days
+
+        Backup set (v$backup_datafile) and image copy (v$datafile_copy) records above the
+        control file recids of the previous run are read and merged into the newest
+        available checkpoint per datafile kept in StateStore. When the backup kept for
+        a datafile is no longer available (deleted, obsolete), or after
+        datafile_full_scan_days, or when the control file records were reset, all
+        records are read again. Read only datafiles need one backup of any age.
+        """
+        logger.debug("Datafile backup coverage test")
+        max_age = float(Utils.config.get("datafile_backup_days") or Utils.config["period"])
+        rescan_days = Utils.get_config_int("datafile_full_scan_days", 7)
+        section = "datafile_coverage/%s" % self.db_name
+        state = StateStore.get(self._get_dbid(), section, {})
+        today = datetime.date.today()
+        datafiles = self.db_connection.execute_query(SqlRegistry.get("datafiles"))
+        control_recid = (datafiles[0][4] if datafiles else 0) or 0
+        control_copy_recid = (datafiles[0][5] if datafiles else 0) or 0
+        rescan = not state or "last_copy_recid" not in state or state["last_recid"] > control_recid or \
+            state["last_copy_recid"] > control_copy_recid or \
+            (today - datetime.date.fromisoformat(state["base_date"])).days >= rescan_days
+        if not rescan:
+            available = {row[0] for row in self.db_connection.execute_query(SqlRegistry.get("datafile_sources"))}
+            gone = [key for key, entry in state["files"].items() if entry["source"] not in available]
+            if gone:
+                # an older backup of these files may still be available, only a full read finds it
+                logger.info("%s: newest backup of %d datafiles no longer available, full rescan", self.db_name,
+                            len(gone))
+                rescan = True
+        if rescan:
+            state = {"base_date": today.isoformat()}
+            last_recid = last_copy_recid = 0
+            checkpoints = {}
+        else:
+            last_recid = state["last_recid"]
+            last_copy_recid = state["last_copy_recid"]
+            checkpoints = state["files"]
+        backups = self.db_connection.execute_query(SqlRegistry.get("datafile_backups"),
+                                                   {"last_recid": last_recid, "last_copy_recid": last_copy_recid})
+        logger.debug("%s: %d datafiles with backups above recid %d / copies above recid %d", self.db_name,
+                     len(backups), last_recid, last_copy_recid)
+        for file_no, creation_change, checkpoint_time, source in backups:
+            key = "%s/%s" % (file_no, creation_change)
+            checkpoint = checkpoint_time.isoformat()
+            if key not in checkpoints or checkpoint > checkpoints[key]["checkpoint"]:
+                checkpoints[key] = {"checkpoint": checkpoint, "source": source}
+
+        now = datetime.datetime.now()
+        covered = {}
+        result = []
+        for file_no, name, creation_change, enabled, _, _ in datafiles:
+            # file number of a dropped datafile can be reused, creation SCN tells them apart
+            key = "%s/%s" % (file_no, creation_change)
+            entry = checkpoints.get(key)
+            if entry is None:
+                result.append([str(file_no), name, enabled, "-", None])
+                continue
+            covered[key] = entry
+            checkpoint_time = datetime.datetime.fromisoformat(entry["checkpoint"])
+            age = (now - checkpoint_time).total_seconds() / 86400
+            if age > max_age and enabled != "READ ONLY":
+                result.append([str(file_no), name, enabled, checkpoint_time, age])
+        StateStore.put(self._get_dbid(), section, dict(state, last_recid=control_recid,
+                                                       last_copy_recid=control_copy_recid, files=covered))
+
+        # files without backup first, then the oldest backups
+        result.sort(key=lambda row: float("inf") if row[4] is None else row[4], reverse=True)
+        result = [row[:4] + ["-" if row[4] is None else round(row[4], 1)] for row in result]
+        ret_val = {"datafiles": len(datafiles), "uncovered": len(result)}
+        ret_val["alert"] = bool(result)
+        ret_val["alert_msg"] = ""
+        if result:
+            ret_val["alert_msg"] = self.ALERT_PREFIX + db_name + " %d datafiles without backup in %g days</p>" % (
+                len(result), max_age)
+            logger.warning("%s %d of %d datafiles without backup in %g days", db_name, len(result), len(datafiles),
+                           max_age)
+        html_prefix = "<p style=\"margin:0 0 6px 0; color:#4a5568; font-size:12px;\">Pliki danych: {0:}, bez kopii " \
+                      "z ostatnich {1:g} dni: <strong>{2:}</strong></p>\n".format(len(datafiles), max_age, len(result))
+        RenderStage.table(ret_val, result, ["Nr", "Plik danych", "Status", "Ostatnia kopia / kopia obrazu (checkpoint)", "Wiek [dni]"],
+                          ["File#", "Datafile", "Status", "Last backup or copy checkpoint", "Age [days]"],
+                          html_prefix=html_prefix,
+                          txt_prefix="Datafiles: {0:}, without backup in {1:g} days: {2:}\n".format(
+                              len(datafiles), max_age, len(result)),
+                          style_class="full_tbl", caption="Datafile backup coverage",
+                          attachment="%s_datafile_coverage" % self.db_name.upper())
         return ret_val
 
     def logs_test(self):
+        """LOG_ZAPISY row counts, method from logs_count_method: exact, stats, sample or incremental
+        """
         logger.debug("LOG_ZAPISY test")
-        ret_val = {}
-        sql_template = self.env.get_template('log_zapisy_count.sql')
-        sql = sql_template.render()
-        result = self.db_connection.execute_query(sql)
-        ret_val["html"] = Utils.create_html_table(result, ["-", "Aktualne logi, do archiwizacji", "Logi zaarchiwizowane"],
-                                                  style_class="full_tbl", caption="Database Logs")
-        ret_val["txt"] = Utils.create_txt_table(
-            result, ["-", "Logs to be archived", "Logs archived"])
+        method = str(Utils.config.get("logs_count_method") or "exact").strip().lower()
+        ret_val = {"method": method}
+        if method == "stats":
+            result = self._log_counts_stats()
+        elif method == "sample":
+            result = self._log_counts_sample()
+        elif method == "incremental":
+            result = self._log_counts_incremental()
+        else:
+            ret_val["method"] = "exact"
+            sql = SqlRegistry.get("log_zapisy_count")
+            result = self.db_connection.execute_query(sql)
+        RenderStage.table(
+            ret_val, result,
+            ["-", "Aktualne logi, do archiwizacji", "Logi zaarchiwizowane"],
+            ["-", "Logs to be archived", "Logs archived"],
+            style_class="full_tbl", caption="Database Logs"
+        )
         return ret_val
 
     def amms_infra_certs(self):
         logger.debug("AMMS_INFRA.CERTS test")
         ret_val = {}
-        sql_template = self.env.get_template('amms_infra_certs.sql')
-        sql = sql_template.render()
+        sql = SqlRegistry.get("amms_infra_certs")
         result = self.db_connection.execute_query(sql)
-        ret_val["html"] = Utils.create_html_table(result, ["Moduł", "Plik", "Data zakończenia"],
-                                                  style_class="full_tbl", caption="AMMS certs")
-        ret_val["txt"] = Utils.create_txt_table(
-            result, ["Module", "File", "Expiration"])
+        RenderStage.table(
+            ret_val, result,
+            ["Moduł", "Plik", "Data zakończenia"],
+            ["Module", "File", "Expiration"],
+            style_class="full_tbl", caption="AMMS certs"
+        )
         return ret_val
 
+    @staticmethod
+    def _redo_statistics(hours, history_days):
+        """Peak, p95, average and 7 day trend of hourly log switches
+
+        :param hours: {"YYYY-MM-DD HH": switches}, hours without switches are counted as 0
+        """
+        now = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+        first = min([datetime.datetime.strptime(hour, "%Y-%m-%d %H") for hour in hours] or [now])
+        first = max(first, now - datetime.timedelta(days=history_days))
+        series = []
+        current = first
+        while current <= now:
+            series.append(hours.get(current.strftime("%Y-%m-%d %H"), 0))
+            current += datetime.timedelta(hours=1)
+        ranked = sorted(series)
+        stats = {
+            "p95": ranked[min(len(ranked) - 1, int(math.ceil(0.95 * len(ranked))) - 1)],
+            "avg": round(float(sum(series)) / len(series), 2),
+            "trend_pct": None,
+        }
+        # last 7 days against the 7 days before
+        if len(series) >= 14 * 24:
+            last, previous = sum(series[-7 * 24:]), sum(series[-14 * 24:-7 * 24])
+            stats["trend_pct"] = round(100.0 * (last - previous) / previous, 1) if previous else None
+        return stats
+
     def redo_test(self):
+        """Hourly redo log switches
+
+        Only the recent redo_window_hours are queried (whole redo_history_days on first run),
+        from a full hour on, and merged into the histogram kept per DBID in StateStore.
+        """
         logger.debug("Redo Logs test")
         ret_val = {}
-        sql_template = self.env.get_template('redo_logs_rotation.sql')
-        sql = sql_template.render()
-        result = self.db_connection.execute_query(sql)
-        ret_val["html"] = Utils.create_html_table(result, ["Max ilosc rotacji redo logów", "Data i godzina"],
-                                                  style_class="full_tbl", caption="Redo logs rotation")
-        ret_val["txt"] = Utils.create_txt_table(
-            result, ["Redo log rotation max", "Date and hour"])
+        window_hours = Utils.get_config_int("redo_window_hours", 48)
+        history_days = Utils.get_config_int("redo_history_days", 90)
+        section = "redo_histogram/%s" % self.db_name
+        history = StateStore.get(self._get_dbid(), section, {})
+        hours = history.get("hours", {})
+        if not hours:
+            window_hours = history_days * 24
+        elif history.get("last_run"):
+            # cover the whole gap since the previous run
+            since_last = datetime.datetime.now() - datetime.datetime.fromisoformat(history["last_run"])
+            window_hours = min(history_days * 24, max(window_hours, int(since_last.total_seconds() // 3600) + 2))
+
+        sql = SqlRegistry.get("redo_log_switches")
+        result = self.db_connection.execute_query(sql, {"window_hours": window_hours})
+        logger.debug("%s redo window %d h: %d hours with switches", self.db_name, window_hours, len(result))
+        for day_hour, switches in result:
+            hours[day_hour] = switches
+        oldest = (datetime.datetime.now() - datetime.timedelta(days=history_days)).strftime("%Y-%m-%d %H")
+        hours = {hour: switches for hour, switches in hours.items() if hour >= oldest}
+        StateStore.put(self._get_dbid(), section, {"hours": hours, "last_run": datetime.datetime.now().isoformat()})
+
+        stats = self._redo_statistics(hours, history_days)
+        top = sorted(hours.items(), key=lambda item: (item[1], item[0]), reverse=True)[:5]
+        result = [[switches, hour] for hour, switches in top]
+        ret_val["peak"] = result[0][0] if result else 0
+        ret_val.update(stats)
+        trend = "-" if stats["trend_pct"] is None else "{0:+.1f}%".format(stats["trend_pct"])
+        summary = [ret_val["peak"], stats["p95"], stats["avg"], trend]
+
+        html_prefix = "<p style=\"margin:0 0 6px 0; color:#4a5568; font-size:12px;\">Szczyt: <strong>{0:}/h</strong>" \
+                      " | p95: <strong>{1:}/h</strong> | średnio: {2:}/h | trend 7 dni: {3:}</p>\n".format(*summary)
+        RenderStage.table(ret_val, result, ["Max ilosc rotacji redo logów", "Data i godzina"],
+                          ["Redo log rotation max", "Date and hour"], html_prefix=html_prefix,
+                          txt_prefix="Peak: {0:}/h, p95: {1:}/h, avg: {2:}/h, 7 day trend: {3:}\n".format(*summary),
+                          style_class="full_tbl", caption="Redo logs rotation")
         return ret_val
 
+    def load_signal(self):
+        """Host CPU % and average active sessions of the last 60 s interval (v$sysmetric)"""
+        result = self.db_connection.execute_query(SqlRegistry.get("host_load"))
+        host_cpu, aas, num_cpus = result[0]
+        return {"host_cpu": float(host_cpu or 0), "aas": float(aas or 0), "num_cpus": int(num_cpus or 1)}
+
+    def dg_status(self):
+        """DataGuard configuration status from dgmgrl"""
+        return {"dg_status": ResultRecorder.call(self.db_name, "dgmgrl", Utils.get_dg_status, self.db_name)}
+
     def dbid(self):
         logger.debug("DBID test")
         ret_val = {}
-        sql = "select dbid from v$database"
+        sql = SqlRegistry.get("dbid")
         result = self.db_connection.execute_query(sql)
-        ret_val["html"] = Utils.create_html_table(
-            result,
-            ["DBID"],
-            style_class="full_tbl", caption=self.LBL_AMMS_VERSION
-        )
         ret_val["dbid"] = result[0][0]
-        ret_val["txt"] = Utils.create_txt_table(result, ["DBID"])
+        self.dbid_value = result[0][0]
+        RenderStage.table(ret_val, result, ["DBID"], ["DBID"], style_class="full_tbl", caption=self.LBL_AMMS_VERSION)
         return ret_val
 
     def amms_version(self):
         logger.debug("AMMS version test")
         ret_val = {}
-        sql = "select WER_SYS||'.'||WER_INT||'.'||WER_WEW as version, DT_INST as inst_date from sysadm.zainstal_skladnik  where WER_SYS <> 0 and KOD_SKLADN_INST = 'AP_AMMS'"
+        sql = SqlRegistry.get("amms_version")
         result = self.db_connection.execute_query(sql)
-        ret_val["html"] = Utils.create_html_table(
-            result,
+        ret_val["version"] = result[0][0]
+        RenderStage.table(
+            ret_val, result,
             ["Wersja AMMS", "Data instalacji"],
+            [self.LBL_AMMS_VERSION, self.LBL_INSTALL_DATE],
             style_class="full_tbl", caption=self.LBL_AMMS_VERSION
         )
-        ret_val["version"] = result[0][0]
-        ret_val["txt"] = Utils.create_txt_table(
-            result,
-            [self.LBL_AMMS_VERSION, self.LBL_INSTALL_DATE]
-        )
         return ret_val
 
     def im_version(self):
         logger.debug("InfoMedica version test")
         ret_val = {}
-        sql = "select distinct WER_SYS||'.'||WER_INT||'.'||WER_WEW as version, DT_INST as inst_date from sysadm.zainstal_skladnik  where WER_SYS <> 0 and KOD_SKLADN_INST in ('AP_LAB','AP_WMD')"
+        sql = SqlRegistry.get("im_version")
         result = self.db_connection.execute_query(sql)
-        ret_val["html"] = Utils.create_html_table(
-            result,
+        ret_val["version"] = result[0][0]
+        RenderStage.table(
+            ret_val, result,
             ["Wersja aplikacji", "Data instalacji"],
+            [self.LBL_APP_VERSION, self.LBL_INSTALL_DATE],
             style_class="full_tbl", caption=self.LBL_APP_VERSION
         )
-        ret_val["version"] = result[0][0]
-        ret_val["txt"] = Utils.create_txt_table(
-            result,
-            [self.LBL_APP_VERSION, self.LBL_INSTALL_DATE]
-        )
         return ret_val
 
     def docker_version(self):
         logger.debug("Docker APP version test")
         ret_val = {}
-        sql_template = self.env.get_template('app_docker_version.sql')
-        sql = sql_template.render()
+        sql = SqlRegistry.get("app_docker_version")
         result = self.db_connection.execute_query(sql)
-        ret_val["html"] = Utils.create_html_table(
-            result,
+        ret_val["version"] = result[0][2]
+        RenderStage.table(
+            ret_val, result,
             ["LP", "Komponent", "Wersja", "Data instlacji"],
+            ["No", "Component", "Version", self.LBL_INSTALL_DATE],
             style_class="full_tbl", caption=self.LBL_APP_VERSION
         )
-        ret_val["version"] = result[0][2]
-        ret_val["txt"] = Utils.create_txt_table(
-            result,
-            ["No", "Component", "Version", self.LBL_INSTALL_DATE]
-        )
         return ret_val
 
-    def db_version(self):
+    def db_major_version(self):
+        """Major database version, selects the version query in db_version"""
+        version_result = self.db_connection.execute_query(SqlRegistry.get("db_major_version"))
+        return {"major": int(version_result[0][0].split('.')[0])}
+
+    def db_version(self, db_major_version=None):
         logger.debug("Database version test")
         ret_val = {}
         
         # Check database version to determine which query to use
-        version_check_sql = "select VERSION from product_component_version where PRODUCT like 'Oracle%' and rownum = 1"
-        version_result = self.db_connection.execute_query(version_check_sql)
-        db_major_version = int(version_result[0][0].split('.')[0])
+        if db_major_version is None:
+            db_major_version = self.db_major_version()["major"]
         
         # Use version_full for Oracle 19c and newer, VERSION for older versions
         if db_major_version >= 19:
-            sql = "select product||'('||version_full||')' as db_ver from product_component_version where PRODUCT like 'Oracle%' and rownum = 1"
+            sql = SqlRegistry.get("db_version")
         else:
-            sql = "select * from (select product||'('||VERSION||')' as db_ver from product_component_version where PRODUCT like 'Oracle%') where rownum = 1"
+            sql = SqlRegistry.get("db_version_pre19")
         
         result = self.db_connection.execute_query(sql)
-        ret_val["html"] = Utils.create_html_table(
-            result,
+        ret_val["version"] = result[0][0]
+        RenderStage.table(
+            ret_val, result,
             ["Wersja bazy danych"],
+            [self.LBL_DATABASE_VERSION],
             style_class="full_tbl", caption=self.LBL_DATABASE_VERSION
         )
-        ret_val["version"] = result[0][0]
-        ret_val["txt"] = Utils.create_txt_table(result, [self.LBL_DATABASE_VERSION])
         return ret_val
 
     def edm_lobs(self, db_name):
         logger.debug("EDM LOBs test")
         ret_val = {}
-        sql_template = self.env.get_template('app_edm_lob.sql')
-        sql = sql_template.render()
+        sql = SqlRegistry.get("app_edm_lob")
         result = self.db_connection.execute_query(sql)
-        ret_val["html"] = Utils.create_html_table(result, ["Plik parycji", "Wielkość aktualna [GB]", "Max [GB]", "Data początkowa",
-                                                           "Data końcowa", "Lb. dni do konca"], style_class="full_tbl",
-                                                  index_to_test=5, caption="LOB partitions")
-        ret_val["txt"] = Utils.create_txt_table(result, ["Partition file", "Size [GB]", "Max [GB]", "Start date",
-                                                         "End date", "Days left"])
+        RenderStage.table(
+            ret_val, result,
+            ["Plik parycji", "Wielkość aktualna [GB]", "Max [GB]", "Data początkowa", "Data końcowa",
+             "Lb. dni do konca"],
+            ["Partition file", "Size [GB]", "Max [GB]", "Start date", "End date", "Days left"],
+            style_class="full_tbl", index_to_test=5, caption="LOB partitions"
+        )
         ret_val['alert'] = False
         ret_val['alert_msg'] = ""
         if result[0][5] <= float(Utils.config["period"])*5:
             ret_val['alert'] = True
             ret_val['alert_msg'] = self.ALERT_PREFIX + db_name + " Należy utworzyć nowe pliki parycji</p>"
-            logger.warning(db_name + " add new partition")
+            logger.warning("%s add new partition", db_name)
+            ret_val.pop("render", None)
             ret_val["html"] = "<h4 style='color:red'>UWAGA! Należy utworzyć nowe pliki parycji, pozostało {0:} dni</h4>" \
                 .format(str(round(float(Utils.config["period"])*5)))
             ret_val["txt"] = "UWAGA! Należy utworzyć nowe pliki parycji, pozostało {0:} dni".format(
@@ -2,101 +2,537 @@ import oracledb
 import logging
 import datetime
 import os
-import sys
+import re
+import time
+import random
+import threading
+import contextlib
+import hashlib
+from .tracing import Tracer
+from .sql_registry import SqlRegistry, SqlStatement
+from .utils import Utils
+from .result_recorder import ResultRecorder, ReplayPool
 
 logger = logging.getLogger(__name__)
 
+CONTAINER_RE = re.compile(r"^[A-Za-z][A-Za-z0-9_$#]*$")
+# call_timeout exceeded: thin mode, thick mode, server side
+TIMEOUT_ERRORS = ("DPY-4024", "DPI-1067", "ORA-03156")
+# transient errors worth a retry: listener refusals, connect timeouts, lost connections
+TRANSIENT_ERRORS = ("ORA-12170", "ORA-03113", "ORA-03114", "ORA-03135", "ORA-12514", "ORA-12516", "ORA-12518",
+                    "ORA-12519", "ORA-12520", "ORA-12528", "ORA-12537", "ORA-12541", "ORA-12547",
+                    "DPY-4011", "DPY-4005", "DPY-6005", "DPI-1080")
+# errors which will not go away during the run (credentials, account, unknown alias or service):
+# they open the circuit breaker of the database, transient ones only after the retries
+CIRCUIT_ERRORS = ("ORA-01017", "ORA-28000", "ORA-28001", "ORA-01031", "ORA-01045", "ORA-12154", "ORA-12505",
+                  "ORA-12514", "DPY-4000", "DPY-4026", "DPY-4027")
+
+
+class QueryError(Exception):
+    """Query of a check failed, the check is reported as failed"""
+
+
+class CheckTimeout(QueryError):
+    """Database call of a check exceeded its call_timeout"""
+
+    def __init__(self, seconds):
+        QueryError.__init__(self, "timed out after %d s" % seconds)
+        self.seconds = seconds
+
+
+class DatabaseUnavailable(Exception):
+    """Database cannot be connected: retries exhausted or circuit breaker open"""
+
+    def __init__(self, db_name, reason):
+        Exception.__init__(self, "%s unavailable: %s" % (db_name, reason))
+        self.db_name = db_name
+        self.reason = reason
+
 
 class DatabaseUsage(object):
 
     connection = None
-    _thick_mode_initialized = False
+    call_timeout = 0
+    # time.monotonic() when the call_timeout budget of the running check is used up
+    _call_deadline = None
+    # reason of a failed _reopen(), the remaining queries of this session fail with it
+    _lost = None
+    # python-oracledb mode of the process (thin / thick), selected at the first connection
+    _driver_mode = None
+    # databases failed with an error of CIRCUIT_ERRORS, not retried for the rest of the run
+    _open_circuits = {}
+    _slots = None
+    _lock = threading.Lock()
+
+    def __init__(self, db, pool=None, container=None):
+        """Connect to database, or take a session from pool and switch it to container (PDB)
+        """
+        # False once v$mystat turned out not to be readable
+        self._parse_stats = True
+        self._stmt_cache_size = Utils.get_config_int("stmtcachesize", 40)
+        self._db, self._pool, self._container = db, pool, container
+        if pool is not None:
+            self._acquire_from_pool(db, pool, container)
+        else:
+            self._connect_db(db)
+        if self.connection is not None:
+            self.connection.stmtcachesize = self._stmt_cache_size
 
-    def __init__(self, db):
-        self._connect_db(db)
+    @staticmethod
+    def _wallet_dir():
+        """Wallet directory: wallet_location, default tns_admin"""
+        return (Utils.config.get("wallet_location") or "").strip() or os.getenv("TNS_ADMIN")
+
+    @staticmethod
+    def _has_password(url):
+        """True when url is user/password@dsn, False for @dsn or user@dsn (credentials from wallet)"""
+        credentials = (url or "").rpartition("@")[0]
+        return "/" in credentials and credentials.split("/", 1)[1] != ""
+
+    @classmethod
+    def _thick_reason(cls):
+        """Why Thick mode is needed, None when Thin mode will do
+
+        Thin mode reads tnsnames.ora from config_dir and PEM wallets (ewallet.pem)
+        for TLS, credentials come from the url. Auto-login only wallets
+        (cwallet.sso) and the secure external password store (credentials
+        from the wallet, url without password) need the Oracle Client.
+        """
+        driver_mode = (Utils.config.get("driver_mode") or "auto").strip().lower()
+        if driver_mode == "thin":
+            return None
+        if driver_mode == "thick":
+            return "driver_mode = thick"
+        wallet = cls._wallet_dir()
+        if not wallet:
+            return None
+        if os.path.exists(os.path.join(wallet, "cwallet.sso")) and \
+                not os.path.exists(os.path.join(wallet, "ewallet.pem")):
+            return "auto-login wallet %s without ewallet.pem" % wallet
+        urls = [db["url"] for db in Utils.config.get("oracle_dbs") or []]
+        urls += Utils._parse_list_config_value(Utils.config.get("rman_catalog") or "")
+        external = [url.split("@")[-1] for url in urls if url and not cls._has_password(url)]
+        if external:
+            return "credentials from wallet %s for %s" % (wallet, ", ".join(external))
+        return None
 
     @classmethod
-    def _initialize_thick_mode(cls):
-        """Initialize oracledb in Thick mode if not already done"""
-        if cls._thick_mode_initialized:
+    def _init_driver(cls):
+        """Select python-oracledb mode once per process, before the first connection"""
+        if cls._driver_mode is not None:
             return
-            
+        with cls._lock:
+            if cls._driver_mode is not None:
+                return
+            with Tracer.span("driver_init"):
+                reason = cls._thick_reason()
+                if reason is not None and cls._init_oracle_client(reason):
+                    cls._driver_mode = "thick"
+                else:
+                    cls._driver_mode = "thin"
+                    thin_args = cls._thin_args()
+                    logger.info("oracledb in Thin mode (config_dir %s, wallet %s)", thin_args.get("config_dir"),
+                                thin_args.get("wallet_location"))
+
+    @classmethod
+    def driver_mode(cls):
+        """python-oracledb mode used for connections: thin or thick"""
+        cls._init_driver()
+        return cls._driver_mode
+
+    @staticmethod
+    def _init_oracle_client(reason):
+        """Load Oracle Client libraries from ORACLE_HOME, False when not available (Thin mode is used)"""
         oracle_home = os.getenv("ORACLE_HOME")
-        if oracle_home and os.getenv("TNS_ADMIN"):
+        if not oracle_home:
+            logger.warning("Thick mode needed (%s) but ORACLE_HOME is not set, using Thin mode", reason)
+            return False
+        lib_dir = os.path.join(oracle_home, "lib")
+        if not os.path.exists(lib_dir):
+            # Windows client
+            lib_dir = os.path.join(oracle_home, "bin")
+        if not os.path.exists(lib_dir):
+            logger.warning("Oracle Client library directory not found: %s, using Thin mode", lib_dir)
+            return False
+        try:
+            oracledb.init_oracle_client(lib_dir=lib_dir)
+        except oracledb.Error as e:
+            logger.warning("Could not initialize Thick mode: %s. Using Thin mode.", e)
+            return False
+        logger.info("Initialized oracledb in Thick mode from %s: %s", lib_dir, reason)
+        return True
+
+    @classmethod
+    def _thin_args(cls):
+        """Thin mode network configuration: tnsnames.ora directory and PEM wallet"""
+        args = {}
+        config_dir = (Utils.config.get("config_dir") or "").strip() or os.getenv("TNS_ADMIN")
+        if config_dir:
+            args["config_dir"] = config_dir
+        wallet = cls._wallet_dir()
+        if wallet:
+            args["wallet_location"] = wallet
+        if Utils.config.get("wallet_password"):
+            args["wallet_password"] = Utils.config["wallet_password"]
+        return args
+
+    @classmethod
+    def _connect_args(cls, db):
+        """Connection arguments: Thin mode url with credentials and wallet settings,
+        Thick mode TNS alias with credentials from the wallet (TNS_ADMIN)
+        """
+        cls._init_driver()
+        mode = oracledb.SYSDBA if db["sysdba"] else None
+        if cls._driver_mode == "thick" and os.getenv("TNS_ADMIN") is not None:
+            return {"dsn": db["db"], "mode": mode}
+        if db["url"] is None:
+            raise DatabaseUnavailable(db["db"].upper(), "no connection method available: no URL and no TNS_ADMIN")
+        args = {"dsn": db["url"] if cls._has_password(db["url"]) else db["db"], "mode": mode}
+        if cls._driver_mode == "thin":
+            args.update(cls._thin_args())
+        return args
+
+    @staticmethod
+    def _error_code(error):
+        code = getattr(error, "full_code", None)
+        if not code and getattr(error, "code", 0):
+            code = "ORA-%05d" % error.code
+        return code
+
+    @classmethod
+    def _is_transient(cls, error):
+        return cls._error_code(error) in TRANSIENT_ERRORS
+
+    @classmethod
+    def _opens_circuit(cls, error):
+        return cls._error_code(error) in CIRCUIT_ERRORS
+
+    @staticmethod
+    def _backoff(attempt):
+        """Full jitter exponential backoff delay in seconds"""
+        base = float(Utils.config.get("retry_base_delay") or 1)
+        cap = float(Utils.config.get("retry_max_delay") or 30)
+        return random.uniform(0, min(cap, base * 2 ** attempt))
+
+    @classmethod
+    def _slot(cls):
+        """One of max_concurrency database call slots shared by all threads (0 = unlimited)"""
+        if cls._slots is None:
+            with cls._lock:
+                if cls._slots is None:
+                    limit = Utils.get_config_int("max_concurrency", 0)
+                    cls._slots = threading.BoundedSemaphore(limit) if limit > 0 else contextlib.nullcontext()
+        return cls._slots
+
+    @classmethod
+    def circuit_open(cls, db_name):
+        """Reason of the circuit breaker failure of db_name, None when it may be connected"""
+        with cls._lock:
+            return cls._open_circuits.get(db_name.upper())
+
+    @classmethod
+    def _with_retry(cls, db, func, *args, **kwargs):
+        """Connect with func, retrying transient errors with backoff
+
+        Sleeping between attempts happens outside the concurrency slot.
+        Only errors of CIRCUIT_ERRORS open the circuit breaker of the database,
+        other errors (e.g. pool timeouts) fail this connection attempt only.
+        The outcome is kept for --replay when recording.
+        """
+        try:
+            result = cls._connect_with_retry(db, func, *args, **kwargs)
+        except DatabaseUnavailable as e:
+            if ResultRecorder.recording():
+                ResultRecorder.record(db["db"], "connect", error=e.reason)
+            raise
+        if ResultRecorder.recording():
+            ResultRecorder.record(db["db"], "connect")
+        return result
+
+    @staticmethod
+    def _replay_connect(db):
+        """Recorded connect outcome, DatabaseUnavailable when the recorded run failed to connect"""
+        entry = ResultRecorder.replay(db["db"], "connect")
+        if entry is not None and entry.get("error"):
+            raise DatabaseUnavailable(db["db"].upper(), entry["error"])
+
+    @classmethod
+    def _connect_with_retry(cls, db, func, *args, **kwargs):
+        db_name = db["db"].upper()
+        retries = Utils.get_config_int("connect_retries", 3)
+        attempt = 0
+        while True:
+            reason = cls.circuit_open(db_name)
+            if reason is not None:
+                raise DatabaseUnavailable(db_name, reason)
             try:
-                # Initialize Thick mode for Oracle Wallet support
-                lib_dir = os.path.join(oracle_home, "lib")
-                if not os.path.exists(lib_dir):
-                    # Try Windows path
-                    lib_dir = os.path.join(oracle_home, "bin")
-                
-                if os.path.exists(lib_dir):
-                    oracledb.init_oracle_client(lib_dir=lib_dir)
-                    logger.info(f"Initialized oracledb in Thick mode from: {lib_dir}")
-                    cls._thick_mode_initialized = True
-                else:
-                    logger.warning(f"Oracle Client library directory not found: {lib_dir}")
-            except Exception as e:
-                logger.warning(f"Could not initialize Thick mode: {str(e)}. Using Thin mode.")
+                with cls._slot():
+                    return func(*args, **kwargs)
+            except oracledb.DatabaseError as exc:
+                error = exc.args[0]
+                transient = cls._is_transient(error)
+                if not transient or attempt >= retries:
+                    if cls._opens_circuit(error):
+                        with cls._lock:
+                            cls._open_circuits[db_name] = str(error)
+                        logger.error("%s: %s, circuit open for this run", db_name, error)
+                    if not transient:
+                        raise DatabaseUnavailable(db_name, str(error))
+                    raise DatabaseUnavailable(db_name, "%s (after %d retries)" % (error, retries))
+                delay = cls._backoff(attempt)
+                attempt += 1
+                logger.warning("%s: %s, retry %d/%d in %.1f s", db_name, error, attempt, retries, delay)
+                time.sleep(delay)
+
+    @classmethod
+    def create_pool(cls, db, size):
+        """Session pool for parallel per-PDB sessions of a CDB
+        """
+        if ResultRecorder.replaying():
+            cls._replay_connect(db)
+            return ReplayPool()
+        connect_args = cls._connect_args(db)
+        logger.info("Creating session pool for %s (max %d sessions, %s mode)", db["db"].upper(), size,
+                    cls._driver_mode)
+        with Tracer.span("create_pool", db=db["db"]):
+            return cls._with_retry(db, oracledb.create_pool, min=1, max=size, increment=1, **connect_args)
+
+    def _acquire_from_pool(self, db, pool, container):
+        """Take pooled session and switch it to given container
+        """
+        if container is not None and not CONTAINER_RE.match(container):
+            raise ValueError("Invalid container name: %s" % container)
+        if ResultRecorder.replaying():
+            return self._replay_connect(db)
+        with Tracer.span("connect", db=db["db"], container=container):
+            self.connection = self._with_retry(db, pool.acquire)
+            if container is not None:
+                self._switch_container(container)
+                logger.info("Session for %s switched to container %s", db["db"].upper(), container.upper())
+
+    def _switch_container(self, container):
+        """alter session set container, QueryError when the container cannot be used (wrong name, closed PDB)
+
+        A session failing the switch is dropped from the pool.
+        """
+        try:
+            cur = self.connection.cursor()
+            try:
+                cur.execute("alter session set container = %s" % container)
+            finally:
+                cur.close()
+        except oracledb.DatabaseError as exc:
+            error = exc.args[0]
+            logger.warning("%s: cannot switch session to container %s: %s", self._db["db"].upper(), container.upper(),
+                           error)
+            try:
+                self._pool.drop(self.connection)
+            except oracledb.Error:
+                pass
+            self.connection = None
+            raise QueryError("container %s: %s" % (container.upper(), error))
 
     def _connect_db(self, db):
         """Connect to database
         """
+        if ResultRecorder.replaying():
+            return self._replay_connect(db)
+        with Tracer.span("connect", db=db["db"]):
+            self._with_retry(db, self._open_connection, db)
+
+    def _open_connection(self, db):
+        """Open connection: Thin mode with url credentials, Thick mode with wallet (TNS_ADMIN) credentials
+        """
+        connect_args = self._connect_args(db)
+        logger.info("Connecting to database: %s (%s mode)", db["db"].upper(), self._driver_mode)
         try:
-            # Initialize Thick mode if needed (for Oracle Wallet support)
-            self._initialize_thick_mode()
-            
-            logger.info("Connecting to database: " + db["db"].upper())
-            mode = oracledb.SYSDBA if db["sysdba"] else None
-            
-            # Check if TNS_ADMIN is set (indicates wallet usage)
-            tns_admin = os.getenv("TNS_ADMIN")
-            if tns_admin is not None:
-                logger.info("Using Oracle Wallet from TNS_ADMIN: " + tns_admin)
-                
-                # In Thick mode, TNS_ADMIN is automatically used
-                # Connect using just the DSN (TNS alias) - wallet provides credentials
-                self.connection = oracledb.connect(dsn=db["db"], mode=mode)
-                logger.info("Successfully connected using Oracle Wallet")
-                
-            elif db["url"] is not None:
-                # Traditional connection with username/password
-                logger.info("Using traditional connection with credentials")
-                self.connection = oracledb.connect(db["url"], mode=mode)
-            else:
-                raise ValueError("No connection method available: no URL and no TNS_ADMIN")
-                
+            self.connection = oracledb.connect(**connect_args)
         except oracledb.DatabaseError as exc:
             error_obj = exc.args[0]
-            logger.warning("Oracle-Error-Code: " + str(error_obj.code))
-            logger.warning("Oracle-Error-Message: " + str(error_obj))
-            logger.warning("TNS_ADMIN: " + str(os.getenv("TNS_ADMIN")))
-            logger.warning("ORACLE_HOME: " + str(os.getenv("ORACLE_HOME")))
-            logger.warning("Connection URL: " + str(db.get("url", "None")))
-            logger.warning("Connection DSN: " + str(db.get("db", "None")))
-            print("Oracle error: " + str(error_obj))
-            print("Check log file for detailed connection information")
-            sys.exit(error_obj.code)
+            logger.warning("Oracle-Error-Code: %s", error_obj.code)
+            logger.warning("Oracle-Error-Message: %s", str(error_obj))
+            logger.warning("Driver mode: %s, wallet: %s", self._driver_mode, self._wallet_dir())
+            logger.warning("TNS_ADMIN: %s", os.getenv("TNS_ADMIN"))
+            logger.warning("ORACLE_HOME: %s", os.getenv("ORACLE_HOME"))
+            logger.warning("Connection URL: %s", Utils.redact_url(db.get("url")))
+            logger.warning("Connection DSN: %s", db.get("db", "None"))
+            raise
+
+    def set_call_timeout(self, seconds):
+        """Limit all database calls of a check to seconds in total, 0 disables the limit
+
+        oracledb call_timeout applies to a single round trip, so every query gets
+        the time left of the check budget.
+        """
+        self.call_timeout = seconds
+        self._call_deadline = time.monotonic() + seconds if seconds else None
+        self._apply_call_timeout()
+
+    def _apply_call_timeout(self):
+        """Time left of the check budget as call_timeout of the connection, CheckTimeout when used up"""
+        if self.connection is None:
+            return
+        if self._call_deadline is None:
+            self.connection.call_timeout = 0
+            return
+        remaining = int((self._call_deadline - time.monotonic()) * 1000)
+        if remaining <= 0:
+            raise CheckTimeout(self.call_timeout)
+        self.connection.call_timeout = remaining
+
+    def _reopen(self):
+        """Replace session which is no longer usable (cancelled call, lost connection)
+
+        QueryError when no new session can be opened, the running and the later checks
+        of this session fail instead of the whole database being reported unavailable.
+        """
+        logger.warning("Session to %s unusable, reconnecting", self._db["db"].upper())
+        try:
+            if self._pool is not None:
+                try:
+                    self._pool.drop(self.connection)
+                except oracledb.Error:
+                    pass
+                self._acquire_from_pool(self._db, self._pool, self._container)
+            else:
+                try:
+                    self.connection.close()
+                except oracledb.Error:
+                    pass
+                self._connect_db(self._db)
+        except (DatabaseUnavailable, QueryError) as e:
+            self.connection = None
+            self._lost = "session lost, reconnect failed: %s" % (
+                e.reason if isinstance(e, DatabaseUnavailable) else e)
+            raise QueryError(self._lost)
+        self.connection.stmtcachesize = self._stmt_cache_size
 
     def close_db(self):
-        """Close database connection
+        """Close database connection, a pooled session goes back to the pool in the root container
         """
-        if self.connection is not None:
-            self.connection.close()
+        if self.connection is None:
+            return
+        if self._pool is not None and self._container is not None:
+            try:
+                cur = self.connection.cursor()
+                try:
+                    cur.execute("alter session set container = cdb$root")
+                finally:
+                    cur.close()
+            except oracledb.Error as e:
+                logger.warning("Session of %s not reset to CDB$ROOT, dropped from pool: %s", self._db["db"].upper(), e)
+                self._pool.drop(self.connection)
+                self.connection = None
+                return
+        self.connection.close()
+        self.connection = None
+
+    def _result_key(self, sql):
+        """(database or database_container, template name) of recorded result sets"""
+        db_key = self._db["db"] if self._container is None else "%s_%s" % (self._db["db"], self._container)
+        if isinstance(sql, SqlStatement):
+            return db_key, sql.name
+        return db_key, "adhoc_%s" % hashlib.sha1(sql.encode("utf-8")).hexdigest()[:12]
+
+    def parse_statistics(self):
+        """Parse counters of this session from v$mystat, None on replay or without access
+
+        The probe itself is neither recorded nor replayed (--record / --replay).
+        """
+        if ResultRecorder.replaying() or not self._parse_stats or self.connection is None:
+            return None
+        try:
+            return dict(self._execute(SqlRegistry.get("session_parse_stats"), None))
+        except QueryError as e:
+            logger.warning("%s: session statistics unavailable, parse counts off: %s", self._db["db"].upper(), e)
+            self._parse_stats = False
+            return None
+
+    @staticmethod
+    def parse_delta(before, after):
+        """Parse counters used between two parse_statistics() samples of one session
+
+        :return: {"parses", "hard_parses", "cache_hits"}, None when a sample is missing or the session was replaced
+        """
+        if before is None or after is None:
+            return None
+        delta = {"parses": after["parse count (total)"] - before["parse count (total)"],
+                 "hard_parses": after["parse count (hard)"] - before["parse count (hard)"],
+                 "cache_hits": after["session cursor cache hits"] - before["session cursor cache hits"]}
+        if min(delta.values()) < 0:
+            return None
+        return delta
 
     def execute_query(self, sql, params=None):
         """Execute SQL query
+
+        :param sql: SqlStatement from SqlRegistry or plain SQL text
+        :param params: bind parameters
         """
+        if ResultRecorder.mode is not None:
+            return self._execute_recorded(sql, params)
+        return self._execute(sql, params)
+
+    def _execute(self, sql, params):
+        """Execute with call timeout handling and retries of transient errors"""
+        if isinstance(sql, SqlStatement):
+            sql.check_params(params)
+            sql = sql.text
+        if self._lost is not None:
+            raise QueryError(self._lost)
+        retries = Utils.get_config_int("connect_retries", 3)
+        attempt = 0
+        while True:
+            try:
+                self._apply_call_timeout()
+                with self._slot():
+                    cur = self.connection.cursor()
+                    if params is not None:
+                        cur.execute(sql, params)
+                    else:
+                        cur.execute(sql)
+                    res = cur.fetchall()
+                    cur.close()
+                return res
+            except oracledb.DatabaseError as exc:
+                error = exc.args[0]
+                if self.call_timeout and self._error_code(error) in TIMEOUT_ERRORS:
+                    if not self.connection.is_healthy():
+                        self._reopen()
+                    raise CheckTimeout(self.call_timeout)
+                if not self._is_transient(error) or attempt >= retries:
+                    logger.warning("Oracle-Error-Code: %s", error.code)
+                    logger.warning("Oracle-Error-Message: %s", str(error))
+                    raise QueryError(str(error))
+                delay = self._backoff(attempt)
+                attempt += 1
+                logger.warning("%s: %s, query retry %d/%d in %.1f s", self._db["db"].upper(), str(error), attempt,
+                               retries, delay)
+                time.sleep(delay)
+                self._reopen()
+
+    def _execute_recorded(self, sql, params):
+        """execute_query with --record (result kept) or --replay (recorded result served)"""
+        db_key, name = self._result_key(sql)
+        if ResultRecorder.replaying():
+            if isinstance(sql, SqlStatement):
+                sql.check_params(params)
+            entry = ResultRecorder.replay(db_key, name)
+            if entry is None:
+                raise QueryError("%s: no recorded result of %s" % (db_key, name))
+            if entry.get("timeout") is not None:
+                raise CheckTimeout(entry["timeout"])
+            if entry.get("error") is not None:
+                raise QueryError(entry["error"])
+            return [tuple(row) for row in entry["rows"]]
         try:
-            cur = self.connection.cursor()
-            if params is not None:
-                cur.execute(sql, params)
-            else:
-                cur.execute(sql)
-            res = cur.fetchall()
-            cur.close()
-            return res
-        except oracledb.DatabaseError as exc:
-            logger.warning("Oracle-Error-Code: " + str(exc.args[0].code))
-            logger.warning("Oracle-Error-Message: " + str(exc.args[0]))
+            rows = self._execute(sql, params)
+        except CheckTimeout as e:
+            ResultRecorder.record(db_key, name, error=str(e), timeout=e.seconds)
+            raise
+        except QueryError as e:
+            ResultRecorder.record(db_key, name, error=str(e))
+            raise
+        ResultRecorder.record(db_key, name, rows)
+        return rows
 
@@ -7,9 +7,14 @@ from email.mime.base import MIMEBase
 from email import encoders
 import os
 import sys
+import uuid
+import base64
+import tempfile
 from .utils import Utils
+from .tracing import Tracer
 import logging
 import datetime
+import time
 
 ALERT = False
 ALERT_MSG = ""
@@ -23,9 +28,11 @@ class EmailCreation(object):
 
     alert = False
 
-    def __init__(self, alert):
+    def __init__(self, alert, connect=True):
         self.alert = alert
-        self._initialize_smtp_server()
+        if connect:
+            with Tracer.span("smtp_connect"):
+                self._initialize_smtp_server()
 
     def _attach_img(self, filename, file_id):
         """Attache img into email
@@ -47,6 +54,15 @@ class EmailCreation(object):
             sys.exit(1)
 
 
+    def _attach_file(self, filename, payload):
+        """Attach generated file (gzip-compressed CSV) into email
+        """
+        msg_file = MIMEBase('application', 'gzip')
+        msg_file.set_payload(payload)
+        encoders.encode_base64(msg_file)
+        msg_file.add_header('Content-Disposition', 'attachment', filename=filename)
+        return msg_file
+
     def _get_smtp_port(self, email_server, email_port):
         """Determine SMTP port to use"""
         if not email_port or email_port == '':
@@ -111,6 +127,33 @@ class EmailCreation(object):
     def create_email(self, html, text):
         """Create email
         """
+        with Tracer.span("mime_build"):
+            msg_root, emails, msg_str = self._build_message(html, text)
+
+        logger.info("Sending email to: " + Utils.config['email_addr'] + "; " + Utils.config['email_cc'])
+        with Tracer.span("smtp_send", size=len(msg_str)):
+            self._smtpserver.sendmail(msg_root['From'], emails, msg_str)
+            self._smtpserver.quit()
+
+    def create_email_from_files(self, html_path, text_path):
+        """Create email from spooled report files
+
+        The message is written to a temporary file and sent from it, so the
+        report is never held in memory as a whole.
+        """
+        with Tracer.span("mime_build"):
+            msg_root, emails, msg_path = self._build_message_file(html_path, text_path)
+        try:
+            logger.info("Sending email to: " + Utils.config['email_addr'] + "; " + Utils.config['email_cc'])
+            with Tracer.span("smtp_send", size=os.path.getsize(msg_path)):
+                self._send_file(msg_root['From'], emails, msg_path)
+                self._smtpserver.quit()
+        finally:
+            os.remove(msg_path)
+
+    def _message_root(self):
+        """Multipart/related root with headers and subject, and list of recipients
+        """
         msg_root = MIMEMultipart('related')
 
         msg_root['From'] = Utils.config['email_from']
@@ -132,6 +175,35 @@ class EmailCreation(object):
                 msg_root['X-Priority'] = "1 (Highest)"
         else:
             msg_root['Subject'] = "%s %s %s" % ("[BACKUP REPORT] ", Utils.config['email_title'], DATE.strftime("%Y-%m-%d"))
+        return msg_root, emails
+
+    def _inline_parts(self):
+        """Inline images and generated attachments
+        """
+        parts = [
+            self._attach_img("background-pattern-neutral.png", "background-pattern"),
+            self._attach_img("background-top-neutral.png", "background-top"),
+            self._attach_img("dbico.png", "dbicon"),
+            self._attach_img("hddico.png", "hddicon"),
+        ]
+        if Utils.config['logo'] is not None:
+            parts.append(self._attach_img(Utils.config['logo'], "logo"))
+        for filename, payload in Utils.attachments:
+            parts.append(self._attach_file(filename, payload))
+        return parts
+
+    def _log_message_size(self, msg_size, html_size, build_start):
+        logger.info("MIME message size: %.1f KB (html %.1f KB, %d attachments), built in %.3f s" %
+                    (msg_size / 1024, html_size / 1024, len(Utils.attachments), time.monotonic() - build_start))
+        size_budget = Utils.get_config_int('email_size_budget', 0)
+        if 0 < size_budget < msg_size / 1024:
+            logger.warning("MIME message size %.1f KB exceeds email_size_budget %d KB" % (msg_size / 1024, size_budget))
+
+    def _build_message(self, html, text):
+        """Assemble MIME message with inline images and attachments
+        """
+        build_start = time.monotonic()
+        msg_root, emails = self._message_root()
 
         msg_alternative = MIMEMultipart('alternative')
         msg_root.attach(msg_alternative)
@@ -141,21 +213,86 @@ class EmailCreation(object):
         msg_alternative.attach(txt_msg)
         msg_alternative.attach(html_msg)
 
-        background_pattern = self._attach_img("background-pattern-neutral.png", "background-pattern")
-        msg_root.attach(background_pattern)
+        for part in self._inline_parts():
+            msg_root.attach(part)
 
-        background_top = self._attach_img("background-top-neutral.png", "background-top")
-        msg_root.attach(background_top)
+        msg_str = msg_root.as_string()
+        self._log_message_size(len(msg_str.encode('utf-8')), len(html.encode('utf-8')), build_start)
+        return msg_root, emails, msg_str
 
-        db_icon = self._attach_img("dbico.png", "dbicon")
-        msg_root.attach(db_icon)
-        hdd_icon = self._attach_img("hddico.png", "hddicon")
-        msg_root.attach(hdd_icon)
+    @staticmethod
+    def _write_base64(out, path):
+        """Stream file content as base64 lines (57 input bytes per 76 char line)"""
+        with open(path, 'rb') as fp:
+            while True:
+                chunk = fp.read(57 * 1024)
+                if not chunk:
+                    break
+                out.write(base64.encodebytes(chunk))
 
-        if Utils.config['logo'] is not None:
-            logo_file = self._attach_img(Utils.config['logo'], "logo")
-            msg_root.attach(logo_file)
+    def _build_message_file(self, html_path, text_path):
+        """Write MIME message into a temporary file, report parts are streamed from the spool files
+        """
+        build_start = time.monotonic()
+        msg_root, emails = self._message_root()
+        related = "===============%s==" % uuid.uuid4().hex
+        alternative = "===============%s==" % uuid.uuid4().hex
+        msg_root.set_boundary(related)
+        headers = msg_root.as_bytes().split(b"\n\n", 1)[0]
 
-        logger.info("Sending email to: " + Utils.config['email_addr'] + "; " + Utils.config['email_cc'])
-        self._smtpserver.sendmail(msg_root['From'], emails, msg_root.as_string())
-        self._smtpserver.quit()
+        fd, msg_path = tempfile.mkstemp(prefix="backup_report_", suffix=".eml")
+        with os.fdopen(fd, 'wb') as out:
+            out.write(headers + b"\n\nThis is a multi-part message in MIME format.\n")
+            out.write(("--%s\nContent-Type: multipart/alternative; boundary=\"%s\"\nMIME-Version: 1.0\n\n" %
+                       (related, alternative)).encode('ascii'))
+            for subtype, path in (('plain', text_path), ('html', html_path)):
+                out.write(("--%s\nContent-Type: text/%s; charset=\"utf-8\"\nMIME-Version: 1.0\n"
+                           "Content-Transfer-Encoding: base64\n\n" % (alternative, subtype)).encode('ascii'))
+                self._write_base64(out, path)
+            out.write(("--%s--\n\n" % alternative).encode('ascii'))
+            for part in self._inline_parts():
+                out.write(("--%s\n" % related).encode('ascii'))
+                out.write(part.as_bytes() + b"\n")
+            out.write(("--%s--\n" % related).encode('ascii'))
+
+        self._log_message_size(os.path.getsize(msg_path), os.path.getsize(html_path), build_start)
+        return msg_root, emails, msg_path
+
+    def _send_file(self, from_addr, to_addrs, msg_path):
+        """SMTP transaction with DATA streamed from message file (CRLF line ends, dot-stuffing)
+        """
+        server = self._smtpserver
+        server.ehlo_or_helo_if_needed()
+        code, resp = server.mail(from_addr)
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+        refused = {}
+        for addr in to_addrs:
+            code, resp = server.rcpt(addr.strip())
+            if code not in (250, 251):
+                refused[addr] = (code, resp)
+        if len(refused) == len(to_addrs):
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, resp = server.docmd("data")
+        if code != 354:
+            raise smtplib.SMTPDataError(code, resp)
+        buf = []
+        buf_size = 0
+        with open(msg_path, 'rb') as fp:
+            for line in fp:
+                line = line.rstrip(b"\r\n")
+                if line.startswith(b"."):
+                    line = b"." + line
+                buf.append(line + b"\r\n")
+                buf_size += len(line) + 2
+                if buf_size >= 65536:
+                    server.send(b"".join(buf))
+                    buf = []
+                    buf_size = 0
+        buf.append(b".\r\n")
+        server.send(b"".join(buf))
+        code, resp = server.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
+        if refused:
+            logger.warning("Recipients refused: %s" % refused)
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import json
+import socket
+import socketserver
+import threading
+import tempfile
+import datetime
+import logging
+from .report_writer import ReportWriter
+
+logger = logging.getLogger(__name__)
+
+SAFE_NAME_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+class FleetPayload(object):
+    """Structured per-database / per-host payload exchanged between hosts and collector
+
+    A payload is a small ndjson document:
+      line 1 - metadata (everything needed for summary boxes and alerts)
+      line 2 - {"html": ...} report fragment
+      line 3 - {"txt": ...} report fragment
+      line 4 - {"checks": [...]} structured check records (database payloads only)
+    The collector reads only line 1 while merging, fragments are read one at a time
+    when the consolidated report is assembled.
+    """
+
+    META_KEYS = ("size", "alert", "alert_msg", "db_version", "version", "dbid", "sga", "pga", "dataguard")
+
+    @staticmethod
+    def database(host, db_name, result, report_date):
+        meta = {"kind": "database", "host": host, "db": db_name, "report_date": report_date,
+                "pushed_at": datetime.datetime.now().isoformat()}
+        for key in FleetPayload.META_KEYS:
+            if key in result:
+                meta[key] = ReportWriter._typed(result[key])
+        checks = list(ReportWriter.check_records(db_name, result))
+        return FleetPayload._dump([meta, {"html": result["html"]}, {"txt": result["txt"]}, {"checks": checks}])
+
+    @staticmethod
+    def host(host, html, txt, report_date):
+        meta = {"kind": "host", "host": host, "report_date": report_date,
+                "pushed_at": datetime.datetime.now().isoformat()}
+        return FleetPayload._dump([meta, {"html": html}, {"txt": txt}])
+
+    @staticmethod
+    def _dump(lines):
+        return "".join(json.dumps(line, ensure_ascii=False, default=str) + "\n" for line in lines).encode("utf-8")
+
+    @staticmethod
+    def file_name(meta):
+        if meta["kind"] == "host":
+            name = "host_%s" % meta["host"]
+        else:
+            name = "db_%s_%s_%s" % (meta.get("dbid"), meta["db"], meta["host"])
+        return SAFE_NAME_RE.sub("_", name) + ".ndjson"
+
+    @staticmethod
+    def store(directory, payload):
+        """Atomically store payload bytes in collector directory
+
+        ValueError or KeyError for metadata without kind/host/db, nothing is left behind.
+        """
+        meta = json.loads(payload.split(b"\n", 1)[0].decode("utf-8"))
+        if not isinstance(meta, dict):
+            raise ValueError("payload metadata is not an object")
+        target = os.path.join(directory, FleetPayload.file_name(meta))
+        fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=".incoming_")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(payload)
+            os.replace(tmp_name, target)
+        except OSError:
+            os.unlink(tmp_name)
+            raise
+        return target
+
+
+class FleetPusher(object):
+    """Push payloads to a collector directory or host:port socket"""
+
+    def __init__(self, target, host, report_date):
+        self.target = target
+        self.host = host
+        self.report_date = report_date
+        self.socket_address = None
+        if not os.path.isdir(target) and ":" in target:
+            addr, port = target.rsplit(":", 1)
+            self.socket_address = (addr or "localhost", int(port))
+        elif not os.path.isdir(target):
+            os.makedirs(target, exist_ok=True)
+
+    def _send(self, payload):
+        try:
+            if self.socket_address is not None:
+                with socket.create_connection(self.socket_address, timeout=30) as sock:
+                    sock.sendall(payload)
+                    sock.shutdown(socket.SHUT_WR)
+                    sock.recv(16)
+            else:
+                FleetPayload.store(self.target, payload)
+        except (OSError, ValueError) as e:
+            logger.warning("Fleet push to %s failed: %s" % (self.target, e))
+
+    def push_database(self, db_name, result):
+        logger.info("Pushing %s results to %s" % (db_name.upper(), self.target))
+        self._send(FleetPayload.database(self.host, db_name, result, self.report_date))
+
+    def push_host(self, html, txt):
+        logger.info("Pushing %s disk usage to %s" % (self.host, self.target))
+        self._send(FleetPayload.host(self.host, html, txt, self.report_date))
+
+
+class _PayloadHandler(socketserver.StreamRequestHandler):
+
+    # seconds a sending host may stay silent before the connection is dropped
+    timeout = 60
+
+    def handle(self):
+        try:
+            payload = self.rfile.read(self.server.max_payload + 1)
+        except OSError as e:
+            logger.warning("Rejected payload from %s: %s" % (self.client_address[0], e))
+            return
+        if not payload:
+            return
+        if len(payload) > self.server.max_payload:
+            logger.warning("Rejected payload from %s: larger than %d bytes" %
+                           (self.client_address[0], self.server.max_payload))
+            return
+        try:
+            target = FleetPayload.store(self.server.collect_dir, payload)
+            logger.info("Received payload from %s: %s" % (self.client_address[0], os.path.basename(target)))
+            self.wfile.write(b"OK\n")
+        except (ValueError, KeyError, OSError) as e:
+            logger.warning("Rejected payload from %s: %s" % (self.client_address[0], e))
+
+
+class FleetCollector(object):
+    """Merge pushed payloads by DBID and stream them into one report"""
+
+    def __init__(self, collect_dir):
+        self.collect_dir = collect_dir
+        os.makedirs(collect_dir, exist_ok=True)
+
+    def listen(self, address, window, max_payload):
+        """Receive payloads over TCP for window seconds, storing them in collect_dir
+
+        Payloads are not authenticated, without a host in address only local connections
+        are accepted; payloads larger than max_payload bytes are rejected.
+        """
+        addr, port = address.rsplit(":", 1)
+        server = socketserver.ThreadingTCPServer((addr or "localhost", int(port)), _PayloadHandler)
+        server.daemon_threads = True
+        server.collect_dir = self.collect_dir
+        server.max_payload = max_payload
+        logger.info("Collector listening on %s for %d s" % (address, window))
+        thread = threading.Thread(target=server.serve_forever, name="collector")
+        thread.start()
+        try:
+            threading.Event().wait(window)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    @staticmethod
+    def _read_meta(path):
+        with open(path, "r", encoding="utf-8") as fp:
+            return json.loads(fp.readline())
+
+    def merge(self, report_date, stale_days=7):
+        """Index payloads by DBID (databases) and host name (disk usage), newest push wins
+
+        Only metadata is kept in memory. Payloads of an earlier report date are
+        stale - the host did not push for this report - and are listed apart;
+        after stale_days they are ignored (decommissioned hosts).
+        :return: (databases, hosts, stale databases, stale hosts) - lists of (meta, path) sorted by name
+        """
+        databases = {}
+        hosts = {}
+        with os.scandir(self.collect_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".ndjson") or not entry.is_file():
+                    continue
+                try:
+                    meta = self._read_meta(entry.path)
+                except (ValueError, OSError) as e:
+                    logger.warning("Skipping unreadable payload %s: %s" % (entry.name, e))
+                    continue
+                if meta.get("kind") == "host":
+                    index, key = hosts, meta["host"]
+                else:
+                    index, key = databases, str(meta.get("dbid"))
+                if key not in index or index[key][0]["pushed_at"] < meta["pushed_at"]:
+                    index[key] = (meta, entry.path)
+        databases, stale_databases = self._split_stale(databases, report_date, stale_days)
+        hosts, stale_hosts = self._split_stale(hosts, report_date, stale_days)
+        logger.info("Collector merged %d databases from %d hosts, stale: %d databases, %d hosts" %
+                    (len(databases), len(hosts), len(stale_databases), len(stale_hosts)))
+        return (sorted(databases, key=lambda item: item[0]["db"]), sorted(hosts, key=lambda item: item[0]["host"]),
+                sorted(stale_databases, key=lambda item: item[0]["db"]),
+                sorted(stale_hosts, key=lambda item: item[0]["host"]))
+
+    @staticmethod
+    def _split_stale(index, report_date, stale_days):
+        """Payloads of report_date and stale ones, payloads older than stale_days are dropped"""
+        current = []
+        stale = []
+        today = datetime.date.fromisoformat(report_date)
+        for meta, path in index.values():
+            if meta.get("report_date") == report_date:
+                current.append((meta, path))
+                continue
+            try:
+                age = (today - datetime.date.fromisoformat(meta["report_date"])).days
+            except (KeyError, TypeError, ValueError):
+                age = None
+            if age is None or age > stale_days:
+                logger.info("Ignoring payload %s from %s (report date %s)" %
+                            (os.path.basename(path), meta.get("host"), meta.get("report_date")))
+                continue
+            stale.append((meta, path))
+        return current, stale
+
+    @staticmethod
+    def fragments(path):
+        """Read html and txt fragment of a single payload"""
+        with open(path, "r", encoding="utf-8") as fp:
+            fp.readline()
+            html = json.loads(fp.readline())["html"]
+            txt = json.loads(fp.readline())["txt"]
+        return html, txt
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+import contextlib
+import logging
+from .utils import Utils
+from .database_usage import QueryError
+
+logger = logging.getLogger(__name__)
+
+
+class LoadGovernor(object):
+    """Load-aware pacing of expensive checks on one database
+
+    The load signal (host CPU %, average active sessions per CPU) is read
+    from v$sysmetric before the plan starts and again before expensive
+    checks once it is older than load_sample_interval. Depending on the
+    level the governor:
+      ok         - runs checks as planned
+      busy       - serializes expensive checks (one at a time)
+      overloaded - delays expensive checks until the load drops, the delay
+                   budget (load_delay_max) or the run deadline is used up,
+                   then runs them serialized
+    It only ever lowers the configured parallelism. Every decision is logged.
+
+    The run deadline (run_deadline) is one budget for the whole run: checks
+    are not started after it minus deadline_reserve, the time kept for
+    rendering and sending the report.
+    """
+
+    run_start = time.monotonic()
+
+    def __init__(self, db_name):
+        self.db_name = db_name.upper()
+        self.enabled = Utils.get_config_flag("load_aware")
+        self.cpu_busy = float(Utils.config.get("load_cpu_busy") or 70)
+        self.cpu_overloaded = float(Utils.config.get("load_cpu_overloaded") or 90)
+        self.aas_busy = float(Utils.config.get("load_aas_busy") or 0.7)
+        self.aas_overloaded = float(Utils.config.get("load_aas_overloaded") or 1.5)
+        self.heavy_cost = float(Utils.config.get("load_heavy_cost") or 2.0)
+        self.interval = Utils.get_config_int("load_sample_interval", 60)
+        self.delay_step = Utils.get_config_int("load_delay_step", 30)
+        self.delay_budget = float(Utils.get_config_int("load_delay_max", 300))
+        self.level = "ok"
+        self.signal = None
+        self._sampled = None
+        self._serial = threading.Lock()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def start_run(cls):
+        cls.run_start = time.monotonic()
+
+    @classmethod
+    def budget(cls):
+        """run_deadline as seconds since run start, None without deadline
+
+        Seconds or HH:MM of the config are converted once, by Utils._parse_run_deadline_config
+        """
+        return Utils.config.get("run_deadline")
+
+    @classmethod
+    def remaining(cls):
+        """Seconds left until run_deadline, None without deadline"""
+        budget = cls.budget()
+        if budget is None:
+            return None
+        return max(0.0, budget - (time.monotonic() - cls.run_start))
+
+    @classmethod
+    def collect_remaining(cls):
+        """Seconds checks may still start: until run_deadline minus deadline_reserve, None without deadline"""
+        remaining = cls.remaining()
+        if remaining is None:
+            return None
+        return remaining - Utils.get_config_int("deadline_reserve", 60)
+
+    @classmethod
+    def collecting(cls):
+        """True while checks may start: run_deadline minus deadline_reserve not reached"""
+        remaining = cls.collect_remaining()
+        return remaining is None or remaining > 0
+
+    @classmethod
+    def delivery_wait(cls):
+        """Seconds the report still waits for database threads, None without deadline
+
+        Checks running when collection stopped get half of deadline_reserve to finish.
+        """
+        remaining = cls.remaining()
+        if remaining is None:
+            return None
+        return max(0.0, remaining - Utils.get_config_int("deadline_reserve", 60) / 2.0)
+
+    def _classify(self, signal):
+        aas_per_cpu = signal["aas"] / max(signal["num_cpus"], 1)
+        if signal["host_cpu"] >= self.cpu_overloaded or aas_per_cpu >= self.aas_overloaded:
+            return "overloaded"
+        if signal["host_cpu"] >= self.cpu_busy or aas_per_cpu >= self.aas_busy:
+            return "busy"
+        return "ok"
+
+    def sample(self, db, force=False):
+        """Refresh load level from db (DatabaseTests) when the last sample is too old"""
+        if not self.enabled:
+            return self.level
+        with self._lock:
+            if not force and self._sampled is not None and time.monotonic() - self._sampled < self.interval:
+                return self.level
+            self._sampled = time.monotonic()
+        try:
+            signal = db.load_signal()
+        except QueryError as e:
+            # no access to v$sysmetric: plan runs unchanged
+            logger.warning("%s load signal unavailable, load-aware scheduling off: %s", self.db_name, e)
+            self.enabled = False
+            return self.level
+        level = self._classify(signal)
+        logger.info("%s load: host CPU %.1f%%, AAS %.2f on %d CPUs -> %s", self.db_name, signal["host_cpu"],
+                    signal["aas"], signal["num_cpus"], level)
+        self.signal = signal
+        self.level = level
+        return level
+
+    def parallelism(self, db, configured):
+        """Plan parallelism for the current load, never above configured"""
+        level = self.sample(db, force=True)
+        if level != "ok" and configured > 1:
+            logger.info("%s decision: %s, check_parallelism %d -> 1", self.db_name, level, configured)
+            return 1
+        return configured
+
+    def _delay(self, db, name):
+        while self.level == "overloaded":
+            # delay ends before the deadline reserve, checks must not start inside it
+            remaining = self.collect_remaining()
+            step = min(self.delay_step, self.delay_budget, remaining if remaining is not None else self.delay_step)
+            if step <= 0:
+                logger.info("%s decision: %s still overloaded, delay budget or run deadline used up, "
+                            "running serialized", self.db_name, name)
+                return
+            logger.info("%s decision: delay %s by %d s (budget left %.0f s)", self.db_name, name, step,
+                        self.delay_budget)
+            time.sleep(step)
+            self.delay_budget -= step
+            self.sample(db, force=True)
+
+    @contextlib.contextmanager
+    def admit(self, node, cost, db):
+        """Run node directly (cheap check, normal load), delayed and/or serialized under load
+
+        Yields False when collection stopped (run_deadline) while the node was delayed,
+        the node must not run then.
+        """
+        if not self.enabled or cost < self.heavy_cost:
+            yield True
+            return
+        if self.sample(db) == "ok":
+            yield True
+            return
+        with self._serial:
+            # delay while holding the lock, other expensive checks wait as well
+            self._delay(db, node["name"])
+            if not self.collecting():
+                logger.info("%s decision: %s not started, run deadline reached while delayed", self.db_name,
+                            node["name"])
+                yield False
+                return
+            logger.info("%s decision: %s serialized (%s, estimated %.1f s)", self.db_name, node["name"], self.level,
+                        cost)
+            yield True
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import time
+import queue
+import atexit
+import threading
+import contextlib
+import logging
+import logging.handlers
+
+# args of these types are safe to format later in the listener thread
+IMMUTABLE_ARGS = (str, bytes, int, float, bool, type(None))
+FIELDS = ("db", "check", "elapsed", "parses", "cache_hits")
+
+
+class LogContext(object):
+    """Structured log fields (db, check) of the current thread"""
+
+    _local = threading.local()
+
+    @classmethod
+    def fields(cls):
+        return getattr(cls._local, "fields", {})
+
+    @classmethod
+    @contextlib.contextmanager
+    def bind(cls, **fields):
+        """Add fields to records logged by this thread inside the with-block"""
+        previous = cls.fields()
+        cls._local.fields = dict(previous, **fields)
+        try:
+            yield
+        finally:
+            cls._local.fields = previous
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per logger name, ERROR and above always pass
+
+    Suppressed records are counted and reported with the next record of the
+    logger that passes.
+    """
+
+    def __init__(self, rate=0, burst=None):
+        super(RateLimitFilter, self).__init__()
+        self.configure(rate, burst)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def configure(self, rate, burst=None):
+        """rate - records per second and logger, 0 disables the limit"""
+        self.rate = float(rate or 0)
+        self.burst = float(burst or max(self.rate * 10, 1))
+
+    def filter(self, record):
+        if self.rate <= 0 or record.levelno >= logging.ERROR:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, suppressed = self._buckets.get(record.name, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[record.name] = (tokens, now, suppressed + 1)
+                return False
+            self._buckets[record.name] = (tokens - 1, now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread
+
+    Only the structured fields of the calling thread are captured here;
+    records with mutable args are formatted right away, so the listener
+    never sees objects changed after the call.
+    """
+
+    def prepare(self, record):
+        fields = dict(LogContext.fields())
+        for name in FIELDS:
+            if name in record.__dict__:
+                fields[name] = record.__dict__[name]
+        record.fields = fields
+        args = record.args
+        if not isinstance(record.msg, str) or \
+                args and not (isinstance(args, tuple) and all(isinstance(arg, IMMUTABLE_ARGS) for arg in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class StructuredFormatter(logging.Formatter):
+    """Adds " [db=... check=... elapsed=...s]" with the fields set on the record"""
+
+    def format(self, record):
+        fields = getattr(record, "fields", {})
+        items = []
+        for name in FIELDS:
+            value = fields.get(name)
+            if value is None:
+                continue
+            items.append("%s=%s" % (name, "%.3fs" % value if name == "elapsed" else value))
+        record.structured = " [%s]" % " ".join(items) if items else ""
+        text = super(StructuredFormatter, self).format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += " (%d earlier messages of %s suppressed by log_rate_limit)" % (suppressed, record.name)
+        return text
+
+
+class LogPipeline(object):
+    """Root logging through a queue
+
+    Threads only put records on an in-memory queue; a single listener thread
+    formats them and does the file I/O and rotation, so workers never block
+    on the log volume.
+    """
+
+    listener = None
+    rate_limit = RateLimitFilter()
+
+    @classmethod
+    def start(cls, handler, fmt, level=logging.INFO):
+        handler.setFormatter(StructuredFormatter(fmt))
+        log_queue = queue.SimpleQueue()
+        queue_handler = DeferredQueueHandler(log_queue)
+        queue_handler.addFilter(cls.rate_limit)
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(queue_handler)
+        cls.listener = logging.handlers.QueueListener(log_queue, handler)
+        cls.listener.start()
+        atexit.register(cls.stop)
+
+    @classmethod
+    def configure(cls, rate_limit):
+        """Apply log_rate_limit (records per second and logger) from config"""
+        cls.rate_limit.configure(rate_limit)
+
+    @classmethod
+    def stop(cls):
+        """Flush queued records and stop the listener thread"""
+        if cls.listener is not None:
+            cls.listener.stop()
+            cls.listener = None
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from jinja2 import Environment, FileSystemLoader
+from .utils import Utils
+
+logger = logging.getLogger(__name__)
+
+env = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                       "templates")))
+env.filters['format_storage'] = Utils.format_storage_size
+
+# Report sections: check key -> (caption, full title)
+SECTION_TITLES = {
+    "fra": ("Fast Recovery Area", "Raport zajętość Fast Recovery Area:"),
+    "full": ("Full backup", "Raport wykonania kopii pełnych:"),
+    "arch": ("Archivelog", "Raport wykonania kopii archive-logów:"),
+    "archlogs": ("Archivelog coverage", "Ciągłość i kopie archive-logów:"),
+    "datafiles": ("Datafile coverage", "Pokrycie plików danych kopiami:"),
+    "logs": ("Logs info", "Raport z migracji logów aplikacji:"),
+    "cert": ("AMMS cert", "Informacje o certyfikatach AMMS:"),
+    "redo": ("Redo logs", "Max rotacja redo logów:"),
+    "lob": ("Lob partitions", "Partycje lob i czas obowiązywania:"),
+    "tbl": ("Tablespaces", "Raport przestrzeni tabel:"),
+    "stats": ("Oldest statistics", "Raport statystyk tabel:"),
+}
+
+
+def render_table(caption, full_title, db_name, table_html, id_postfix):
+    """Renders table test content
+    """
+    logger.info("%s %s", caption, db_name)
+    template = env.get_template('test_table.html.j2')
+    html = template.render(caption=caption, full_title=full_title, dbname=db_name, table_html=table_html, postfix=id_postfix)
+    return html
+
+
+def render_section(dbs, key, ret_val):
+    """Render check result as report section, titles from SECTION_TITLES"""
+    caption, full_title = SECTION_TITLES[key]
+    return render_table(caption, full_title, dbs["db"], ret_val["html"], key)
+
+
+def render_check(ret_val):
+    """Render html and txt of a check result kept as table spec (RenderStage.table)"""
+    spec = ret_val.pop("render", None)
+    if spec is not None:
+        ret_val["html"] = spec["html_prefix"] + Utils.create_html_table(ret_val["rows"], spec["html_header"],
+                                                                        **spec["html_args"])
+        ret_val["txt"] = spec["txt_prefix"] + Utils.create_txt_table(ret_val["rows"], ret_val["columns"])
+    return ret_val
+
+
+def render_db_title(dbs, dbid, db_version, check_logs, lob_check, dg_status, multitenant, pdb_val):
+    """Render database title section (HTML and text)"""
+    if multitenant:
+        template = env.get_template('db_title_cdb.html.j2')
+        html_content = template.render(
+            dbname=dbs["db"], dbid=dbid, check_logs=check_logs,
+            lob_check=lob_check, pdb_val=pdb_val,
+            dg_status=dg_status, db_version=db_version
+        )
+        text_content = "=== Database: %s (DBID: %s, ver.: %s) ===\n\n" % (dbs["db"].upper(), dbid, db_version)
+        if dg_status:
+            text_content += " DataGuard status: {0:}\n".format(dg_status)
+        for pdb in pdb_val:
+            text_content += " * {0:} ({1:})\n".format(pdb['pdb'], pdb['guid'])
+    else:
+        template = env.get_template('db_title.html.j2')
+        html_content = template.render(
+            dbname=dbs["db"], dbid=dbid, check_logs=check_logs,
+            lob_check=lob_check, dg_status=dg_status, db_version=db_version
+        )
+        text_content = "=== Database: %s (DBID: %s, ver.: %s) ===\n\n" % (dbs["db"].upper(), dbid, db_version)
+        if dg_status:
+            text_content += " DataGuard status: {0:}\n".format(dg_status)
+
+    return html_content, text_content
+
+
+def check_alerts(sections, checks):
+    """Alerts of check results in plan order: (alert, alert_msg)"""
+    alert = False
+    alert_msg = ""
+    for name in sections:
+        ret_val = checks[name]
+        if ret_val.get("alert"):
+            alert = True
+            alert_msg += ret_val["alert_msg"]
+        # Timed out checks (call_timeout), alert only with call_timeout_alert = yes
+        if ret_val.get("timeout_alert"):
+            alert = True
+            alert_msg += ret_val["timeout_alert"]
+    return alert, alert_msg
+
+
+def render_plan_sections(dbs, sections, checks):
+    """Render check results in plan order
+
+    :param sections: names of check nodes in plan order
+    :return: (html, txt, alert, alert_msg)
+    """
+    html_content = ""
+    text_content = ""
+    for name in sections:
+        ret_val = render_check(checks[name])
+        if name in SECTION_TITLES:
+            text_content += "--- %s ---\n" % SECTION_TITLES[name][0]
+            html_content += render_section(dbs, name, ret_val)
+        text_content += "%s\n" % ret_val["txt"]
+    alert, alert_msg = check_alerts(sections, checks)
+    return html_content, text_content, alert, alert_msg
+
+
+def render_pdb(cdb, pdb_data):
+    """PDB title and sections: (html, txt, alert, alert_msg)"""
+    section_dbs = {"db": pdb_data["section_db"]}
+    template = env.get_template('pdb_title.html.j2')
+    html_content = template.render(anchor=section_dbs["db"], pdb=pdb_data["pdb"], cdb=cdb,
+                                   version=pdb_data["version"], check_logs="logs" in pdb_data["checks"],
+                                   lob_check="lob" in pdb_data["checks"])
+    text_content = "\n== PDB %s (%s) ==\n" % (pdb_data["pdb"].upper(), cdb.upper())
+    if pdb_data["version"]:
+        text_content += " App version: %s\n" % pdb_data["version"]
+    sections_html, sections_txt, alert, alert_msg = render_plan_sections(section_dbs, pdb_data["sections"],
+                                                                         pdb_data["checks"])
+    return html_content + sections_html, text_content + sections_txt, alert, alert_msg
+
+
+def render_database(job):
+    """Database fragment from plain result data
+
+    :param job: {"db", "title": render_db_title kwargs, "sections", "checks", "pdbs": [pdb data]}
+    :return: {"html", "txt", "alert", "alert_msg", "checks" (rendered), "pdbs" (rendered checks)}
+    """
+    dbs = {"db": job["db"]}
+    html_content, text_content = render_db_title(dbs, **job["title"])
+    sections_html, sections_txt, alert, alert_msg = render_plan_sections(dbs, job["sections"], job["checks"])
+    html_content += sections_html
+    text_content += sections_txt
+    for pdb_data in job["pdbs"]:
+        pdb_html, pdb_txt, pdb_alert, pdb_alert_msg = render_pdb(job["db"], pdb_data)
+        html_content += pdb_html
+        text_content += pdb_txt
+        alert = alert or pdb_alert
+        alert_msg += pdb_alert_msg
+    return {"html": html_content, "txt": text_content, "alert": alert, "alert_msg": alert_msg,
+            "checks": job["checks"], "pdbs": job["pdbs"]}
+
+
+def _init_worker(config, config_host):
+    """Render worker process: report config, no log output (records of workers are dropped)"""
+    Utils.config = config
+    Utils.config_host = config_host
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.NullHandler())
+
+
+def _render_in_worker(job):
+    Utils.attachments = []
+    result = render_database(job)
+    result["attachments"] = Utils.attachments
+    return result
+
+
+class RenderStage(object):
+    """Rendering of database fragments, inline or in a process pool
+
+    With render_workers > 0 checks keep plain table specs (rows, headers,
+    options) instead of html/txt, and each database fragment - table cells,
+    texttable drawing, section templates - is rendered in one of the worker
+    processes, outside the GIL of the collecting threads. Fragments come
+    back to the database thread, so report order does not change. csv.gz
+    attachments created by workers are registered in the main process.
+    """
+
+    _executor = None
+
+    @classmethod
+    def start(cls, workers=None):
+        """Start worker processes, before database threads are started"""
+        workers = Utils.get_config_int("render_workers", 0) if workers is None else workers
+        if workers <= 0:
+            return
+        # fork while only the log listener thread runs, workers inherit loaded modules
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork") if "fork" in methods else None
+        cls._executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                            initargs=(Utils.config, Utils.config_host))
+        cls._executor.submit(int).result()
+        logger.info("Render stage: %d worker processes", workers)
+
+    @classmethod
+    def deferred(cls):
+        """True when checks leave rendering to the render stage"""
+        return cls._executor is not None
+
+    @staticmethod
+    def table(ret_val, result, html_header, txt_header, html_prefix="", txt_prefix="", **html_args):
+        """Keep check result table with raw rows and column names, rendered now or in the render stage
+
+        :param html_args: Utils.create_html_table options (index_to_test, style_class, caption, attachment)
+        """
+        ret_val["columns"] = txt_header
+        ret_val["rows"] = result
+        ret_val["render"] = {"html_header": html_header, "html_prefix": html_prefix, "txt_prefix": txt_prefix,
+                             "html_args": html_args}
+        if not RenderStage.deferred():
+            render_check(ret_val)
+        return ret_val
+
+    @classmethod
+    def render(cls, job):
+        """Render database fragment, see render_database()"""
+        if cls._executor is None:
+            return render_database(job)
+        result = cls._executor.submit(_render_in_worker, job).result()
+        for file_name, payload in result.pop("attachments"):
+            Utils.add_attachment(file_name, payload)
+        return result
+
+    @classmethod
+    def shutdown(cls):
+        if cls._executor is not None:
+            cls._executor.shutdown()
+            cls._executor = None
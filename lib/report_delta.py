@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import json
+import hashlib
+import datetime
+import threading
+import logging
+from .state_store import StateStore
+from .report_writer import ReportWriter
+
+logger = logging.getLogger(__name__)
+
+
+class ReportDelta(object):
+    """Changes of per-database report sections since the previous run
+
+    Each section (check result) is reduced to a fingerprint of its columns and
+    rows. Date and timestamp values and volatile measurements (VOLATILE_COLUMNS:
+    backup sizes, space used, counters growing every day) are left out, so a
+    new backup or a few more MB used does not count as a change; thresholds
+    crossed show up as new alerts. Fingerprints and alert messages of the last
+    run are kept per DBID in StateStore, written by commit() once the report
+    was delivered.
+    """
+
+    SECTION = "report_delta"
+    # text column names of check tables whose values change on every run
+    VOLATILE_COLUMNS = frozenset((
+        "Data input", "Data output", "Used [MB]", "Free [MB]", "Total [MB]", "Free [%]", "Max space [MB]",
+        "Physical disk consumption [GB]", "Space used by data [GB]", "Size [GB]", "Days left",
+        "Logs to be archived", "Logs archived", "Age [days]", "Redo log rotation max", "Date and hour",
+        "Sequences", "Archived", "Oldest unprotected"))
+    _pending = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(ret_val):
+        """Short hash of section data without date/timestamp values and VOLATILE_COLUMNS"""
+        if ret_val.get("error"):
+            data = ret_val["error"]
+        elif ret_val.get("columns"):
+            keep = [i for i, column in enumerate(ret_val["columns"]) if column not in ReportDelta.VOLATILE_COLUMNS]
+            rows = [[row[i] for i in keep
+                     if i < len(row) and not isinstance(row[i], (datetime.datetime, datetime.date))]
+                    for row in ret_val.get("rows") or []]
+            data = [[ret_val["columns"][i] for i in keep], ReportWriter._typed(rows)]
+        else:
+            # sections without raw rows (alerts, notes) are compared by their text
+            data = ret_val.get("txt", "")
+        return hashlib.sha1(json.dumps(data, default=str, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def compare(db_name, result):
+        """Compare results[i] with the previous run, the current state is kept for commit()
+
+        :return: (changed section keys, new alert messages), all sections and alerts on first run
+        """
+        sections = {key: ReportDelta.fingerprint(ret_val) for key, ret_val in result.get("checks", {}).items()}
+        alerts = ReportWriter._alert_messages(result.get("alert_msg"))
+        if result.get("unavailable") or result.get("not_collected"):
+            # no new baseline from a database not fully collected
+            return [], alerts
+
+        dbid = result["dbid"]
+        previous = StateStore.get(dbid, ReportDelta.SECTION, {})
+        with ReportDelta._lock:
+            ReportDelta._pending[dbid] = {"sections": sections, "alerts": alerts,
+                                          "run": datetime.datetime.now().isoformat()}
+        old_sections = previous.get("sections", {})
+        changed = [key for key, fp in sections.items() if old_sections.get(key) != fp]
+        new_alerts = [msg for msg in alerts if msg not in previous.get("alerts", [])]
+        logger.info("%s delta: %d of %d sections changed, %d new alerts" %
+                    (db_name.upper(), len(changed), len(sections), len(new_alerts)))
+        return changed, new_alerts
+
+    @staticmethod
+    def commit():
+        """Store states of compare() in StateStore, call after the report was delivered
+
+        A failed delivery leaves the previous state, so the next run shows the changes again.
+        """
+        with ReportDelta._lock:
+            pending = dict(ReportDelta._pending)
+            ReportDelta._pending.clear()
+        for dbid, state in pending.items():
+            StateStore.put(dbid, ReportDelta.SECTION, state)
+        if pending:
+            logger.info("Delta state of %d databases stored" % len(pending))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ReportSpool(object):
+    """Per-database report fragments spooled to temporary files
+
+    Database threads put their html and txt fragments here as soon as the
+    checks are done, so only summary metadata stays in memory. The final html
+    and txt reports are assembled by copying the files in report order.
+    """
+
+    def __init__(self, spool_dir=None):
+        self.directory = tempfile.mkdtemp(prefix="backup_report_", dir=spool_dir or None)
+        self._lock = threading.Lock()
+        self._count = 0
+        self._bytes = 0
+        logger.info("Spooling report fragments to %s" % self.directory)
+
+    def _write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, "w", encoding="utf-8") as fp:
+            fp.write(content)
+        return path
+
+    def put(self, name, html, txt):
+        """Spool html and txt fragment, returns reference used by assemble()"""
+        with self._lock:
+            self._count += 1
+            prefix = "%04d_%s" % (self._count, name)
+        fragment = {"html": self._write(prefix + ".html", html), "txt": self._write(prefix + ".txt", txt)}
+        with self._lock:
+            self._bytes += len(html) + len(txt)
+        return fragment
+
+    def assemble(self, kind, parts):
+        """Write html or txt report from strings and spooled fragments
+
+        :param kind: "html" or "txt"
+        :param parts: strings and fragment references from put(), in report order
+        :return: path of the assembled report
+        """
+        path = os.path.join(self.directory, "report.%s" % kind)
+        with open(path, "w", encoding="utf-8") as out:
+            for part in parts:
+                if isinstance(part, dict):
+                    with open(part[kind], "r", encoding="utf-8") as fp:
+                        shutil.copyfileobj(fp, out)
+                else:
+                    out.write(part)
+        return path
+
+    def cleanup(self):
+        logger.info("Report spool: %d fragments, %.1f KB" % (self._count, self._bytes / 1024.0))
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import sys
+import re
+import json
+import html
+import datetime
+import decimal
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+TAG_RE = re.compile(r"<[^>]+>")
+
+
+class ReportWriter(object):
+    """Machine-readable report output (json / ndjson)
+
+    Records are written as soon as a database finishes its checks:
+      {"record": "database", "dbid": ..., "db": ..., "size_gb": ..., "alert": ..., ...}
+      {"record": "check", "dbid": ..., "db": ..., "check": "fra", "columns": [...], "rows": [[...]]}
+    ndjson writes one record per line, json writes a single array which is
+    still streamed element by element.
+    """
+
+    FORMATS = ("json", "ndjson")
+
+    def __init__(self, fmt, output="-", report_date=None):
+        if fmt not in self.FORMATS:
+            raise ValueError("Unknown report format: %s" % fmt)
+        self.fmt = fmt
+        self.report_date = (report_date or datetime.datetime.now()).strftime("%Y-%m-%d")
+        self._lock = threading.Lock()
+        self._count = 0
+        if output is None or output == "-":
+            self._stream = sys.stdout
+            self._close_stream = False
+        else:
+            self._stream = open(output, "w", encoding="utf-8")
+            self._close_stream = True
+        if self.fmt == "json":
+            self._stream.write("[\n")
+        logger.info("Writing %s report to %s" % (fmt, output))
+
+    @staticmethod
+    def _typed(val):
+        """Convert Oracle result values into JSON types"""
+        if isinstance(val, (datetime.datetime, datetime.date)):
+            return val.isoformat()
+        if isinstance(val, decimal.Decimal):
+            return int(val) if val == val.to_integral_value() else float(val)
+        if isinstance(val, bytes):
+            return val.hex()
+        if isinstance(val, (list, tuple)):
+            return [ReportWriter._typed(item) for item in val]
+        return val
+
+    @staticmethod
+    def _dbid(result):
+        dbid = result.get("dbid")
+        return int(dbid) if dbid is not None and str(dbid).isdigit() else dbid
+
+    @staticmethod
+    def _alert_messages(alert_msg):
+        """Plain text alert messages from the html alert fragment"""
+        lines = html.unescape(TAG_RE.sub("\n", alert_msg or "")).split("\n")
+        return [line.strip().lstrip("»").strip() for line in lines if line.strip().lstrip("»").strip()]
+
+    @staticmethod
+    def database_record(db_name, result):
+        """Database level record built from results[i]"""
+        record = {
+            "record": "database",
+            "dbid": ReportWriter._dbid(result),
+            "db": db_name,
+            "db_version": result.get("db_version"),
+            "app_version": result.get("version") or None,
+            "size_gb": ReportWriter._typed(result.get("size")),
+            "sga_gb": ReportWriter._typed(result.get("sga")),
+            "pga_gb": ReportWriter._typed(result.get("pga")),
+            "alert": bool(result.get("alert")),
+            "alert_msg": ReportWriter._alert_messages(result.get("alert_msg")),
+        }
+        if "dataguard" in result:
+            record["dataguard"] = result["dataguard"]
+        return record
+
+    @staticmethod
+    def check_records(db_name, result):
+        """Check level records built from results[i]["checks"]"""
+        for check, ret_val in result.get("checks", {}).items():
+            # PDB scoped checks are keyed pdb/check
+            pdb, _, name = check.rpartition("/")
+            yield {
+                "record": "check",
+                "dbid": ReportWriter._dbid(result),
+                "db": db_name,
+                "pdb": pdb or None,
+                "check": name,
+                "alert": bool(ret_val.get("alert", False)),
+                "columns": ret_val.get("columns", []),
+                "rows": [ReportWriter._typed(row) for row in (ret_val.get("rows") or [])],
+            }
+
+    def _write(self, record):
+        record["report_date"] = self.report_date
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        if self.fmt == "json":
+            line = ("  " if self._count == 0 else ",\n  ") + line
+        else:
+            line += "\n"
+        self._stream.write(line)
+        self._count += 1
+
+    def write_database(self, db_name, result):
+        """Write database record followed by its check records"""
+        with self._lock:
+            self._write(self.database_record(db_name, result))
+            for record in self.check_records(db_name, result):
+                self._write(record)
+            self._stream.flush()
+
+    def close(self):
+        with self._lock:
+            if self.fmt == "json":
+                self._stream.write("\n]\n")
+            self._stream.flush()
+            if self._close_stream:
+                self._stream.close()
+        logger.info("%s report: %d records written" % (self.fmt, self._count))
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import glob
+import gzip
+import json
+import base64
+import shutil
+import decimal
+import datetime
+import tempfile
+import threading
+import logging
+from .utils import Utils
+from .state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+FILE_NAME_RE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+class ReplayPool(object):
+    """Session pool stand-in for --replay, nothing to connect or close"""
+
+    def close(self):
+        pass
+
+
+class ResultRecorder(object):
+    """Raw result sets of a run for offline replay (--record DIR / --replay DIR)
+
+    Every execute_query result (rows, or the error it raised) is kept in call
+    order per database (container) and SQL template name, and written as
+    DIR/<database>/<template>.json.gz when the run ends. Host calls (dgmgrl,
+    filesystem usage) are kept the same way. The state directory is copied
+    to DIR/state at record start, so a replay starts from the same state.
+
+    Replay serves the results in the same order without Oracle or SMTP;
+    the state is used from a temporary copy and stays untouched.
+    """
+
+    mode = None
+    directory = None
+    _results = {}
+    _positions = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, datetime.datetime):
+            return {"$dt": value.isoformat()}
+        if isinstance(value, datetime.date):
+            return {"$d": value.isoformat()}
+        if isinstance(value, decimal.Decimal):
+            return {"$dec": str(value)}
+        if isinstance(value, bytes):
+            return {"$b": base64.b64encode(value).decode("ascii")}
+        if hasattr(value, "read"):
+            # LOB locator, only the content is kept
+            return ResultRecorder._encode(value.read())
+        return str(value)
+
+    @staticmethod
+    def _decode(obj):
+        if len(obj) == 1:
+            key, value = next(iter(obj.items()))
+            if key == "$dt":
+                return datetime.datetime.fromisoformat(value)
+            if key == "$d":
+                return datetime.date.fromisoformat(value)
+            if key == "$dec":
+                return decimal.Decimal(value)
+            if key == "$b":
+                return base64.b64decode(value)
+        return obj
+
+    @classmethod
+    def _path(cls, db_key, name):
+        return os.path.join(cls.directory, FILE_NAME_RE.sub("_", db_key), FILE_NAME_RE.sub("_", name) + ".json.gz")
+
+    @classmethod
+    def start(cls, mode, directory):
+        """Enable record or replay mode, call after the config is parsed"""
+        cls.mode = mode
+        cls.directory = os.path.abspath(directory)
+        if mode == "record":
+            state_dir = StateStore._state_dir()
+            os.makedirs(os.path.join(cls.directory, "state"), exist_ok=True)
+            for path in glob.glob(os.path.join(state_dir, "*.json")):
+                shutil.copy(path, os.path.join(cls.directory, "state"))
+            logger.info("Recording result sets into %s", cls.directory)
+        else:
+            if not os.path.isdir(cls.directory):
+                raise ValueError("Replay directory %s does not exist" % cls.directory)
+            replay_state = tempfile.mkdtemp(prefix="backup_replay_state_")
+            for path in glob.glob(os.path.join(cls.directory, "state", "*.json")):
+                shutil.copy(path, replay_state)
+            Utils.config["state_dir"] = replay_state
+            # recorded load signals must not delay the replay
+            Utils.config["load_aware"] = "no"
+            logger.info("Replaying result sets from %s, state copy in %s", cls.directory, replay_state)
+
+    @classmethod
+    def recording(cls):
+        return cls.mode == "record"
+
+    @classmethod
+    def replaying(cls):
+        return cls.mode == "replay"
+
+    @classmethod
+    def record(cls, db_key, name, rows=None, error=None, timeout=None):
+        """Keep one result: rows, or error message (timeout seconds for call timeouts)"""
+        entry = {"rows": rows} if error is None else {"error": error, "timeout": timeout}
+        with cls._lock:
+            cls._results.setdefault((db_key, name), []).append(entry)
+
+    @classmethod
+    def replay(cls, db_key, name):
+        """Next recorded entry of db_key / name, None when not recorded"""
+        with cls._lock:
+            key = (db_key, name)
+            if key not in cls._results:
+                try:
+                    with gzip.open(cls._path(db_key, name), "rt", encoding="utf-8") as fp:
+                        cls._results[key] = json.load(fp, object_hook=cls._decode)
+                except FileNotFoundError:
+                    cls._results[key] = []
+            position = cls._positions.get(key, 0)
+            cls._positions[key] = position + 1
+            entries = cls._results[key]
+        if position >= len(entries):
+            logger.warning("%s: no recorded result of %s (call %d)", db_key, name, position + 1)
+            return None
+        return entries[position]
+
+    @classmethod
+    def call(cls, db_key, name, func, *args):
+        """Recorded host call (dgmgrl, filesystem usage): run and keep result, or replay it"""
+        if cls.replaying():
+            entry = cls.replay(db_key, name)
+            return entry["rows"] if entry is not None else None
+        result = func(*args)
+        if cls.recording():
+            cls.record(db_key, name, result)
+        return result
+
+    @classmethod
+    def finish(cls, date=None):
+        """Write recorded result sets and meta.json (record mode), drop state copy (replay mode)"""
+        if cls.replaying():
+            shutil.rmtree(Utils.config["state_dir"], ignore_errors=True)
+        if not cls.recording():
+            return
+        with cls._lock:
+            results = dict(cls._results)
+        for (db_key, name), entries in results.items():
+            path = cls._path(db_key, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with gzip.open(path, "wt", encoding="utf-8", compresslevel=6) as fp:
+                json.dump(entries, fp, default=cls._encode, separators=(",", ":"))
+        with open(os.path.join(cls.directory, "meta.json"), "w", encoding="utf-8") as fp:
+            json.dump({"date": date.isoformat() if date else None, "host": Utils.config_host.get("current_host"),
+                       "config_file": Utils.params.get("config_file"), "result_sets": len(results)}, fp)
+        logger.info("Recorded %d result set files into %s", len(results), cls.directory)
+
+    @classmethod
+    def recorded_date(cls):
+        """Report date of the recorded run, None when unknown"""
+        try:
+            with open(os.path.join(cls.directory, "meta.json"), "r", encoding="utf-8") as fp:
+                date = json.load(fp).get("date")
+        except (OSError, ValueError):
+            return None
+        return datetime.datetime.fromisoformat(date) if date else None
+
+    @classmethod
+    def save_report(cls, html_content, txt_content):
+        """Replayed report is written into the replay directory instead of email"""
+        for kind, content in (("html", html_content), ("txt", txt_content)):
+            with open(os.path.join(cls.directory, "replay.%s" % kind), "w", encoding="utf-8") as fp:
+                fp.write(content)
+        logger.info("Replayed report written to %s/replay.html and replay.txt", cls.directory)
+
+    @classmethod
+    def save_report_files(cls, html_path, txt_path):
+        """save_report() for spooled report files"""
+        for kind, path in (("html", html_path), ("txt", txt_path)):
+            shutil.copy(path, os.path.join(cls.directory, "replay.%s" % kind))
+        logger.info("Replayed report written to %s/replay.html and replay.txt", cls.directory)
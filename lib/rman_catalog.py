@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import threading
+import logging
+from .utils import Utils
+from .sql_registry import SqlRegistry
+from .tracing import Tracer
+from .database_usage import DatabaseUsage, QueryError, DatabaseUnavailable
+
+logger = logging.getLogger(__name__)
+
+
+class RmanCatalog(object):
+    """Backup history of all registered databases from the RMAN recovery catalog
+
+    With rman_catalog set, one set-based query over RC_RMAN_STATUS /
+    RC_BACKUP_PIECE runs through a single catalog connection before the
+    database threads start. full_bck and arch_bck then take the rows of
+    their DBID from here instead of querying v$rman_status of each
+    database. Databases not registered in the catalog, or a failed
+    catalog query, fall back to the per-database query. So do databases
+    without catalog rows of a kind in the period: the catalog only learns
+    about backups on resync, a NOCATALOG or not yet resynced backup must
+    not raise a missing backup alert.
+    """
+
+    _rows = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def load(cls):
+        """Read last backups of all DBIDs, returns number of DBIDs found"""
+        url = (Utils.config.get("rman_catalog") or "").strip()
+        if not url:
+            return 0
+        catalog = Utils._parse_oracle_dbs_config(url)[0]
+        catalog["sysdba"] = False
+        rows = {}
+        try:
+            with Tracer.span("rman_catalog", db=catalog["db"]):
+                con = DatabaseUsage(catalog)
+                try:
+                    registered = con.execute_query(SqlRegistry.get("catalog_databases"))
+                    result = con.execute_query(SqlRegistry.get("catalog_backups"),
+                                               {"period": Utils.config["period"]})
+                finally:
+                    con.close_db()
+        except (DatabaseUnavailable, QueryError) as e:
+            logger.warning("RMAN catalog %s not used, backups are checked per database: %s", catalog["db"], e)
+            return 0
+        for row in result:
+            rows.setdefault(int(row[0]), {"FULL": [], "ARCH": []})[row[1]].append(tuple(row[2:]))
+        with cls._lock:
+            cls._rows = rows
+        logger.info("RMAN catalog %s: %d backup rows of %d of %d registered DBIDs", catalog["db"], len(result),
+                    len(rows), len(registered))
+        return len(rows)
+
+    @classmethod
+    def rows(cls, dbid, kind):
+        """Backup rows ("FULL" or "ARCH") of DBID, None when the catalog has none of them in the period"""
+        with cls._lock:
+            if cls._rows is None or dbid is None:
+                return None
+            backups = cls._rows.get(int(dbid))
+        if not backups or not backups[kind]:
+            # v$rman_status of the database decides whether the backup is missing
+            return None
+        return backups[kind]
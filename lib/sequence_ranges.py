@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import bisect
+
+
+class SequenceRanges(object):
+    """Disjoint, sorted ranges of log sequence numbers of one redo thread
+
+    Adjacent and overlapping ranges are merged on add, so all operations
+    depend on the number of ranges, never on the number of logs. Times of
+    range bounds are kept to date the logs at the bounds: first_time of the
+    first sequence, next_time of the last one.
+    """
+
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+        self.first_times = {}
+        self.next_times = {}
+
+    def add(self, start, end, first_time=None, next_time=None):
+        """Add sequences start..end (inclusive)"""
+        if first_time is not None:
+            self.first_times[start] = first_time
+        if next_time is not None:
+            self.next_times[end] = next_time
+        # first range that ends at or after start - 1 (adjacent ranges are merged too)
+        i = bisect.bisect_left(self._ends, start - 1)
+        j = i
+        while j < len(self._starts) and self._starts[j] <= end + 1:
+            start = min(start, self._starts[j])
+            end = max(end, self._ends[j])
+            j += 1
+        self._starts[i:j] = [start]
+        self._ends[i:j] = [end]
+
+    def ranges(self):
+        return list(zip(self._starts, self._ends))
+
+    def bounds(self):
+        """(lowest, highest) sequence, None when empty"""
+        if not self._starts:
+            return None
+        return self._starts[0], self._ends[-1]
+
+    def count(self):
+        return sum(end - start + 1 for start, end in self.ranges())
+
+    def gaps(self):
+        """Sequences missing between the lowest and highest sequence"""
+        return [(self._ends[i] + 1, self._starts[i + 1] - 1) for i in range(len(self._starts) - 1)]
+
+    def missing(self, other):
+        """Ranges of this set not covered by other (SequenceRanges)"""
+        result = []
+        for start, end in self.ranges():
+            # ranges of other overlapping start..end
+            j = bisect.bisect_left(other._ends, start)
+            while start <= end:
+                if j >= len(other._starts) or other._starts[j] > end:
+                    result.append((start, end))
+                    break
+                if other._starts[j] > start:
+                    result.append((start, other._starts[j] - 1))
+                start = other._ends[j] + 1
+                j += 1
+        return result
+
+    def first_time(self, sequence, other=None):
+        """first_time of sequence at a range bound: own range start, or next_time of the other's range end before it"""
+        if sequence in self.first_times:
+            return self.first_times[sequence]
+        if other is not None:
+            return other.next_times.get(sequence - 1)
+        return None
@@ -0,0 +1,40 @@
+select
+    kind,
+    thread#,
+    min(sequence#) first_sequence,
+    max(sequence#) last_sequence,
+    min(first_time) first_time,
+    max(next_time) next_time
+from (
+    -- consecutive sequences share sequence# - rank, duplicates (destinations, backup copies) share the rank
+    select
+        kind, thread#, sequence#, first_time, next_time,
+        sequence# - dense_rank() over (partition by kind, thread# order by sequence#) grp
+    from (
+        select 'ARCH' kind, al.thread#, al.sequence#, al.first_time, al.next_time
+        from v$archived_log al
+        where
+            al.standby_dest = 'NO'
+            and
+            al.resetlogs_change# = (select resetlogs_change# from v$database)
+            and
+            al.first_time >= sysdate - :window_days
+        union all
+        select 'BACKUP' kind, bl.thread#, bl.sequence#, bl.first_time, bl.next_time
+        from v$backup_redolog bl
+        where
+            bl.resetlogs_change# = (select resetlogs_change# from v$database)
+            and
+            bl.first_time >= sysdate - :window_days
+            and
+            exists (
+                select 1
+                from v$backup_piece p
+                where p.set_stamp = bl.set_stamp and p.set_count = bl.set_count and p.status = 'A'
+            )
+    )
+)
+group by
+    kind, thread#, grp
+order by
+    kind, thread#, first_sequence
\ No newline at end of file
@@ -0,0 +1,9 @@
+SELECT
+    (SELECT SYS_CONTEXT('USERENV','SERVER_HOST') FROM DUAL) host,
+    name,
+    round(total_mb/1024) total_gb,
+    round((total_mb-free_mb)/1024) as used_gb,
+    round((free_mb)/1024) free_gb,
+    round(100 * (free_mb/total_mb),2) free_perc
+FROM
+    v$asm_diskgroup
\ No newline at end of file
@@ -0,0 +1,43 @@
+select
+        dbid, kind, start_time, end_time, input_bytes_display, output_bytes_display, input_type,
+        output_device_type, status
+from (
+        select
+                d.dbid DBID,
+                case when r.object_type like 'ARCHIVE%' then 'ARCH' else 'FULL' end KIND,
+                r.start_time START_TIME,
+                r.end_time END_TIME,
+                round(nvl(r.input_bytes, 0) / power(1024, case when r.object_type like 'ARCHIVE%' then 2 else 3 end), 2)
+                        INPUT_BYTES_DISPLAY,
+                round(nvl(r.output_bytes, 0) / power(1024, case when r.object_type like 'ARCHIVE%' then 2 else 3 end), 2)
+                        OUTPUT_BYTES_DISPLAY,
+                case when r.object_type like 'ARCHIVE%' then r.object_type else max(p.tag) end INPUT_TYPE,
+                r.output_device_type OUTPUT_DEVICE_TYPE,
+                r.status STATUS,
+                row_number() over (
+                        partition by d.dbid, case when r.object_type like 'ARCHIVE%' then 'ARCH' else 'FULL' end
+                        order by r.start_time desc) RN
+        from
+                rc_rman_status r, rc_database d, rc_backup_piece p
+        where
+                r.start_time >= sysdate-:period
+                and
+                d.db_key = r.db_key
+                and
+                p.db_key = r.db_key
+                and
+                p.rsr_key = r.rsr_key
+                and
+                r.status like '%COMPLETED%'
+                and
+                r.operation like '%BACKUP%'
+                and
+                (r.object_type like 'DB%' or r.object_type like 'ARCHIVE%')
+        group by
+                d.dbid, r.rsr_key, r.object_type, r.start_time, r.end_time, r.input_bytes, r.output_bytes,
+                r.output_device_type, r.status
+)
+where
+        rn <= 7
+order by
+        dbid, kind, start_time desc
\ No newline at end of file
@@ -0,0 +1,4 @@
+select
+        dbid, name
+from
+        rc_database
\ No newline at end of file
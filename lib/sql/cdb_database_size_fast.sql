@@ -0,0 +1,15 @@
+select
+    (
+        select sum(size_in_gb) from (
+            select round(sum(bytes)/1024/1024/1024, 2) size_in_gb from v$datafile
+            union
+            select round(sum(bytes)/1024/1024/1024, 2) from v$tempfile
+        )
+    ) as phys_size,
+    (
+        select round(sum(m.used_space * t.block_size)/1024/1024/1024, 2)
+        from cdb_tablespace_usage_metrics m, cdb_tablespaces t
+        where m.con_id = t.con_id and m.tablespace_name = t.tablespace_name and t.contents <> 'TEMPORARY'
+    ) as data_size
+from
+dual
\ No newline at end of file
@@ -0,0 +1,37 @@
+select
+    pdb.pdb_name,
+    m.tablespace_name tablespace_name,
+    df.files_no files_no,
+    round(m.used_space * t.block_size / 1048576) used,
+    round(df.totalspace - m.used_space * t.block_size / 1048576) free,
+    round(df.totalspace) total,
+    round(100 - m.used_percent, 2) perc_free,
+    round(nvl(df.maxspace,0)) max_file
+from
+    cdb_tablespace_usage_metrics m,
+    cdb_tablespaces t,
+    (
+        select
+            con_id,
+            tablespace_name,
+            count(file_id) files_no,
+            sum(bytes) / 1048576 totalspace,
+            sum(decode(AUTOEXTENSIBLE,'YES',maxbytes,'NO',bytes))/1024/1024 maxspace
+        from
+            cdb_data_files
+        group by
+            con_id, tablespace_name
+    ) df,
+    cdb_pdbs pdb
+where
+    m.con_id = t.con_id
+    AND
+    m.tablespace_name = t.tablespace_name
+    AND
+    m.con_id = df.con_id
+    AND
+    m.tablespace_name = df.tablespace_name
+    AND
+    pdb.pdb_id = m.con_id
+ORDER BY
+    1, 4 desc
\ No newline at end of file
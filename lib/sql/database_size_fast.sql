@@ -0,0 +1,9 @@
+select
+    (select round(sum(bytes)/1024/1024/1024, 2) size_in_gb from dba_data_files) as phys_size,
+    (
+        select round(sum(m.used_space * t.block_size)/1024/1024/1024, 2)
+        from dba_tablespace_usage_metrics m, dba_tablespaces t
+        where m.tablespace_name = t.tablespace_name and t.contents <> 'TEMPORARY'
+    ) as data_size
+from
+dual
\ No newline at end of file
@@ -0,0 +1,48 @@
+select
+    file#,
+    creation_change#,
+    checkpoint_time,
+    source
+from (
+    select
+        file#,
+        creation_change#,
+        checkpoint_time,
+        source,
+        row_number() over (partition by file#, creation_change# order by checkpoint_time desc) rn
+    from (
+        select
+            bd.file#,
+            bd.creation_change#,
+            bd.checkpoint_time,
+            'S:' || bd.set_stamp || ':' || bd.set_count source
+        from
+            v$backup_datafile bd
+        where
+            bd.recid > :last_recid
+            and
+            bd.file# > 0
+            and
+            exists (
+                select 1
+                from v$backup_piece p
+                where p.set_stamp = bd.set_stamp and p.set_count = bd.set_count and p.status = 'A'
+            )
+        union all
+        select
+            dc.file#,
+            dc.creation_change#,
+            dc.checkpoint_time,
+            'C:' || dc.recid || ':' || dc.stamp source
+        from
+            v$datafile_copy dc
+        where
+            dc.recid > :last_copy_recid
+            and
+            dc.file# > 0
+            and
+            dc.status = 'A'
+    )
+)
+where
+    rn = 1
\ No newline at end of file
@@ -0,0 +1,13 @@
+select distinct
+    'S:' || set_stamp || ':' || set_count
+from
+    v$backup_piece
+where
+    status = 'A'
+union all
+select
+    'C:' || recid || ':' || stamp
+from
+    v$datafile_copy
+where
+    status = 'A'
\ No newline at end of file
@@ -0,0 +1,13 @@
+select
+    d.file#,
+    d.name,
+    d.creation_change#,
+    d.enabled,
+    r.last_recid,
+    c.last_recid
+from
+    v$datafile d,
+    (select last_recid from v$controlfile_record_section where type = 'BACKUP DATAFILE') r,
+    (select last_recid from v$controlfile_record_section where type = 'DATAFILE COPY') c
+order by
+    d.file#
\ No newline at end of file
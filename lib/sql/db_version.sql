@@ -0,0 +1 @@
+select product||'('||version_full||')' as db_ver from product_component_version where PRODUCT like 'Oracle%' and rownum = 1
\ No newline at end of file
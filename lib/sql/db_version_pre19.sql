@@ -0,0 +1 @@
+select * from (select product||'('||VERSION||')' as db_ver from product_component_version where PRODUCT like 'Oracle%') where rownum = 1
\ No newline at end of file
@@ -0,0 +1 @@
+select dbid from v$database
\ No newline at end of file
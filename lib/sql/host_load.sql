@@ -0,0 +1,9 @@
+select
+    max(case when m.metric_name = 'Host CPU Utilization (%)' then m.value end) as host_cpu,
+    max(case when m.metric_name = 'Average Active Sessions' then m.value end) as aas,
+    (select o.value from v$osstat o where o.stat_name = 'NUM_CPUS') as num_cpus
+from
+    v$sysmetric m
+where
+    m.group_id = 2
+    and m.metric_name in ('Host CPU Utilization (%)', 'Average Active Sessions')
\ No newline at end of file
@@ -0,0 +1 @@
+select distinct WER_SYS||'.'||WER_INT||'.'||WER_WEW as version, DT_INST as inst_date from sysadm.zainstal_skladnik  where WER_SYS <> 0 and KOD_SKLADN_INST in ('AP_LAB','AP_WMD')
\ No newline at end of file
@@ -0,0 +1,9 @@
+select
+    count(1),
+    max({{ key_column }})
+from
+    sysadm.{{ table }}
+{% if since %}
+where
+    {{ key_column }} > :last_key
+{% endif %}
\ No newline at end of file
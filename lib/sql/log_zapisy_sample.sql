@@ -0,0 +1,11 @@
+select
+    nvl(sum(rows_in_block), 0),
+    nvl(sum(rows_in_block * rows_in_block), 0)
+from (
+    select
+        count(1) rows_in_block
+    from
+        sysadm.{{ table }} sample block ({{ pct }})
+    group by
+        substr(rowidtochar(rowid), 1, 15)
+)
\ No newline at end of file
@@ -0,0 +1,10 @@
+select
+    table_name,
+    num_rows,
+    last_analyzed
+from
+    dba_tables
+where
+    owner = 'SYSADM'
+    and
+    table_name in ('LOG_ZAPISY_AKT', 'LOG_ZAPISY_ARCH')
\ No newline at end of file
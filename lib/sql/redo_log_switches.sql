@@ -0,0 +1,9 @@
+select
+    to_char(first_time, 'YYYY-MM-DD HH24') day_hour,
+    count(*) switches
+from
+    gv$log_history
+where
+    first_time >= trunc(sysdate - :window_hours / 24, 'HH24')
+group by
+    to_char(first_time, 'YYYY-MM-DD HH24')
\ No newline at end of file
@@ -1 +0,0 @@
-select count(*) as rotation, to_char(first_time,'YYYY-MM-DD HH24') as day_hour from gv$log_history group by to_char(first_time,'YYYY-MM-DD HH24') order by 1 desc fetch first 5 rows only
\ No newline at end of file
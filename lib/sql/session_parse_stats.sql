@@ -0,0 +1,4 @@
+select sn.name, ms.value
+  from v$mystat ms
+  join v$statname sn on sn.statistic# = ms.statistic#
+ where sn.name in ('parse count (total)', 'parse count (hard)', 'session cursor cache hits')
\ No newline at end of file
@@ -1,9 +1,22 @@
-select a.TABLE_NAME, a.OWNER, to_char(b.max_date, 'YYYY-MM-DD HH:MI:SS') from (
-select TABLE_NAME, OWNER, MIN(STATS_UPDATE_TIME) min_date from all_tab_stats_history where OWNER not in ('DBSNMP','SYSMAN') group by TABLE_NAME, OWNER
-) a,
-(
-select TABLE_NAME, OWNER, MAX(STATS_UPDATE_TIME) max_date from all_tab_stats_history where OWNER not in ('DBSNMP','SYSMAN') group by TABLE_NAME, OWNER
-) b
-where a.TABLE_NAME = b.TABLE_NAME
-order by 3
-fetch first 10 rows only
\ No newline at end of file
+select
+    s.table_name,
+    s.owner,
+    to_char(s.last_analyzed, 'YYYY-MM-DD HH24:MI:SS') last_analyzed,
+    nvl(s.stale_stats, '-') stale_stats
+from
+    dba_tab_statistics s
+    join dba_users u on u.username = s.owner
+    join dba_tables t on t.owner = s.owner and t.table_name = s.table_name
+where
+    s.object_type = 'TABLE'
+    and
+    u.oracle_maintained = 'N'
+    and
+    t.temporary = 'N'
+    and
+    s.owner not in ('DBSNMP','SYSMAN')
+    and
+    s.table_name not like 'BIN$%'
+order by
+    s.last_analyzed nulls first
+fetch first :top_rows rows only
\ No newline at end of file
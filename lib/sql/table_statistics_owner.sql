@@ -0,0 +1,19 @@
+select
+    s.table_name,
+    s.owner,
+    to_char(s.last_analyzed, 'YYYY-MM-DD HH24:MI:SS') last_analyzed,
+    nvl(s.stale_stats, '-') stale_stats
+from
+    dba_tab_statistics s
+    join dba_tables t on t.owner = s.owner and t.table_name = s.table_name
+where
+    s.owner = :owner
+    and
+    s.object_type = 'TABLE'
+    and
+    t.temporary = 'N'
+    and
+    s.table_name not like 'BIN$%'
+order by
+    s.last_analyzed nulls first
+fetch first :top_rows rows only
\ No newline at end of file
@@ -0,0 +1,16 @@
+select
+    count(*) stale_tables
+from
+    dba_tab_statistics s
+    join dba_users u on u.username = s.owner
+    join dba_tables t on t.owner = s.owner and t.table_name = s.table_name
+where
+    s.object_type = 'TABLE'
+    and
+    s.stale_stats = 'YES'
+    and
+    u.oracle_maintained = 'N'
+    and
+    t.temporary = 'N'
+    and
+    s.owner not in ('DBSNMP','SYSMAN')
\ No newline at end of file
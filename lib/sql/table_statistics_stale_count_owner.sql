@@ -0,0 +1,13 @@
+select
+    count(*) stale_tables
+from
+    dba_tab_statistics s
+    join dba_tables t on t.owner = s.owner and t.table_name = s.table_name
+where
+    s.owner = :owner
+    and
+    s.object_type = 'TABLE'
+    and
+    s.stale_stats = 'YES'
+    and
+    t.temporary = 'N'
\ No newline at end of file
@@ -0,0 +1,28 @@
+select
+    m.tablespace_name tablespace_name,
+    df.files_no files_no,
+    round(m.used_space * t.block_size / 1048576) used,
+    round(df.totalspace - m.used_space * t.block_size / 1048576) free,
+    round(df.totalspace) total,
+    round(100 - m.used_percent, 2) perc_free,
+    round(nvl(df.maxspace,0)) max_file
+from
+    dba_tablespace_usage_metrics m,
+    dba_tablespaces t,
+    (
+        select
+            tablespace_name,
+            count(file_id) files_no,
+            sum(bytes) / 1048576 totalspace,
+            sum(decode(AUTOEXTENSIBLE,'YES',maxbytes,'NO',bytes))/1024/1024 maxspace
+        from
+            dba_data_files
+        group by
+            tablespace_name
+    ) df
+where
+    m.tablespace_name = t.tablespace_name
+    AND
+    m.tablespace_name = df.tablespace_name
+ORDER BY
+    4 desc
\ No newline at end of file
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import glob
+import threading
+import logging
+from jinja2 import Environment, FileSystemLoader, meta
+from .utils import Utils
+
+logger = logging.getLogger(__name__)
+
+SQL_DIR = os.path.join(os.path.dirname(__file__), "sql")
+# string literals and comments are removed before looking for :bind placeholders
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", re.DOTALL)
+BIND_RE = re.compile(r"(?<![:\w]):([A-Za-z_][A-Za-z0-9_$#]*)")
+
+
+class SqlStatement(object):
+    """Constant SQL text with its bind variable names"""
+
+    __slots__ = ("name", "text", "binds")
+
+    def __init__(self, name, text, binds):
+        self.name = name
+        self.text = text
+        self.binds = binds
+
+    def check_params(self, params):
+        """Verify that bind parameters match the statement placeholders"""
+        given = set(params or {})
+        if given != set(self.binds):
+            raise ValueError("%s: bind mismatch, expected %s, got %s" %
+                             (self.name, sorted(self.binds), sorted(given)))
+
+    def __repr__(self):
+        return "SqlStatement(%s, binds=%s)" % (self.name, list(self.binds))
+
+
+class SqlRegistry(object):
+    """Registry of lib/sql/*.sql loaded and validated once per run
+
+    Statements are shared by all database threads, so every connection sends
+    the very same text and the oracledb statement cache (stmtcachesize) can
+    reuse parsed cursors. Parse statistics of the sessions (v$mystat) are
+    kept per check.
+    """
+
+    env = Environment(loader=FileSystemLoader(SQL_DIR))
+    _statements = {}
+    _stats = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _compile(name, text):
+        text = text.strip()
+        if not text:
+            raise ValueError("SQL template %s is empty" % name)
+        if text.endswith(";"):
+            raise ValueError("SQL template %s must not end with ';'" % name)
+        binds = []
+        for bind in BIND_RE.findall(LITERAL_RE.sub("''", text)):
+            if bind.lower() not in binds:
+                binds.append(bind.lower())
+        return SqlStatement(name, text, tuple(binds))
+
+    @classmethod
+    def load(cls):
+        """Load and validate all SQL templates, raise ValueError on invalid one
+
+        Templates using variables (table names, SAMPLE percent) are only checked
+        for template syntax here, they are rendered by get() on first use.
+        """
+        statements = {}
+        parametrized = 0
+        for path in sorted(glob.glob(os.path.join(SQL_DIR, "*.sql"))):
+            file_name = os.path.basename(path)
+            name = os.path.splitext(file_name)[0]
+            source = cls.env.loader.get_source(cls.env, file_name)[0]
+            if meta.find_undeclared_variables(cls.env.parse(source)):
+                parametrized += 1
+                continue
+            statements[name] = cls._compile(name, cls.env.get_template(file_name).render())
+        with cls._lock:
+            cls._statements = statements
+        logger.info("SQL registry: %d statements and %d parametrized templates loaded from %s" %
+                    (len(statements), parametrized, SQL_DIR))
+        return statements
+
+    @classmethod
+    def get(cls, name, **variables):
+        """Statement by template name (without .sql)
+
+        Templates rendered with variables are cached per distinct variable set,
+        so they also stay constant text for the statement cache.
+        """
+        key = name if not variables else "%s(%s)" % (name, ",".join(
+            "%s=%s" % (k, variables[k]) for k in sorted(variables)))
+        stmt = cls._statements.get(key)
+        if stmt is not None:
+            return stmt
+        text = cls.env.get_template(name + ".sql").render(**variables)
+        stmt = cls._compile(name, text)
+        with cls._lock:
+            cls._statements[key] = stmt
+        return stmt
+
+    @classmethod
+    def record(cls, check, delta):
+        """Account parse counters used by one run of check (DatabaseUsage.parse_delta)"""
+        with cls._lock:
+            stats = cls._stats.setdefault(check, {"runs": 0, "parses": 0, "hard_parses": 0, "cache_hits": 0})
+            stats["runs"] += 1
+            for key in ("parses", "hard_parses", "cache_hits"):
+                stats[key] += delta[key]
+
+    @classmethod
+    def statistics(cls):
+        """[check, runs, parses, hard parses, session cursor cache hits, hit rate %] ordered by check"""
+        with cls._lock:
+            rows = []
+            for check in sorted(cls._stats):
+                stats = cls._stats[check]
+                rows.append([check, stats["runs"], stats["parses"], stats["hard_parses"], stats["cache_hits"],
+                             round(100.0 * stats["cache_hits"] / stats["parses"], 1) if stats["parses"] else 0.0])
+        return rows
+
+    @classmethod
+    def log_statistics(cls):
+        rows = cls.statistics()
+        if rows:
+            logger.info("Parse statistics per check, v$mystat (stmtcachesize=%d):\n%s" % (
+                Utils.get_config_int("stmtcachesize", 40),
+                Utils.create_txt_table(rows, ["Check", "Runs", "Parses", "Hard parses", "Cursor cache hits",
+                                              "Hit rate [%]"])))
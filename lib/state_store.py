@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import tempfile
+import threading
+import logging
+from .utils import Utils
+
+logger = logging.getLogger(__name__)
+pathname = os.path.abspath(os.path.dirname(sys.argv[0])) + str(os.sep)
+
+
+class StateStore(object):
+    """Small JSON state kept between runs, one file per DBID
+
+    Files live in state_dir from [report] (default: state/ next to the script),
+    each holds independent sections, e.g. {"log_counts/rch": {...}}.
+    plan.json keeps check plan node timings per database alias.
+    """
+
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _state_dir():
+        state_dir = (Utils.config.get("state_dir") or "").strip() or pathname + "state"
+        os.makedirs(state_dir, exist_ok=True)
+        return state_dir
+
+    @staticmethod
+    def _path(dbid):
+        return os.path.join(StateStore._state_dir(), "%s.json" % dbid)
+
+    @staticmethod
+    def _read(dbid):
+        try:
+            with open(StateStore._path(dbid), "r", encoding="utf-8") as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return {}
+        except (ValueError, OSError) as e:
+            logger.warning("Ignoring unreadable state for DBID %s: %s" % (dbid, e))
+            return {}
+
+    @staticmethod
+    def get(dbid, section, default=None):
+        with StateStore._lock:
+            return StateStore._read(dbid).get(section, default)
+
+    @staticmethod
+    def put(dbid, section, value):
+        """Replace section of DBID state, file is rewritten atomically"""
+        with StateStore._lock:
+            state = StateStore._read(dbid)
+            state[section] = value
+            fd, tmp_name = tempfile.mkstemp(dir=StateStore._state_dir(), prefix=".%s_" % dbid)
+            with os.fdopen(fd, "w", encoding="utf-8") as fp:
+                json.dump(state, fp, default=str)
+            os.replace(tmp_name, StateStore._path(dbid))
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import threading
+import contextlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Tracer(object):
+    """Run timeline in Chrome trace-event format (chrome://tracing, Perfetto)
+
+    Spans are no-ops until enable() is called, so instrumented code paths
+    cost nothing in regular runs.
+    """
+
+    enabled = False
+    _events = []
+    _thread_names = {}
+    _lock = threading.Lock()
+    _origin = time.perf_counter()
+
+    @classmethod
+    def enable(cls):
+        cls.enabled = True
+        cls._origin = time.perf_counter()
+        logger.info("Run timeline tracing enabled")
+
+    @classmethod
+    def _now_us(cls):
+        return (time.perf_counter() - cls._origin) * 1000000
+
+    @classmethod
+    @contextlib.contextmanager
+    def span(cls, name, cat="run", **args):
+        """Record complete event ("ph": "X") around the with-block"""
+        if not cls.enabled:
+            yield
+            return
+        thread = threading.current_thread()
+        start = cls._now_us()
+        try:
+            yield
+        finally:
+            event = {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": round(start, 1),
+                "dur": round(cls._now_us() - start, 1),
+                "pid": os.getpid(),
+                "tid": thread.ident,
+                "args": dict(args, thread=thread.name),
+            }
+            with cls._lock:
+                cls._events.append(event)
+                cls._thread_names[thread.ident] = thread.name
+
+    @classmethod
+    def write(cls, file_name):
+        """Write collected spans with thread name metadata as trace-event JSON"""
+        with cls._lock:
+            events = list(cls._events)
+            for tid, name in cls._thread_names.items():
+                events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+                               "args": {"name": name}})
+        with open(file_name, "w", encoding="utf-8") as fp:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp)
+        logger.info("Run timeline written to %s (%d spans)" % (file_name, len(cls._events)))
@@ -10,10 +10,17 @@ import texttable
 import subprocess
 import ctypes
 import configparser
+import threading
+import csv
+import io
+import gzip
+import re
 
 __ver__ = "3.17.0"
 logger = logging.getLogger(__name__)
 pathname = os.path.abspath(os.path.dirname(sys.argv[0])) + str(os.sep)
+IDENTIFIER_RE = re.compile(r"^[A-Za-z][A-Za-z0-9_$#]*$")
+CLOCK_TIME_RE = re.compile(r"^([01]?[0-9]|2[0-3]):([0-5][0-9])$")
 
 
 class Utils(object):
@@ -27,6 +34,13 @@ class Utils(object):
 
     config_host = {}
 
+    attachments = []
+    _attachments_lock = threading.Lock()
+
+    # Compact table styling - one style per table, bare cells
+    COMPACT_TABLE_STYLE = "border-collapse:collapse; font-size:12px; color:#4a5568;"
+    COMPACT_ALERT_STYLE = "color:#e53e3e; font-weight:700;"
+
     help_msg = """\
 This script generates Oracle backup and usage report, especially for Asseco based applications
 Version """ + __ver__ + """
@@ -47,29 +61,43 @@ Version """ + __ver__ + """
         return table.draw() + "\n"
 
     @staticmethod
-    def _format_table_cell(val, col, index_to_test):
+    def _format_table_cell(val, col, index_to_test, compact=False):
         """Format a single table cell value"""
         if isinstance(val, (int, float)):
             # Check if value is below threshold
-            if index_to_test is not None and index_to_test == col and float(val) < float(Utils.config["threshold"]):
+            below_threshold = index_to_test is not None and index_to_test == col and float(val) < float(Utils.config["threshold"])
+            if compact:
+                if below_threshold:
+                    return '<td align="right" style="{0}">{1:.2f}</td>'.format(Utils.COMPACT_ALERT_STYLE, val)
+                return '<td align="right">{0:.2f}</td>'.format(val)
+            if below_threshold:
                 text_style = 'color:#e53e3e; font-weight:700;'
             else:
                 text_style = 'color:#2d3748;'
             return '<td style="{0}text-align:right; border-bottom:1px solid #e2e8f0; padding:6px 8px; font-size:12px;">{1:.2f}</td>\n'.format(text_style, val)
         else:
+            if compact:
+                return '<td>{0:}</td>'.format(val)
             return '<td style="color:#4a5568; border-bottom:1px solid #e2e8f0; padding:6px 8px; font-size:12px;">{0:}</td>\n'.format(val)
 
     @staticmethod
-    def create_html_table(tbl_data, tbl_header, index_to_test=None, style_class="", caption="Data table"):
-        """generate HTML table with modern email-safe styling
-
-        :param tbl_data:
-        :param tbl_header:
-        :param index_to_test:
-        :param style_class:
-        :param caption
-        :return:
-        """
+    def _render_html_table(tbl_data, tbl_header, index_to_test, compact):
+        """Render table rows, full inline styling or compact"""
+        if compact:
+            # Padding, borders and font come from table attributes so cells stay bare
+            html = '<table role="presentation" cellspacing="0" cellpadding="6" border="0" width="100%" rules="rows" ' \
+                   'bordercolor="#e2e8f0" style="{0}">\n'.format(Utils.COMPACT_TABLE_STYLE)
+            html += '<tr bgcolor="#f7fafc">'
+            for header in tbl_header:
+                html += '<th align="left" style="color:#2d3748;">{0:}</th>'.format(header)
+            html += '</tr>\n'
+            for row in tbl_data:
+                html += '<tr>'
+                for col, val in enumerate(row):
+                    html += Utils._format_table_cell(val, col, index_to_test, compact=True)
+                html += '</tr>\n'
+            html += '</table>\n'
+            return html
 
         html = '<table role="presentation" cellspacing="0" cellpadding="0" border="0" width="100%" style="border-collapse:collapse;">\n'
         html += '<tr style="background-color:#f7fafc; border-bottom:2px solid #e2e8f0;">\n'
@@ -90,6 +118,66 @@ Version """ + __ver__ + """
         html += '</table>\n'
         return html
 
+    @staticmethod
+    def create_html_table(tbl_data, tbl_header, index_to_test=None, style_class="", caption="Data table", attachment=None):
+        """generate HTML table with modern email-safe styling
+
+        When the rendered table exceeds section_size_budget [KB] and an attachment
+        name is given, only section_top_rows rows are rendered - with index_to_test
+        the rows with the lowest tested value, highlighted below threshold, first -
+        and the full data goes into a gzip-compressed CSV attachment.
+
+        :param tbl_data:
+        :param tbl_header:
+        :param index_to_test:
+        :param style_class:
+        :param caption
+        :param attachment: base name of the CSV attachment for oversized tables
+        :return:
+        """
+        compact = Utils.get_config_flag("html_compact")
+        html = Utils._render_html_table(tbl_data, tbl_header, index_to_test, compact)
+
+        budget = Utils.get_config_int("section_size_budget", 0) * 1024
+        if attachment is None or budget <= 0 or len(html) <= budget:
+            return html
+
+        top_rows = Utils.get_config_int("section_top_rows", 20)
+        file_name = "%s.csv.gz" % attachment
+        Utils.add_attachment(file_name, Utils.create_csv_gz(tbl_data, tbl_header))
+        logger.info("%s: %d bytes over budget, showing %d of %d rows, full data in %s" %
+                    (caption, len(html), min(top_rows, len(tbl_data)), len(tbl_data), file_name))
+
+        top_data = tbl_data
+        if index_to_test is not None:
+            # queries sort by free space or PDB name, nearly full rows must not be cut off
+            top_data = sorted(tbl_data, key=lambda row: row[index_to_test]
+                              if isinstance(row[index_to_test], (int, float)) else float("inf"))
+        html = Utils._render_html_table(top_data[:top_rows], tbl_header, index_to_test, compact)
+        html += '<p style="margin:4px 0; color:#718096; font-size:11px;">Pokazano {0:} z {1:} wierszy, ' \
+                'pełne dane w załączniku {2:}</p>\n'.format(min(top_rows, len(tbl_data)), len(tbl_data), file_name)
+        return html
+
+    @staticmethod
+    def create_csv_gz(tbl_data, tbl_header):
+        """Gzip-compressed CSV of the table data
+
+        :param tbl_data:
+        :param tbl_header:
+        :return: bytes
+        """
+        buf = io.StringIO()
+        writer = csv.writer(buf, delimiter=";")
+        writer.writerow(tbl_header)
+        writer.writerows(tbl_data)
+        return gzip.compress(buf.getvalue().encode("utf-8"))
+
+    @staticmethod
+    def add_attachment(file_name, payload):
+        """Register file to be attached to the report email (thread safe)"""
+        with Utils._attachments_lock:
+            Utils.attachments.append((file_name, payload))
+
     @staticmethod
     def toc(db_name, db_size, db_alert, db_id, app_version=False):
         """Generate Tables of Contents for email
@@ -180,6 +268,76 @@ Version """ + __ver__ + """
     def get_config():
         return Utils.config
 
+    @staticmethod
+    def get_config_flag(key, default="no"):
+        """Read yes/no flag from report config"""
+        return str(Utils.config.get(key) or default).strip().lower() == "yes"
+
+    @staticmethod
+    def get_config_int(key, default):
+        """Read integer value from report config, default when empty"""
+        val = Utils.config.get(key)
+        if val is None or str(val).strip() == "":
+            return default
+        return int(val)
+
+    @staticmethod
+    def _parse_call_timeout_config(val):
+        """Parse call_timeout: default seconds and check:seconds overrides, e.g. 300, stats:120, size:600
+
+        :return: {"*": default, check: seconds}
+        """
+        timeouts = {}
+        for item in Utils._parse_list_config_value(val):
+            if not item:
+                continue
+            check, _, seconds = item.rpartition(":")
+            timeouts[check.strip() or "*"] = int(seconds)
+        return timeouts
+
+    @staticmethod
+    def _parse_sample_pct_config(val):
+        """Parse logs_sample_pct: SAMPLE BLOCK percent in range <0.000001, 100), None when empty"""
+        if not (val or "").strip():
+            return None
+        pct = float(val)
+        if not 0.000001 <= pct < 100:
+            raise ValueError("logs_sample_pct must be in range <0.000001, 100): %s" % val)
+        return pct
+
+    @staticmethod
+    def _parse_run_deadline_config(val):
+        """Parse run_deadline: seconds, or HH:MM - the next such time from now
+
+        :return: seconds from the run start, None when empty or 0
+        """
+        val = (val or "").strip()
+        match = CLOCK_TIME_RE.match(val)
+        if match:
+            now = datetime.datetime.now()
+            deadline = now.replace(hour=int(match.group(1)), minute=int(match.group(2)), second=0, microsecond=0)
+            if deadline <= now:
+                deadline += datetime.timedelta(days=1)
+            return (deadline - now).total_seconds()
+        if not re.match(r"^[0-9]+(\.[0-9]+)?$", val or "0"):
+            raise ValueError("run_deadline must be seconds or HH:MM: %s" % val)
+        budget = float(val or 0)
+        return budget if budget > 0 else None
+
+    @staticmethod
+    def _parse_identifier_config(key, val):
+        """Parse column name used in SQL text (logs_key_column), None when empty"""
+        val = (val or "").strip()
+        if val and not IDENTIFIER_RE.match(val):
+            raise ValueError("Invalid %s: %s" % (key, val))
+        return val or None
+
+    @staticmethod
+    def get_call_timeout(check):
+        """call_timeout in seconds of given check, 0 when not limited"""
+        timeouts = Utils.config.get("call_timeout") or {}
+        return timeouts.get(check, timeouts.get("*", 0))
+
     @staticmethod
     def format_storage_size(size_gb, decimal_places=2):
         """Format storage size: display in TB if >= 1024 GB, otherwise in GB
@@ -188,6 +346,8 @@ Version """ + __ver__ + """
         :param decimal_places: Number of decimal places (default: 2)
         :return: Formatted string with unit (e.g., "1.5 TB" or "512 GB")
         """
+        if size_gb is None:
+            return "-"
         try:
             size_value = float(size_gb)
             if size_value >= 1024:
@@ -213,6 +373,17 @@ Version """ + __ver__ + """
         elem_list = val.split(",")
         return [item.strip() for item in elem_list]
 
+    @staticmethod
+    def _parse_oracle_pdbs_config(val):
+        """Parse oracle_pdbs map (cdb:pdb, ...) into {cdb: [pdb, ...]}"""
+        pdb_map = {}
+        for elem in Utils._parse_list_config_value(val):
+            if ":" not in elem:
+                continue
+            cdb, pdb = [item.strip() for item in elem.split(":", 1)]
+            pdb_map.setdefault(cdb, []).append(pdb)
+        return pdb_map
+
     @staticmethod
     def _parse_oracle_dbs_config(val):
         """Parse oracle_dbs configuration value"""
@@ -226,23 +397,69 @@ Version """ + __ver__ + """
         return parsed_dbs
 
     @staticmethod
-    def _add_db_flags_to_oracle_dbs(oracle_dbs, parsed_config_data):
-        """Add sysdba, multitenant, and dataguard flags to oracle_dbs entries"""
+    def _parse_database_sections(cfg):
+        """Per-database overrides from [database <alias>] sections
+
+        :return: {alias: {key: value}}
+        """
+        overrides = {}
+        for section in cfg.sections():
+            if section.startswith("database "):
+                overrides[section.split(None, 1)[1].strip()] = dict(cfg.items(section))
+        return overrides
+
+    @staticmethod
+    def _add_db_flags_to_oracle_dbs(oracle_dbs, parsed_config_data, db_overrides=None):
+        """Add sysdba, multitenant, dataguard flags and check plan settings to oracle_dbs entries
+
+        Values from [database <alias>] override the global [report] ones.
+        """
         for item in oracle_dbs:
+            overrides = (db_overrides or {}).get(item['db'], {})
+
             # SYSDBA flag
-            sysdba_value = parsed_config_data.get("use_sysdba", "yes")
+            sysdba_value = overrides.get("sysdba", parsed_config_data.get("use_sysdba", "yes"))
             item['sysdba'] = str(sysdba_value).strip().lower() == "yes"
             
             # Multitenant flag
-            multitenant_value = parsed_config_data.get("multitenant", "no")
+            multitenant_value = overrides.get("multitenant", parsed_config_data.get("multitenant", "no"))
             item['multitenant'] = str(multitenant_value).strip().lower() == "yes"
             
             # DataGuard flag
-            dataguard_value = parsed_config_data.get("dataguard", "no")
+            dataguard_value = overrides.get("dataguard", parsed_config_data.get("dataguard", "no"))
             item['dataguard'] = str(dataguard_value).strip().lower() == "yes"
+
+            # Check plan: skipped nodes and nodes run at once
+            skip_value = overrides.get("skip_checks", parsed_config_data.get("skip_checks") or "")
+            item['skip_checks'] = [check for check in Utils._parse_list_config_value(skip_value) if check]
+            item['check_parallelism'] = int(overrides.get("check_parallelism") or
+                                            parsed_config_data.get("check_parallelism") or 1)
             
-            logger.info("Database %s flags set: sysdba=%s, multitenant=%s, dataguard=%s" % 
-                       (item['db'], item['sysdba'], item['multitenant'], item['dataguard']))
+            logger.info("Database %s flags set: sysdba=%s, multitenant=%s, dataguard=%s, skip_checks=%s" %
+                       (item['db'], item['sysdba'], item['multitenant'], item['dataguard'], item['skip_checks']))
+
+    @staticmethod
+    def redact_url(url):
+        """Connection URL user/password@dsn without the password"""
+        if not url or "@" not in url:
+            return url
+        credentials, _, dsn = url.rpartition("@")
+        if "/" in credentials:
+            credentials = credentials.split("/", 1)[0] + "/***"
+        return "%s@%s" % (credentials, dsn)
+
+    @staticmethod
+    def redact_config_value(key, val):
+        """Config value safe for logging: passwords masked, connection URLs without credentials"""
+        if not val:
+            return val
+        if any(word in key for word in ("pass", "secret", "token")):
+            return "***"
+        items = Utils._parse_list_config_value(val)
+        if any("/" in item.rpartition("@")[0] for item in items):
+            # user/password@dsn of any key (oracle_dbs, rman_catalog)
+            return ", ".join(Utils.redact_url(item) for item in items)
+        return val
 
     @staticmethod
     def _parse_report_section(cfg):
@@ -254,10 +471,20 @@ Version """ + __ver__ + """
         list_keys = ("oradata", "logs_check", "app_amms", "app_im", "app_docker", "app_edm")
         
         for key, val in config_data:
-            logger.info("%s = %s" % (key, val))
+            logger.info("%s = %s", key, Utils.redact_config_value(key, val))
             
             if key == "oracle_dbs":
                 parsed_config_data[key] = Utils._parse_oracle_dbs_config(val)
+            elif key == "oracle_pdbs":
+                parsed_config_data[key] = Utils._parse_oracle_pdbs_config(val or "")
+            elif key == "call_timeout":
+                parsed_config_data[key] = Utils._parse_call_timeout_config(val or "")
+            elif key == "logs_sample_pct":
+                parsed_config_data[key] = Utils._parse_sample_pct_config(val)
+            elif key == "run_deadline":
+                parsed_config_data[key] = Utils._parse_run_deadline_config(val)
+            elif key == "logs_key_column":
+                parsed_config_data[key] = Utils._parse_identifier_config(key, val)
             elif key in list_keys:
                 parsed_config_data[key] = Utils._parse_list_config_value(val)
             else:
@@ -265,7 +492,8 @@ Version """ + __ver__ + """
         
         # Add flags to oracle_dbs
         if "oracle_dbs" in parsed_config_data:
-            Utils._add_db_flags_to_oracle_dbs(parsed_config_data["oracle_dbs"], parsed_config_data)
+            Utils._add_db_flags_to_oracle_dbs(parsed_config_data["oracle_dbs"], parsed_config_data,
+                                              Utils._parse_database_sections(cfg))
         
         return parsed_config_data
 
@@ -303,8 +531,9 @@ Version """ + __ver__ + """
             # Store results
             Utils.config = parsed_config_data
             Utils.config_host = parsed_host_data
-            logger.info(Utils.config)
-            logger.info(Utils.config_host)
+            logger.info("Config parsed: %d report keys, %d databases, host %s",
+                        len(Utils.config), len(Utils.config.get("oracle_dbs") or []),
+                        Utils.config_host["current_host"])
             return Utils.config
             
         except configparser.Error as e:
@@ -331,7 +560,44 @@ Version """ + __ver__ + """
                           action="store_false", default=False)
         parser.add_option("-f", "--file", dest="config_file", help="read configuration from given file",
                           default="config.cfg")
+        parser.add_option("--format", dest="format", type="choice", choices=["json", "ndjson"],
+                          help="additionally write machine-readable report: json or ndjson", default=None)
+        parser.add_option("-o", "--output", dest="output", help="file for --format output, - for stdout",
+                          default="-")
+        parser.add_option("--profile", dest="profile", action="store_true", default=False,
+                          help="write run timeline as chrome trace-event json into log directory")
+        parser.add_option("--cprofile", dest="cprofile", action="store_true", default=False,
+                          help="with --profile, also dump cProfile stats of the main thread")
+        parser.add_option("--push", dest="push", default=None,
+                          help="push per-database results to collector directory or host:port")
+        parser.add_option("--collect", dest="collect", default=None,
+                          help="collector mode: build consolidated report from payloads in directory")
+        parser.add_option("--listen", dest="listen", default=None,
+                          help="with --collect, receive payloads on host:port for collect_window seconds "
+                               "(localhost without host)")
+        parser.add_option("--full", dest="full", action="store_true", default=False,
+                          help="send full report also when report_mode = delta")
+        parser.add_option("--plan", dest="plan", action="store_true", default=False,
+                          help="print check plan of every database with critical-path estimate and exit")
+        parser.add_option("--record", dest="record", default=None,
+                          help="save raw result sets of all queries (gzip json) into directory for --replay")
+        parser.add_option("--replay", dest="replay", default=None,
+                          help="rebuild report from --record directory, no Oracle connection and no email")
+        parser.add_option("--summary", dest="summary", action="store_true", default=False,
+                          help="summary boxes and alerts only (minimal queries), email when the alert state changed")
         (options, args) = parser.parse_args()
         Utils.params["config_file"] = options.config_file
         Utils.params["verbose"] = options.verbose
+        Utils.params["format"] = options.format
+        Utils.params["output"] = options.output
+        Utils.params["profile"] = options.profile or options.cprofile
+        Utils.params["cprofile"] = options.cprofile
+        Utils.params["push"] = options.push
+        Utils.params["collect"] = options.collect
+        Utils.params["listen"] = options.listen
+        Utils.params["full"] = options.full
+        Utils.params["plan"] = options.plan
+        Utils.params["record"] = options.record
+        Utils.params["replay"] = options.replay
+        Utils.params["summary"] = options.summary
         logger.info(Utils.params)